@@ -2,6 +2,8 @@
 ASGI config for Entreefox project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+HTTP requests go to Django; websocket connections (``/ws/...``) go to the
+realtime consumers in ``backend.consumers``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
@@ -13,4 +15,18 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Entreefox.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported after Django is set up so the consumers can use the ORM
+from backend.consumers import websocket_application  # noqa: E402
+from backend.graph import graph  # noqa: E402
+
+# Load the follow graph behind /api/suggestions/ before requests need it
+graph.start()
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'websocket':
+        await websocket_application(scope, receive, send)
+    else:
+        await django_application(scope, receive, send)
@@ -42,6 +42,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'backend.instrumentation.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -74,10 +75,21 @@ WSGI_APPLICATION = 'Entreefox.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# Write transactions take SQLite's lock when they begin and wait up to
+# 'timeout' seconds for it, so concurrent requests queue instead of failing
+# with "database is locked". Tests use a file database as well, since the
+# default in-memory one cannot be shared by concurrent connections.
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
@@ -101,9 +113,128 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 REST_FRAMEWORK = {
+    # simplejwt's JWTAuthentication plus a short-lived user cache and a
+    # revocation list; see AUTH_CACHE below
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
-    )
+        'backend.authentication.CachedJWTAuthentication',
+    ),
+    # Keyset pagination on (created_at, id); see backend/pagination.py for
+    # the per-endpoint page sizes and hard maximums.
+    'DEFAULT_PAGINATION_CLASS': 'backend.pagination.KeysetPagination',
+    'PAGE_SIZE': 20,
+}
+
+# Token users are cached per process; revocations need a shared, non-evicting ALIAS cache (check --deploy)
+AUTH_CACHE = {
+    'ALIAS': 'revocations',
+    'USER_TTL': 30,
+    'MAX_USERS': 10000,
+}
+
+# Search
+# Post and user search index; backend.search.SimpleSearchBackend works on any
+# database, SQLiteFTSBackend needs the FTS5 tables from migration 0010.
+SEARCH_BACKEND = 'backend.search.SQLiteFTSBackend'
+
+# Realtime
+# Pub/sub broker behind the websocket endpoints in backend/consumers.py. The
+# in-process broker only reaches clients connected to the same process.
+REALTIME_BROKER = 'backend.realtime.InProcessBroker'
+
+# Notifications
+# Likes, follows and comments queue their notifications; a background worker
+# writes them in batches and coalesces like/follow bursts. Set ASYNC to False
+# to write inline, and JOURNAL_DIR to keep a local on-disk journal of queued
+# events that is replayed if a process dies before flushing.
+NOTIFICATION_PIPELINE = {
+    'ASYNC': True,
+    'BATCH_SIZE': 500,
+    'FLUSH_INTERVAL': 0.5,
+    'JOURNAL_DIR': None,
+}
+
+# Home feed
+# Timelines are materialized on write and capped per user; authors with at
+# least FEED_FANOUT_FOLLOWER_LIMIT followers are merged in at read time instead.
+# Fan-out does not trim; run the trim_feeds command periodically (e.g. from
+# cron) to cut timelines back to FEED_MAX_ENTRIES.
+FEED_MAX_ENTRIES = 800
+FEED_FANOUT_FOLLOWER_LIMIT = 10000
+
+# Suggestions
+# "Who to follow" is computed from an in-memory copy of the Follow table in
+# each process (backend/graph.py). It is reloaded in the background after
+# MAX_AGE seconds, so follows made through other processes show up, or once
+# REBUILD_AFTER local changes have piled up on top of it.
+SUGGESTIONS = {
+    'MAX_AGE': 600,
+    'REBUILD_AFTER': 100000,
+}
+
+# Trending
+# /api/posts/trending/ ranks posts by likes, comments and recency, each
+# weighted by WEIGHTS and losing half its weight every HALF_LIFE seconds.
+# Every process keeps the TOP_K hottest posts overall and per location, and
+# recomputes them from the last WINDOW seconds of activity every REFRESH
+# seconds (see backend/trending.py).
+TRENDING = {
+    'HALF_LIFE': 6 * 3600,
+    'WINDOW': 3 * 24 * 3600,
+    'REFRESH': 300,
+    'TOP_K': 500,
+    'WEIGHTS': {'post': 1.0, 'like': 1.0, 'comment': 3.0},
+}
+
+# Places
+# Every process keeps all places in memory for /api/places/ autocomplete and
+# /api/places/nearby/ (see backend/places.py), reloaded in the background
+# every REFRESH seconds to pick up places and counts from other processes.
+PLACES = {
+    'REFRESH': 300,
+}
+
+# Batch endpoints
+# Largest number of operations (or notification ids) accepted by one request
+# to the batch like, follow and mark-read endpoints.
+BATCH_MAX_OPERATIONS = 200
+
+# Per-process LRU caches; point BACKEND at Redis or Memcached to share them between workers
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'entreefox',
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'MAX_ENTRIES': 20000,
+            'CULL_FREQUENCY': 4,
+        },
+    },
+    # Token revocations (AUTH_CACHE), never culled
+    'revocations': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'entreefox-revocations',
+        'TIMEOUT': None,
+        'OPTIONS': {
+            'MAX_ENTRIES': 2 ** 62,
+        },
+    },
+}
+
+# Cached responses (backend/caching.py), invalidated on write; TIMEOUT only bounds memory
+RESPONSE_CACHE = {
+    'ALIAS': 'default',
+    'TIMEOUT': 300,
+    'LOCK_TIMEOUT': 10,
+    'LOCK_WAIT': 2.0,
+}
+
+# Per-view metrics at /api/_metrics (backend/instrumentation.py); SERVER_TIMING is 'staff', 'all' or 'none'
+INSTRUMENTATION = {
+    'ENABLED': True,
+    'SERVER_TIMING': 'staff',
+    'N_PLUS_ONE_THRESHOLD': 5,
+    'PROFILE_SAMPLE_RATE': 0.0,
+    'PROFILE_DIR': None,
 }
 
 # Internationalization
@@ -123,6 +254,29 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+# Uploaded media
+# Uploads have always been written relative to the project root
+# (posts/images/, posts/videos/, profile_pics/); renditions go to renditions/.
+MEDIA_ROOT = BASE_DIR
+MEDIA_URL = '/media/'
+
+# Background processing of uploads into resized WebP renditions and video
+# poster frames (see backend/media.py). Set ASYNC to False to process inline.
+MEDIA_PIPELINE = {
+    'ASYNC': True,
+    'WORKERS': 2,
+}
+
+# Resumable uploads for post videos: clients send the file in chunks of at
+# most MAX_CHUNK_SIZE bytes, written to TEMP_DIR under MEDIA_ROOT. The
+# expire_uploads command drops uploads idle for EXPIRE_AFTER seconds.
+CHUNKED_UPLOADS = {
+    'MAX_CHUNK_SIZE': 8 * 1024 * 1024,
+    'MAX_UPLOAD_SIZE': 2 * 1024 * 1024 * 1024,
+    'TEMP_DIR': 'uploads/tmp',
+    'EXPIRE_AFTER': 24 * 3600,
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Entreefox.settings')
 
 application = get_wsgi_application()
+
+# Load the follow graph behind /api/suggestions/ before requests need it
+from backend.graph import graph  # noqa: E402
+
+graph.start()
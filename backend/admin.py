@@ -15,15 +15,7 @@ class UserAdmin(admin.ModelAdmin):
     )
     search_fields = ('username', 'email')
     list_filter = ('is_staff', 'is_superuser')
-
-    def followers_count(self, obj):
-        return obj.followers.count()
-
-    def following_count(self, obj):
-        return obj.following.count()
-
-    followers_count.short_description = 'Followers'
-    following_count.short_description = 'Following'
+    readonly_fields = ('followers_count', 'following_count', 'posts_count')
 
 @admin.register(Follow)
 class FollowAdmin(admin.ModelAdmin):
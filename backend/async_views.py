@@ -0,0 +1,135 @@
+import asyncio
+import functools
+
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+from django.db.models import F
+from django.http import Http404, JsonResponse
+from rest_framework import status
+from rest_framework.exceptions import APIException, MethodNotAllowed, NotAuthenticated
+from rest_framework.request import Request
+
+from . import views
+from .authentication import CachedJWTAuthentication
+from .feed import aget_feed_queryset, get_feed_queryset
+from .models import Conversation, Notification, Post
+from .pagination import ConversationPagination, FeedPagination, NotificationPagination
+from .serializers import ConversationSerializer, NotificationSerializer, PostSerializer
+
+# Async versions of the hottest read endpoints, served natively by the ASGI
+# entry point (Entreefox/asgi.py). Queries go through the async ORM, so a
+# request waiting on the database does not hold a worker thread, and the
+# independent parts of /api/async/home/ run at the same time. Responses have
+# the same shape as the DRF views they mirror.
+
+authentication = CachedJWTAuthentication()
+
+
+def async_api_view(view):
+    # GET only, bearer token required, DRF exceptions rendered as DRF would
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        try:
+            if request.method != 'GET':
+                raise MethodNotAllowed(request.method)
+            result = await authentication.aauthenticate(request)
+            if result is None:
+                raise NotAuthenticated()
+            api_request = Request(request)
+            api_request.user, api_request.auth = result
+            data = await view(api_request, *args, **kwargs)
+        except Http404:
+            return JsonResponse({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+        except APIException as error:
+            data = error.detail if isinstance(error.detail, (list, dict)) else {'detail': error.detail}
+            response = JsonResponse(data, status=error.status_code, safe=False)
+            if error.status_code == status.HTTP_401_UNAUTHORIZED:
+                response['WWW-Authenticate'] = authentication.authenticate_header(request)
+            return response
+        return JsonResponse(data, safe=False)
+    return wrapper
+
+
+def branch(function, *args):
+    # Runs in a pool thread, which has its own database connections; they are
+    # released there, as request_finished would for a request thread
+    try:
+        return function(*args)
+    finally:
+        close_old_connections()
+
+
+async def concurrently(*calls):
+    # Async ORM calls made by one request share a single thread, so they
+    # would still run one after another. These (function, *args) calls run
+    # in pool threads at the same time instead.
+    return await asyncio.gather(*(
+        sync_to_async(branch, thread_sensitive=False)(*call) for call in calls
+    ))
+
+
+def page_data(paginator, rows, request, serializer_class):
+    return {
+        'next': paginator.get_next_link(),
+        'previous': paginator.get_previous_link(),
+        'results': serializer_class(rows, many=True, context={'request': request}).data,
+    }
+
+
+async def paginated(paginator, queryset, request, serializer_class):
+    rows = await paginator.apaginate_queryset(queryset, request)
+    return page_data(paginator, rows, request, serializer_class)
+
+
+async def feed_page(request):
+    queryset = (await aget_feed_queryset(request.user)).with_feed_annotations(request.user)
+    return await paginated(FeedPagination(), queryset, request, PostSerializer)
+
+
+def first_feed_page(request):
+    paginator = FeedPagination()
+    queryset = get_feed_queryset(request.user).with_feed_annotations(request.user)
+    return page_data(paginator, paginator.paginate_queryset(queryset, request), request, PostSerializer)
+
+
+def unread_count(user):
+    return Notification.objects.filter(recipient=user, is_read=False).count()
+
+
+@async_api_view
+async def feed(request):
+    return await feed_page(request)
+
+
+@async_api_view
+async def post_detail(request, pk):
+    post = await Post.objects.with_feed_annotations(request.user).filter(id=pk).afirst()
+    if post is None:
+        raise Http404
+    return PostSerializer(post, context={'request': request}).data
+
+
+@async_api_view
+async def notifications(request):
+    queryset = Notification.objects.filter(recipient=request.user).select_related('actor')
+    return await paginated(NotificationPagination(), queryset, request, NotificationSerializer)
+
+
+@async_api_view
+async def conversations(request):
+    queryset = (
+        Conversation.objects.filter(memberships__user=request.user)
+        .annotate(unread_count=F('memberships__unread_count'))
+        .select_related('last_message__sender')
+        .prefetch_related('participants')
+    )
+    return await paginated(ConversationPagination(), queryset, request, ConversationSerializer)
+
+
+@async_api_view
+async def home(request):
+    # What the app loads on launch, in one round trip: profile, unread count and the first feed page
+    profile, unread, feed = await concurrently(
+        (views.profile_data, request.user.id), (unread_count, request.user), (first_feed_page, request),
+    )
+    return {'profile': profile, 'unread_count': unread, 'feed': feed}
@@ -0,0 +1,161 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+
+
+def options():
+    return getattr(settings, 'AUTH_CACHE', {})
+
+
+class UserCache:
+    # Small in-process LRU of user rows with a short TTL, so that a burst of
+    # requests from one user costs a single SELECT. Other processes drop their
+    # copy when the TTL runs out; revocations go through the shared cache.
+    def __init__(self, ttl=30, max_size=10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._users = OrderedDict()
+
+    # Keyed by the id as a string, which is how simplejwt writes it into tokens
+    def get(self, user_id):
+        key = str(user_id)
+        with self._lock:
+            entry = self._users.get(key)
+            if entry is None:
+                return None
+            user, expires = entry
+            if expires < time.monotonic():
+                del self._users[key]
+                return None
+            self._users.move_to_end(key)
+        # Each request gets its own instance; views may modify request.user
+        return copy.copy(user)
+
+    def set(self, user):
+        with self._lock:
+            key = str(user.pk)
+            self._users[key] = (user, time.monotonic() + self.ttl)
+            self._users.move_to_end(key)
+            while len(self._users) > self.max_size:
+                self._users.popitem(last=False)
+
+    def discard(self, user_id):
+        with self._lock:
+            self._users.pop(str(user_id), None)
+
+    def clear(self):
+        with self._lock:
+            self._users.clear()
+
+
+user_cache = UserCache(ttl=options().get('USER_TTL', 30), max_size=options().get('MAX_USERS', 10000))
+
+
+# --- Revocation list, kept in a shared, non-evicting cache so every process sees it ---
+
+def revocation_cache():
+    return caches[options().get('ALIAS', 'revocations')]
+
+
+def revoke(token):
+    # Reject this token (access or refresh) until it would have expired anyway
+    remaining = int(token['exp'] - time.time())
+    if remaining > 0:
+        revocation_cache().set(f'revoked:{token[jwt_settings.JTI_CLAIM]}', True, remaining + 1)
+
+
+def revoke_user_tokens(user_id):
+    # Reject every token issued to the user so far, e.g. on deactivation. Kept
+    # as long as the longest-lived token could still be presented.
+    lifetime = int(jwt_settings.REFRESH_TOKEN_LIFETIME.total_seconds())
+    revocation_cache().set(f'revoked-before:{user_id}', time.time(), lifetime)
+    user_cache.discard(user_id)
+
+
+def revocation_keys(token):
+    return [f'revoked:{token.get(jwt_settings.JTI_CLAIM)}', f'revoked-before:{token.get(jwt_settings.USER_ID_CLAIM)}']
+
+
+def _revoked(token, keys, found):
+    if found.get(keys[0]):
+        return True
+    revoked_before = found.get(keys[1])
+    return revoked_before is not None and token.get('iat', 0) <= revoked_before
+
+
+def is_revoked(token):
+    keys = revocation_keys(token)
+    return _revoked(token, keys, revocation_cache().get_many(keys))
+
+
+async def ais_revoked(token):
+    keys = revocation_keys(token)
+    return _revoked(token, keys, await revocation_cache().aget_many(keys))
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    # JWTAuthentication without the per-request user SELECT: the signed token
+    # identifies the user and the row comes from the in-process cache.
+    # Revoked tokens are checked against the shared cache.
+
+    def get_user(self, validated_token):
+        user_id = self._user_id(validated_token)
+        if is_revoked(validated_token):
+            raise AuthenticationFailed(_("Token has been revoked"), code='token_revoked')
+        return self._cached_user(user_id) or self._load_user(validated_token)
+
+    # Async views authenticate without leaving the event loop unless the user
+    # is not cached. Only the signature check runs inline; it is CPU only.
+    async def aauthenticate(self, request):
+        header = self.get_header(request)
+        if header is None:
+            return None
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+        validated_token = self.get_validated_token(raw_token)
+        return await self.aget_user(validated_token), validated_token
+
+    async def aget_user(self, validated_token):
+        user_id = self._user_id(validated_token)
+        if await ais_revoked(validated_token):
+            raise AuthenticationFailed(_("Token has been revoked"), code='token_revoked')
+        return self._cached_user(user_id) or await sync_to_async(self._load_user)(validated_token)
+
+    def _user_id(self, validated_token):
+        try:
+            return validated_token[jwt_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+    def _cached_user(self, user_id):
+        user = user_cache.get(user_id)
+        if user is not None and jwt_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code='user_inactive')
+        return user
+
+    def _load_user(self, validated_token):
+        user = super().get_user(validated_token)
+        user_cache.set(copy.copy(user))
+        return user
+
+
+class RevocableTokenRefreshSerializer(TokenRefreshSerializer):
+    # Logged-out refresh tokens cannot mint new access tokens
+    def validate(self, attrs):
+        refresh = self.token_class(attrs['refresh'])
+        if is_revoked(refresh):
+            raise AuthenticationFailed(_("Token has been revoked"), code='token_revoked')
+        return super().validate(attrs)
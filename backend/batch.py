@@ -0,0 +1,167 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+
+from .caching import invalidate_on_commit, object_scope
+from .counters import forget_users, recount_posts, recount_users
+from .feed import backfill_authors, remove_authors
+from .graph import graph
+from .models import Follow, Like, Notification, Post, User
+from .notifications import notify
+from .relations import delete_rows, insert_ignore
+from .signals import publish_unread_count
+from .trending import trending
+
+# Batch versions of the like, follow and mark-read endpoints, for clients that
+# replay queued offline actions. Each batch is one transaction with a fixed
+# number of queries, whatever its size. Batches of one user are serialized on
+# that user's row, so the state read at the start holds until the single
+# INSERT and DELETE of each relation; if a toggle from outside a batch slips
+# in between, the row counts disagree and the counters are recounted.
+# Operations are (target_id, action) pairs; when a target appears more than
+# once the last operation wins, as if they had been sent one by one, and the
+# earlier ones are reported as 'superseded'.
+BATCH_MAX_OPERATIONS = getattr(settings, 'BATCH_MAX_OPERATIONS', 200)
+
+
+def _last_operations(operations):
+    # {target_id: action} for the last operation on each target
+    return {target_id: action for target_id, action in operations}
+
+
+def _results(operations, outcomes, key):
+    final = {target_id: index for index, (target_id, action) in enumerate(operations)}
+    return [
+        {key: target_id, 'action': action, 'status': outcomes[target_id] if final[target_id] == index else 'superseded'}
+        for index, (target_id, action) in enumerate(operations)
+    ]
+
+
+def _lock_user(user):
+    # Blocks other batches of this user until the transaction ends
+    list(User.objects.select_for_update().filter(id=user.id).values_list('id', flat=True))
+
+
+def _bump(model, pks, field, delta):
+    if pks:
+        model.objects.filter(id__in=pks).update(**{field: Greatest(F(field) + delta, Value(0))})
+
+
+def apply_likes(user, operations):
+    # operations: [(post_id, 'like' | 'unlike')]
+    wanted = _last_operations(operations)
+    with transaction.atomic():
+        _lock_user(user)
+        authors = dict(Post.objects.filter(id__in=wanted).values_list('id', 'author_id'))
+        liked = set(Like.objects.filter(user=user, post_id__in=authors).values_list('post_id', flat=True))
+
+        outcomes = {}
+        to_like, to_unlike = [], []
+        for post_id, action in wanted.items():
+            if post_id not in authors:
+                outcomes[post_id] = 'not_found'
+            elif action == 'like':
+                outcomes[post_id] = 'already_liked' if post_id in liked else 'liked'
+                if post_id not in liked:
+                    to_like.append(post_id)
+            else:
+                outcomes[post_id] = 'unliked' if post_id in liked else 'not_liked'
+                if post_id in liked:
+                    to_unlike.append(post_id)
+
+        inserted = insert_ignore([Like(user=user, post_id=post_id) for post_id in to_like])
+        deleted = delete_rows(Like.objects.filter(user=user, post_id__in=to_unlike)) if to_unlike else 0
+        if (inserted, deleted) == (len(to_like), len(to_unlike)):
+            _bump(Post, to_like, 'likes_count', 1)
+            _bump(Post, to_unlike, 'likes_count', -1)
+        else:
+            recount_posts(Post.objects.filter(id__in=to_like + to_unlike))
+        invalidate_on_commit(*[object_scope(Post, post_id) for post_id in to_like + to_unlike])
+        transaction.on_commit(lambda: [trending.record(post_id, 'like') for post_id in to_like])
+        for post_id in to_like:
+            if authors[post_id] != user.id:
+                notify(User(id=authors[post_id]), user, 'like', post=Post(id=post_id))
+    return _results(operations, outcomes, 'post_id')
+
+
+def apply_follows(user, operations):
+    # operations: [(user_id, 'follow' | 'unfollow')]
+    wanted = _last_operations(operations)
+    with transaction.atomic():
+        _lock_user(user)
+        targets = User.objects.only('id', 'followers_count').in_bulk(list(wanted))
+        following = set(Follow.objects.filter(follower=user, following_id__in=targets).values_list('following_id', flat=True))
+
+        outcomes = {}
+        to_follow, to_unfollow = [], []
+        for target_id, action in wanted.items():
+            if target_id not in targets:
+                outcomes[target_id] = 'not_found'
+            elif target_id == user.id:
+                outcomes[target_id] = 'invalid'
+            elif action == 'follow':
+                outcomes[target_id] = 'already_following' if target_id in following else 'followed'
+                if target_id not in following:
+                    to_follow.append(targets[target_id])
+            else:
+                outcomes[target_id] = 'unfollowed' if target_id in following else 'not_following'
+                if target_id in following:
+                    to_unfollow.append(targets[target_id])
+
+        followed_ids = [target.id for target in to_follow]
+        unfollowed_ids = [target.id for target in to_unfollow]
+        inserted = insert_ignore([Follow(follower=user, following=target) for target in to_follow])
+        deleted = delete_rows(Follow.objects.filter(follower=user, following_id__in=unfollowed_ids)) if to_unfollow else 0
+        changed = followed_ids + unfollowed_ids
+        if changed:
+            if (inserted, deleted) == (len(to_follow), len(to_unfollow)):
+                _bump(User, followed_ids, 'followers_count', 1)
+                _bump(User, unfollowed_ids, 'followers_count', -1)
+                _bump(User, [user.id], 'following_count', inserted - deleted)
+                forget_users([user.id] + changed)
+            else:
+                recount_users(User.objects.filter(id__in=[user.id] + changed))
+            invalidate_on_commit(
+                object_scope(User, user.id), f'following:{user.id}',
+                *[key for target_id in changed for key in (object_scope(User, target_id), f'followers:{target_id}')],
+            )
+            transaction.on_commit(lambda: _update_graph(user, followed_ids, unfollowed_ids))
+        for target in to_follow:
+            notify(target, user, 'follow')
+    # One backfill and one removal for the whole batch, as the toggles do after committing
+    if to_follow:
+        backfill_authors(user, to_follow)
+    if to_unfollow:
+        remove_authors(user, to_unfollow)
+    return _results(operations, outcomes, 'user_id')
+
+
+def _update_graph(user, followed_ids, unfollowed_ids):
+    for target_id in followed_ids:
+        graph.add(user.id, target_id)
+    for target_id in unfollowed_ids:
+        graph.remove(user.id, target_id)
+
+
+def mark_notifications_read(user, notification_ids=None):
+    # Marks the given notifications, or all of them, read with one UPDATE.
+    # Returns (updated, results); results is None when marking all.
+    with transaction.atomic():
+        if notification_ids is None:
+            updated = Notification.objects.filter(recipient=user, is_read=False).update(is_read=True)
+            results = None
+        else:
+            found = dict(Notification.objects.filter(recipient=user, id__in=notification_ids).values_list('id', 'is_read'))
+            unread = [notification_id for notification_id, is_read in found.items() if not is_read]
+            updated = Notification.objects.filter(id__in=unread, is_read=False).update(is_read=True) if unread else 0
+            results = [
+                {
+                    'id': notification_id,
+                    'status': 'not_found' if notification_id not in found else 'already_read' if found[notification_id] else 'read',
+                }
+                for notification_id in dict.fromkeys(notification_ids)
+            ]
+        if updated:
+            transaction.on_commit(lambda: publish_unread_count(user.id))
+    return updated, results
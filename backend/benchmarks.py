@@ -0,0 +1,555 @@
+import asyncio
+import io
+import json
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.db import close_old_connections, connection, connections, transaction
+from django.db.backends.signals import connection_created
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .counters import recount_posts, recount_users
+from .feed import trim_feeds
+from .models import (
+    Comment, Conversation, ConversationParticipant, FeedEntry, Follow, Like, Message, Notification, Post, User,
+)
+from .notifications import get_pipeline
+from .search import get_backend
+from .tags import index_posts
+
+BATCH_SIZE = 2000
+# SQLite's shared in-memory test database locks whole tables, which stalls the
+# background notification writer; benchmarks use a file instead
+SQLITE_DATABASE = os.path.join(settings.BASE_DIR, 'benchmarks', 'benchmark.sqlite3')
+
+
+# --- Synthetic data ---
+
+def zipf_weights(count, exponent=1.1):
+    # A few users attract most follows, likes and conversations, like a real social graph
+    return [1 / (rank + 1) ** exponent for rank in range(count)]
+
+
+def generate(users=1000, posts_per_user=10, follows_per_user=25, likes_per_post=5, comments_per_post=2,
+             conversations=300, messages_per_conversation=20, days=30, seed=1, log=None):
+    # Fill the current database with a reproducible data set using bulk inserts.
+    # Signals do not fire for bulk_create, so counters, timelines and the
+    # search index are rebuilt explicitly at the end.
+    rng = random.Random(seed)
+    log = log or (lambda message: None)
+    now = timezone.now()
+    password = make_password('benchmark')
+
+    def spread():
+        return now - timedelta(seconds=rng.uniform(0, days * 86400))
+
+    with transaction.atomic():
+        log(f"users: {users}")
+        user_objs = User.objects.bulk_create(
+            [User(username=f'bench{index}', email=f'bench{index}@example.com', password=password) for index in range(users)],
+            batch_size=BATCH_SIZE,
+        )
+        user_ids = [user.id for user in user_objs]
+        weights = zipf_weights(users)
+
+        follows = set()
+        for follower in user_ids:
+            # Out-degree is heavy-tailed too; a handful of users follow hundreds
+            degree = min(int(rng.paretovariate(1.5) * follows_per_user / 3), users - 1)
+            for following in rng.choices(user_ids, weights=weights, k=degree):
+                if following != follower:
+                    follows.add((follower, following))
+        log(f"follows: {len(follows)}")
+        Follow.objects.bulk_create([Follow(follower_id=a, following_id=b) for a, b in follows], batch_size=BATCH_SIZE)
+
+        posts = Post.objects.bulk_create(
+            [Post(author_id=rng.choice(user_ids), content=f'benchmark post {index} #bench')
+             for index in range(users * posts_per_user)],
+            batch_size=BATCH_SIZE,
+        )
+        # auto_now_add stamps every row with the same time; spread them out
+        for post in posts:
+            post.created_at = spread()
+        Post.objects.bulk_update(posts, ['created_at'], batch_size=BATCH_SIZE)
+        log(f"posts: {len(posts)}")
+
+        likes = {(rng.choice(user_ids), post.id) for post in posts for _ in range(rng.randint(0, likes_per_post * 2))}
+        Like.objects.bulk_create([Like(user_id=u, post_id=p) for u, p in likes], batch_size=BATCH_SIZE, ignore_conflicts=True)
+        comments = Comment.objects.bulk_create(
+            [Comment(post=post, author_id=rng.choice(user_ids), content='benchmark comment')
+             for post in posts for _ in range(rng.randint(0, comments_per_post * 2))],
+            batch_size=BATCH_SIZE,
+        )
+        log(f"likes: {len(likes)}, comments: {len(comments)}")
+
+        authors = {post.id: post.author_id for post in posts}
+        Notification.objects.bulk_create(
+            [Notification(recipient_id=authors[p], actor_id=u, notification_type='like', post_id=p, is_read=rng.random() < 0.8)
+             for u, p in likes if u != authors[p]],
+            batch_size=BATCH_SIZE,
+        )
+
+        conversation_objs = Conversation.objects.bulk_create([Conversation() for _ in range(conversations)], batch_size=BATCH_SIZE)
+        memberships, messages = [], []
+        for conversation in conversation_objs:
+            pair = rng.sample(user_ids, 2) if users > 1 else user_ids * 2
+            memberships += [ConversationParticipant(conversation=conversation, user_id=user_id) for user_id in pair]
+            messages += [Message(conversation=conversation, sender_id=rng.choice(pair), content='benchmark message', is_read=rng.random() < 0.9)
+                         for _ in range(messages_per_conversation)]
+        ConversationParticipant.objects.bulk_create(memberships, batch_size=BATCH_SIZE)
+        Message.objects.bulk_create(messages, batch_size=BATCH_SIZE)
+        latest = Message.objects.filter(conversation=OuterRef('pk')).order_by('-id').values('id')[:1]
+        Conversation.objects.update(last_message=Subquery(latest))
+        log(f"conversations: {conversations}, messages: {len(messages)}")
+
+        # Materialized timelines: every followed author's posts, trimmed to the cap
+        posts_by_author = {}
+        for post in posts:
+            posts_by_author.setdefault(post.author_id, []).append(post)
+        entries = [FeedEntry(user_id=follower, post_id=post.id, created_at=post.created_at)
+                   for follower, following in follows for post in posts_by_author.get(following, ())]
+        FeedEntry.objects.bulk_create(entries, batch_size=BATCH_SIZE, ignore_conflicts=True)
+        trim_feeds(user_ids)
+        log(f"feed entries: {len(entries)}")
+
+        recount_users(User.objects.filter(id__in=user_ids))
+        recount_posts(Post.objects.all())
+        backend = get_backend()
+        for start in range(0, users, BATCH_SIZE):
+            backend.index_users(user_objs[start:start + BATCH_SIZE])
+        for start in range(0, len(posts), BATCH_SIZE):
+            backend.index_posts(list(Post.objects.select_related('author').filter(id__in=[post.id for post in posts[start:start + BATCH_SIZE]])))
+            index_posts(posts[start:start + BATCH_SIZE])
+
+    return {'users': users, 'follows': len(follows), 'posts': len(posts), 'likes': len(likes), 'comments': len(comments),
+            'conversations': conversations, 'messages': len(messages)}
+
+
+@contextmanager
+def benchmark_database(users=1000, keepdb=False, log=None):
+    # A seeded database built like the test database, so the development data
+    # is never touched
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    log = log or (lambda message: None)
+    setup_test_environment()
+    old_name = connection.settings_dict['NAME']
+    if connection.vendor == 'sqlite':
+        os.makedirs(os.path.dirname(SQLITE_DATABASE), exist_ok=True)
+        connection.settings_dict['TEST']['NAME'] = SQLITE_DATABASE
+        # Take the write lock up front and wait for it, instead of failing
+        # when concurrent requests upgrade read transactions
+        connection.settings_dict['OPTIONS'] = {
+            **connection.settings_dict.get('OPTIONS', {}),
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        }
+        connection.close()
+    connection.creation.create_test_db(verbosity=0, keepdb=keepdb)
+    try:
+        if not User.objects.exists():
+            log("Seeding benchmark data...")
+            generate(users=users, log=lambda message: log(f"  {message}"))
+        cache.clear()
+        yield
+    finally:
+        # Queued notifications must land before their tables go away
+        get_pipeline().flush()
+        connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=keepdb)
+        teardown_test_environment()
+
+
+# --- Scenarios ---
+
+@dataclass
+class Scenario:
+    # One endpoint hit as a random benchmark user; weight sets its share of the mixed load
+    name: str
+    method: str
+    path: str
+    weight: int = 1
+
+    def url(self, context):
+        return self.path.format(**context)
+
+
+SCENARIOS = [
+    Scenario('feed', 'get', '/api/feed/', weight=10),
+    Scenario('posts', 'get', '/api/posts/', weight=5),
+    Scenario('post_detail', 'get', '/api/posts/{post_id}/', weight=5),
+    Scenario('tag_timeline', 'get', '/api/tags/bench/', weight=2),
+    Scenario('notifications', 'get', '/api/notifications/', weight=4),
+    Scenario('unread_count', 'get', '/api/notifications/unread-count/', weight=4),
+    Scenario('conversations', 'get', '/api/conversations/', weight=3),
+    Scenario('like_toggle', 'post', '/api/posts/{post_id}/like/', weight=2),
+    Scenario('follow_toggle', 'post', '/api/follow/{other_id}/', weight=1),
+]
+
+
+class Sampler:
+    # Random request contexts drawn from the seeded data. Requests carry real
+    # access tokens so authentication is part of what is measured.
+    def __init__(self, seed=2):
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.users = {user.id: user for user in User.objects.order_by('id')}
+        self.user_ids = list(self.users)
+        self.post_ids = list(Post.objects.order_by('id').values_list('id', flat=True))
+        self.tokens = {}
+
+    def context(self):
+        with self.lock:
+            user_id, other_id = self.rng.sample(self.user_ids, 2)
+            if user_id not in self.tokens:
+                self.tokens[user_id] = str(AccessToken.for_user(self.users[user_id]))
+            return {'user_id': user_id, 'other_id': other_id, 'post_id': self.rng.choice(self.post_ids), 'token': self.tokens[user_id]}
+
+
+class QueryCounter:
+    # execute_wrapper that counts the statements run on this thread's connection
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def request(client, scenario, context):
+    client.credentials(HTTP_AUTHORIZATION=f"Bearer {context['token']}")
+    queries = QueryCounter()
+    with connection.execute_wrapper(queries):
+        started = time.perf_counter()
+        response = getattr(client, scenario.method)(scenario.url(context))
+        elapsed = time.perf_counter() - started
+    if response.status_code >= 400:
+        raise RuntimeError(f"{scenario.name}: HTTP {response.status_code} for {scenario.url(context)}")
+    return elapsed, queries.count
+
+
+def summarize(latencies, queries, wall_time):
+    cuts = statistics.quantiles(latencies, n=100, method='inclusive') if len(latencies) > 1 else latencies * 99
+    return {
+        'requests': len(latencies),
+        'p50_ms': round(cuts[49] * 1000, 3),
+        'p95_ms': round(cuts[94] * 1000, 3),
+        'p99_ms': round(cuts[98] * 1000, 3),
+        'queries_per_request': round(sum(queries) / len(queries), 2),
+        'max_queries': max(queries),
+        'throughput_rps': round(len(latencies) / wall_time, 1) if wall_time else None,
+    }
+
+
+def run_scenario(scenario, sampler, requests=200, warmup=20):
+    # Sequential requests against one endpoint
+    client = APIClient()
+    for _ in range(warmup):
+        request(client, scenario, sampler.context())
+    latencies, queries = [], []
+    started = time.perf_counter()
+    for _ in range(requests):
+        elapsed, count = request(client, scenario, sampler.context())
+        latencies.append(elapsed)
+        queries.append(count)
+    return summarize(latencies, queries, time.perf_counter() - started)
+
+
+def run_mixed(scenarios, sampler, requests=1000, concurrency=4):
+    # Locust-style mixed load: worker threads pick scenarios by weight
+    weights = [scenario.weight for scenario in scenarios]
+    latencies, queries, errors = [], [], []
+    lock = threading.Lock()
+    remaining = [requests]
+
+    def worker(seed):
+        rng = random.Random(seed)
+        client = APIClient()
+        try:
+            while True:
+                with lock:
+                    if remaining[0] <= 0:
+                        return
+                    remaining[0] -= 1
+                scenario = rng.choices(scenarios, weights=weights)[0]
+                try:
+                    elapsed, count = request(client, scenario, sampler.context())
+                except Exception as error:
+                    with lock:
+                        errors.append(str(error))
+                    continue
+                with lock:
+                    latencies.append(elapsed)
+                    queries.append(count)
+        finally:
+            close_old_connections()
+
+    threads = [threading.Thread(target=worker, args=(seed,)) for seed in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    result = summarize(latencies, queries, time.perf_counter() - started) if latencies else {'requests': 0}
+    result['concurrency'] = concurrency
+    result['errors'] = len(errors)
+    return result
+
+
+# --- Baselines ---
+
+def compare(results, baseline, tolerance=0.25):
+    # Regressions against a stored baseline: slower p95 beyond the tolerance,
+    # or more queries per request than before
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if not previous or not current.get('requests'):
+            continue
+        if current['p95_ms'] > previous['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {previous['p95_ms']}ms -> {current['p95_ms']}ms")
+        if current['queries_per_request'] > previous['queries_per_request'] + 0.5:
+            regressions.append(f"{name}: queries/request {previous['queries_per_request']} -> {current['queries_per_request']}")
+    return regressions
+
+
+def load_baseline(path):
+    with open(path, encoding='utf-8') as file:
+        return json.load(file)
+
+
+def save_baseline(path, report):
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(report, file, indent=2, sort_keys=True)
+        file.write('\n')
+
+
+# --- Token verification ---
+
+def run_auth_benchmark(iterations=2000, users=50):
+    # Per-request cost of authenticating a bearer token: signature check only,
+    # simplejwt's JWTAuthentication (one user SELECT each) and the cached path
+    from django.test import RequestFactory
+    from rest_framework.request import Request
+    from rest_framework_simplejwt.authentication import JWTAuthentication
+
+    from .authentication import CachedJWTAuthentication, user_cache
+
+    factory = RequestFactory()
+    tokens = [str(AccessToken.for_user(user)) for user in User.objects.order_by('id')[:users]]
+    requests = [Request(factory.get('/', HTTP_AUTHORIZATION=f'Bearer {token}')) for token in tokens]
+    user_cache.clear()
+
+    def measure(authenticate):
+        timings = []
+        queries = QueryCounter()
+        with connection.execute_wrapper(queries):
+            for index in range(iterations):
+                started = time.perf_counter()
+                authenticate(requests[index % len(requests)])
+                timings.append(time.perf_counter() - started)
+        result = summarize(timings, [queries.count / iterations], sum(timings))
+        result['mean_us'] = round(statistics.fmean(timings) * 1e6, 1)
+        return result
+
+    return {
+        'signature_only': measure(lambda request: AccessToken(request.META['HTTP_AUTHORIZATION'].split()[1])),
+        'jwt_authentication': measure(JWTAuthentication().authenticate),
+        'cached_jwt_authentication': measure(CachedJWTAuthentication().authenticate),
+    }
+
+
+# --- WSGI vs ASGI ---
+
+@dataclass
+class ServerScenario:
+    # The same data read through the sync views on Entreefox/wsgi.py and the
+    # async views on Entreefox/asgi.py. A sync "request" may take several calls
+    # made one after another, as a client without the combined endpoint would.
+    name: str
+    sync_paths: list
+    async_paths: list
+
+
+SERVER_SCENARIOS = [
+    ServerScenario('feed', ['/api/feed/'], ['/api/async/feed/']),
+    ServerScenario('post_detail', ['/api/posts/{post_id}/'], ['/api/async/posts/{post_id}/']),
+    ServerScenario('notifications', ['/api/notifications/'], ['/api/async/notifications/']),
+    ServerScenario('conversations', ['/api/conversations/'], ['/api/async/conversations/']),
+    ServerScenario('home', ['/api/profile/', '/api/notifications/unread-count/', '/api/feed/'], ['/api/async/home/']),
+]
+
+
+class DatabaseProbe:
+    # execute_wrapper for every connection the servers open: counts statements
+    # and optionally sleeps per statement, standing in for the network round
+    # trip to a database server that SQLite does not have
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self.lock:
+            self.count += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return execute(sql, params, many, context)
+
+    def install(self, sender, connection, **kwargs):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+    @contextmanager
+    def installed(self):
+        connection_created.connect(self.install)
+        # This thread's connection may already be open
+        for existing in connections.all(initialized_only=True):
+            self.install(None, existing)
+        try:
+            yield self
+        finally:
+            connection_created.disconnect(self.install)
+            for existing in connections.all(initialized_only=True):
+                if self in existing.execute_wrappers:
+                    existing.execute_wrappers.remove(self)
+
+
+def split_path(path):
+    path, _, query = path.partition('?')
+    return path, query
+
+
+def wsgi_get(application, path, token):
+    # One GET through the WSGI callable, as a threaded WSGI server would make it
+    path, query = split_path(path)
+    environ = {
+        'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query, 'SCRIPT_NAME': '',
+        'SERVER_NAME': 'testserver', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1', 'REMOTE_ADDR': '127.0.0.1',
+        'HTTP_HOST': 'testserver', 'HTTP_AUTHORIZATION': f'Bearer {token}',
+        'wsgi.version': (1, 0), 'wsgi.url_scheme': 'http', 'wsgi.input': io.BytesIO(), 'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True, 'wsgi.multiprocess': False, 'wsgi.run_once': False,
+    }
+    statuses = []
+    response = application(environ, lambda status, headers, exc_info=None: statuses.append(status))
+    try:
+        b''.join(response)
+    finally:
+        # Fires request_finished, which returns the thread's connection
+        response.close()
+    status = int(statuses[0].split()[0])
+    if status >= 400:
+        raise RuntimeError(f"WSGI: HTTP {status} for {path}")
+
+
+async def asgi_get(application, path, token):
+    # One GET through the ASGI callable, as an ASGI server would make it
+    path, query = split_path(path)
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+        'path': path, 'raw_path': path.encode(), 'query_string': query.encode(), 'root_path': '',
+        'headers': [(b'host', b'testserver'), (b'authorization', f'Bearer {token}'.encode())],
+        'client': ('127.0.0.1', 0), 'server': ('testserver', 80),
+    }
+    body = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+
+    async def receive():
+        if body:
+            return body.pop()
+        # The client stays connected; Django cancels this once it has responded
+        await asyncio.Event().wait()
+
+    statuses = []
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            statuses.append(message['status'])
+
+    await application(scope, receive, send)
+    if statuses[0] >= 400:
+        raise RuntimeError(f"ASGI: HTTP {statuses[0]} for {path}")
+
+
+def run_wsgi(scenario, contexts, concurrency, threads):
+    # `concurrency` clients, each sending its next request when the last one
+    # returns, served by a fixed pool of worker threads like gunicorn --threads
+    from Entreefox.wsgi import application
+
+    def serve(context):
+        for path in scenario.sync_paths:
+            wsgi_get(application, path.format(**context), context['token'])
+
+    queue = iter(contexts)
+    lock = threading.Lock()
+    latencies = []
+
+    def client(pool):
+        while True:
+            with lock:
+                context = next(queue, None)
+            if context is None:
+                return
+            started = time.perf_counter()
+            pool.submit(serve, context).result()
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads, thread_name_prefix='wsgi') as pool:
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='client') as clients:
+            for future in [clients.submit(client, pool) for _ in range(concurrency)]:
+                future.result()
+    return latencies, time.perf_counter() - started
+
+
+def run_asgi(scenario, contexts, concurrency, threads=None):
+    # The same clients against one event loop; there is no worker pool to wait for
+    from Entreefox.asgi import application
+
+    async def main():
+        queue = iter(contexts)
+        latencies = []
+
+        async def client():
+            for context in queue:
+                started = time.perf_counter()
+                for path in scenario.async_paths:
+                    await asgi_get(application, path.format(**context), context['token'])
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+        return latencies, time.perf_counter() - started
+
+    return asyncio.run(main())
+
+
+def run_server_benchmark(sampler, scenarios=SERVER_SCENARIOS, requests=200, concurrency=64, wsgi_threads=8,
+                         db_latency=0.0, warmup=10):
+    # {scenario: {'wsgi': summary, 'asgi': summary}} for the same requests from
+    # the same number of clients. Latency includes waiting for a WSGI worker.
+    # Queries per request are averaged over the run.
+    results = {}
+    for scenario in scenarios:
+        contexts = [sampler.context() for _ in range(requests)]
+        results[scenario.name] = {}
+        for server, run in (('wsgi', run_wsgi), ('asgi', run_asgi)):
+            run(scenario, contexts[:warmup], concurrency, wsgi_threads)
+            with DatabaseProbe(db_latency).installed() as probe:
+                latencies, wall_time = run(scenario, contexts, concurrency, wsgi_threads)
+            results[scenario.name][server] = summarize(latencies, [probe.count / len(latencies)], wall_time)
+    return results
@@ -0,0 +1,154 @@
+import hashlib
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+# Read-through cache for hot read endpoints. Entries are keyed by a version
+# per scope (one post, one user, the public post list, ...). Writes bump the
+# version instead of deleting keys, so a reader that loaded rows just before
+# a write stores them under the old version and never serves them again.
+
+MISSING = object()
+
+
+def options():
+    return getattr(settings, 'RESPONSE_CACHE', {})
+
+
+def get_cache():
+    return caches[options().get('ALIAS', 'default')]
+
+
+class Stats:
+    # Hit/miss counters per namespace, for this process
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = Counter()
+        self.misses = Counter()
+
+    def record(self, namespace, hits=0, misses=0):
+        with self._lock:
+            self.hits[namespace] += hits
+            self.misses[namespace] += misses
+
+    def snapshot(self):
+        with self._lock:
+            namespaces = sorted(set(self.hits) | set(self.misses))
+            result = {}
+            for namespace in namespaces:
+                hits, misses = self.hits[namespace], self.misses[namespace]
+                result[namespace] = {
+                    'hits': hits,
+                    'misses': misses,
+                    'hit_ratio': round(hits / (hits + misses), 4) if hits + misses else None,
+                }
+            return result
+
+    def reset(self):
+        with self._lock:
+            self.hits.clear()
+            self.misses.clear()
+
+
+stats = Stats()
+
+
+def object_scope(model, pk):
+    return f'{model._meta.model_name}:{pk}'
+
+
+def versions(scopes):
+    cache = get_cache()
+    keys = {scope: f'version:{scope}' for scope in scopes}
+    found = cache.get_many(keys.values())
+    result = {}
+    for scope, key in keys.items():
+        value = found.get(key)
+        if value is None:
+            # An evicted version must not revive entries written under an older one
+            value = time.time_ns()
+            if not cache.add(key, value, None):
+                value = cache.get(key, value)
+        result[scope] = value
+    return result
+
+
+def invalidate(*scopes):
+    cache = get_cache()
+    for scope in scopes:
+        try:
+            cache.incr(f'version:{scope}')
+        except ValueError:
+            # No version stored: the next reader starts a fresh one
+            pass
+
+
+def invalidate_on_commit(*scopes):
+    transaction.on_commit(lambda: invalidate(*scopes))
+
+
+def variant_key(*parts):
+    # Request-dependent part of a key (host, query string), kept short and key-safe
+    return hashlib.md5('|'.join(str(part) for part in parts).encode()).hexdigest()
+
+
+def entry_key(namespace, scope, version, variant=''):
+    return f'{namespace}:{scope}:{version}:{variant}'
+
+
+def get_or_set(namespace, scope, compute, variant='', timeout=None):
+    cache = get_cache()
+    key = entry_key(namespace, scope, versions([scope])[scope], variant)
+    value = cache.get(key, MISSING)
+    if value is not MISSING:
+        stats.record(namespace, hits=1)
+        return value
+    stats.record(namespace, misses=1)
+    return fill(cache, key, compute, timeout)
+
+
+def fill(cache, key, compute, timeout=None):
+    # Only one worker recomputes a missing entry; the others wait briefly for
+    # its result instead of all hitting the database at once
+    if timeout is None:
+        timeout = options().get('TIMEOUT', 60)
+    lock_key = f'lock:{key}'
+    if cache.add(lock_key, 1, options().get('LOCK_TIMEOUT', 10)):
+        try:
+            value = compute()
+            cache.set(key, value, timeout)
+            return value
+        finally:
+            cache.delete(lock_key)
+
+    deadline = time.monotonic() + options().get('LOCK_WAIT', 2.0)
+    while time.monotonic() < deadline:
+        time.sleep(0.02)
+        value = cache.get(key, MISSING)
+        if value is not MISSING:
+            return value
+    # The lock holder is slow or gone; compute without caching
+    return compute()
+
+
+def get_many(namespace, scopes, compute_many, variant='', timeout=None):
+    # Batch lookup for list pages: compute_many(missing_scopes) returns
+    # {scope: value} for the scopes it found; the rest are left out
+    if timeout is None:
+        timeout = options().get('TIMEOUT', 60)
+    cache = get_cache()
+    scope_versions = versions(scopes)
+    keys = {scope: entry_key(namespace, scope, scope_versions[scope], variant) for scope in scopes}
+    found = cache.get_many(keys.values())
+    result = {scope: found[key] for scope, key in keys.items() if key in found}
+    missing = [scope for scope in scopes if scope not in result]
+    stats.record(namespace, hits=len(result), misses=len(missing))
+    if missing:
+        computed = compute_many(missing)
+        cache.set_many({keys[scope]: value for scope, value in computed.items()}, timeout)
+        result.update(computed)
+    return result
@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+
+from .authentication import options
+
+# Cache backends whose entries only exist in the process that wrote them
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+# A deployment check, since the test runner turns DEBUG off for every run
+@register(Tags.caches, deploy=True)
+def check_revocation_cache(app_configs, **kwargs):
+    # A token revoked through one process has to be rejected by all of them
+    alias = options().get('ALIAS', 'revocations')
+    backend = settings.CACHES.get(alias, {}).get('BACKEND')
+    if settings.DEBUG or backend not in PROCESS_LOCAL_CACHES:
+        return []
+    return [Error(
+        f"The token revocation cache '{alias}' uses {backend}, which is not shared between processes.",
+        hint="Point it at a shared cache that does not evict entries early, e.g. Redis with maxmemory-policy noeviction.",
+        obj=f"CACHES['{alias}']",
+        id='backend.E001',
+    )]
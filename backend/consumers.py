@@ -0,0 +1,208 @@
+import asyncio
+import json
+import re
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .authentication import is_revoked
+from .messaging import conversation_topic, mark_read, send_message
+from .models import Conversation, Message, Notification, User
+from .realtime import get_broker, user_topic
+
+# Cap on messages replayed to a reconnecting client; older gaps are paged over REST
+RESUME_LIMIT = 500
+# Read receipts from a socket are written at most once per interval
+READ_FLUSH_INTERVAL = 1.0
+
+
+class WebSocket:
+    # Thin wrapper over the raw ASGI websocket protocol
+    def __init__(self, scope, receive, send):
+        self.scope = scope
+        self._receive = receive
+        self._send = send
+        self.query = parse_qs(scope.get('query_string', b'').decode())
+
+    async def accept(self):
+        await self._send({'type': 'websocket.accept'})
+
+    async def close(self, code=1000):
+        await self._send({'type': 'websocket.close', 'code': code})
+
+    async def send_json(self, data):
+        await self._send({'type': 'websocket.send', 'text': json.dumps(data, default=str)})
+
+    async def receive_json(self):
+        # Next JSON object from the client, or None once it disconnects.
+        # Frames that are not JSON objects are ignored.
+        while True:
+            message = await self._receive()
+            if message['type'] == 'websocket.disconnect':
+                return None
+            if message['type'] != 'websocket.receive':
+                continue
+            try:
+                data = json.loads(message.get('text') or message.get('bytes') or 'null')
+            except ValueError:
+                continue
+            if isinstance(data, dict):
+                return data
+
+    def param(self, name):
+        values = self.query.get(name)
+        return values[0] if values else None
+
+
+async def authenticate(socket):
+    # Sockets authenticate with the same access token as the REST API (?token=...)
+    raw_token = socket.param('token')
+    if not raw_token:
+        return None
+    try:
+        token = AccessToken(raw_token)
+    except TokenError:
+        return None
+    if await sync_to_async(is_revoked)(token):
+        return None
+    return await User.objects.filter(id=token[jwt_settings.USER_ID_CLAIM], is_active=True).afirst()
+
+
+async def forward(socket, subscription, on_message=None, skip=None):
+    # Relay published messages to the client until it disconnects
+    async def reader():
+        while True:
+            data = await socket.receive_json()
+            if data is None:
+                return
+            if on_message is not None:
+                await on_message(data)
+
+    async def writer():
+        async for message in subscription:
+            if skip is None or not skip(message):
+                await socket.send_json(message)
+
+    tasks = [asyncio.ensure_future(reader()), asyncio.ensure_future(writer())]
+    try:
+        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            task.result()
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def notifications_socket(socket, user):
+    # Pushes new notifications and the unread count to the recipient
+    subscription = get_broker().subscribe(user_topic(user.id))
+    try:
+        unread = await Notification.objects.filter(recipient=user, is_read=False).acount()
+        await socket.send_json({'type': 'unread_count', 'unread_count': unread})
+        await forward(socket, subscription)
+    finally:
+        subscription.close()
+
+
+async def conversation_socket(socket, user, conversation_id):
+    # Per-conversation channel: new messages, typing indicators and read receipts
+    conversation = await Conversation.objects.filter(id=conversation_id, participants=user).afirst()
+    if conversation is None:
+        await socket.close(code=4404)
+        return
+
+    subscription = get_broker().subscribe(conversation_topic(conversation.id))
+    read_up_to = None
+
+    async def flush_reads():
+        nonlocal read_up_to
+        if read_up_to is not None:
+            up_to_id, read_up_to = read_up_to, None
+            await sync_to_async(mark_read)(conversation, user, up_to_id)
+
+    async def flush_periodically():
+        while True:
+            await asyncio.sleep(READ_FLUSH_INTERVAL)
+            await flush_reads()
+
+    async def on_message(data):
+        nonlocal read_up_to
+        event = data.get('type')
+        if event == 'message' and data.get('content'):
+            await sync_to_async(send_message)(conversation, user, str(data['content']))
+        elif event == 'typing':
+            # Typing indicators are ephemeral and never touch the database
+            get_broker().publish(conversation_topic(conversation.id), {'type': 'typing', 'user_id': user.id, 'user': user.username})
+        elif event == 'read':
+            try:
+                message_id = int(data['message_id'])
+            except (KeyError, TypeError, ValueError, OverflowError):
+                return
+            # Receipts are coalesced and written in one UPDATE per interval
+            read_up_to = max(read_up_to or 0, message_id)
+
+    def own_typing(message):
+        return message.get('type') == 'typing' and message.get('user_id') == user.id
+
+    flusher = asyncio.ensure_future(flush_periodically())
+    try:
+        await resume(socket, conversation, socket.param('last_id'))
+        await forward(socket, subscription, on_message=on_message, skip=own_typing)
+    finally:
+        flusher.cancel()
+        subscription.close()
+        await flush_reads()
+
+
+async def resume(socket, conversation, last_id):
+    # Replay only the messages the client has not seen yet
+    try:
+        last_id = int(last_id)
+    except (TypeError, ValueError):
+        return
+    messages = Message.objects.filter(conversation=conversation, id__gt=last_id).select_related('sender').order_by('id')
+    missed = [message async for message in messages[:RESUME_LIMIT + 1]]
+    has_more = len(missed) > RESUME_LIMIT
+    await socket.send_json({
+        'type': 'resume',
+        'messages': [serialize_message(message) for message in missed[:RESUME_LIMIT]],
+        'has_more': has_more,
+    })
+
+
+def serialize_message(message):
+    from .serializers import MessageSerializer
+
+    return MessageSerializer(message).data
+
+
+routes = [
+    (re.compile(r'^/ws/notifications/$'), notifications_socket),
+    (re.compile(r'^/ws/conversations/(?P<conversation_id>\d+)/$'), conversation_socket),
+]
+
+
+async def websocket_application(scope, receive, send):
+    socket = WebSocket(scope, receive, send)
+    message = await receive()
+    if message['type'] != 'websocket.connect':
+        return
+
+    for pattern, handler in routes:
+        match = pattern.match(scope['path'])
+        if match:
+            break
+    else:
+        await socket.close(code=4404)
+        return
+
+    user = await authenticate(socket)
+    if user is None:
+        await socket.close(code=4401)
+        return
+
+    await socket.accept()
+    await handler(socket, user, **match.groupdict())
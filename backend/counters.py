@@ -0,0 +1,83 @@
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+
+from .authentication import user_cache
+from .caching import invalidate, object_scope
+from .models import Comment, Follow, Like, Place, Post, User
+
+
+def adjust(model, pk, **deltas):
+    # Atomically add deltas to counter columns in a single UPDATE, never dropping below zero
+    changes = {field: Greatest(F(field) + delta, Value(0)) for field, delta in deltas.items()}
+    model.objects.filter(pk=pk).update(**changes)
+    if model is User:
+        forget_users([pk])
+
+
+def forget_users(user_ids):
+    # UPDATEs send no post_save, so drop the rows cached for authentication
+    # here; again on commit, in case a request reloaded the old row meanwhile
+    def discard():
+        for user_id in user_ids:
+            user_cache.discard(user_id)
+
+    discard()
+    transaction.on_commit(discard)
+
+
+def _count_of(queryset, field):
+    counts = queryset.filter(**{field: OuterRef('pk')}).order_by().values(field).annotate(n=Count('*')).values('n')
+    return Coalesce(Subquery(counts), Value(0))
+
+
+def recount_users(queryset):
+    # Recompute the user counters for the given users; returns how many rows had drifted
+    fresh = queryset.annotate(
+        real_followers=_count_of(Follow.objects.all(), 'following'),
+        real_following=_count_of(Follow.objects.all(), 'follower'),
+        real_posts=_count_of(Post.objects.all(), 'author'),
+    )
+    drifted = []
+    for user in fresh.only('id', 'followers_count', 'following_count', 'posts_count'):
+        if (user.followers_count, user.following_count, user.posts_count) != (user.real_followers, user.real_following, user.real_posts):
+            user.followers_count = user.real_followers
+            user.following_count = user.real_following
+            user.posts_count = user.real_posts
+            drifted.append(user)
+    User.objects.bulk_update(drifted, ['followers_count', 'following_count', 'posts_count'])
+    forget_users([user.id for user in drifted])
+    invalidate(*[object_scope(User, user.id) for user in drifted])
+    return len(drifted)
+
+
+def recount_posts(queryset):
+    # Recompute the post counters for the given posts; returns how many rows had drifted
+    fresh = queryset.annotate(
+        real_likes=_count_of(Like.objects.all(), 'post'),
+        real_comments=_count_of(Comment.objects.all(), 'post'),
+    )
+    drifted = []
+    for post in fresh.only('id', 'likes_count', 'comments_count'):
+        if (post.likes_count, post.comments_count) != (post.real_likes, post.real_comments):
+            post.likes_count = post.real_likes
+            post.comments_count = post.real_comments
+            drifted.append(post)
+    Post.objects.bulk_update(drifted, ['likes_count', 'comments_count'])
+    invalidate(*[object_scope(Post, post.id) for post in drifted])
+    return len(drifted)
+
+
+def recount_places(queryset):
+    # Recompute posts_count for the given places; returns how many rows had drifted
+    drifted = []
+    for place in queryset.annotate(real_posts=_count_of(Post.objects.all(), 'place')).only('id', 'posts_count'):
+        if place.posts_count != place.real_posts:
+            place.posts_count = place.real_posts
+            drifted.append(place)
+    Place.objects.bulk_update(drifted, ['posts_count'])
+    return len(drifted)
+
+
+def refresh_place_counts(place_ids):
+    Place.objects.filter(id__in=place_ids).update(posts_count=_count_of(Post.objects.all(), 'place'))
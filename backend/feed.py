@@ -0,0 +1,113 @@
+from django.conf import settings
+from django.db.models import Count, Q
+
+from .models import FeedEntry, Follow, Post, User
+
+# Home timelines are materialized on write (fan-out-on-write). Authors with a
+# very large audience are skipped on write and merged in on read instead, so a
+# single post never has to touch millions of timelines.
+#
+# Readers only ever see the newest FEED_MAX_ENTRIES rows of a timeline, so
+# fan-out does not trim; timelines are cut back by the trim_feeds command,
+# run periodically, and after backfills.
+FEED_MAX_ENTRIES = getattr(settings, 'FEED_MAX_ENTRIES', 800)
+FEED_FANOUT_FOLLOWER_LIMIT = getattr(settings, 'FEED_FANOUT_FOLLOWER_LIMIT', 10000)
+FEED_BATCH_SIZE = 1000
+
+
+def is_fanout_author(author):
+    # True if the author's posts are pushed into follower timelines
+    return author.followers_count < FEED_FANOUT_FOLLOWER_LIMIT
+
+
+def fan_out_post(post):
+    # Push a new post into the timeline of every follower of its author
+    if not is_fanout_author(post.author):
+        return
+
+    follower_ids = list(Follow.objects.filter(following_id=post.author_id).values_list('follower_id', flat=True))
+    FeedEntry.objects.bulk_create(
+        [FeedEntry(user_id=follower_id, post=post, created_at=post.created_at) for follower_id in follower_ids],
+        batch_size=FEED_BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
+
+def backfill_author(user, author):
+    # Copy the author's recent posts into the user's timeline after a follow
+    backfill_authors(user, [author])
+
+
+def backfill_authors(user, authors):
+    # Same for several newly followed authors at once. Only the newest
+    # FEED_MAX_ENTRIES posts across them can survive trimming.
+    author_ids = [author.id for author in authors if is_fanout_author(author)]
+    if not author_ids:
+        return
+
+    posts = Post.objects.filter(author_id__in=author_ids).order_by('-created_at').values_list('id', 'created_at')[:FEED_MAX_ENTRIES]
+    FeedEntry.objects.bulk_create(
+        [FeedEntry(user=user, post_id=post_id, created_at=created_at) for post_id, created_at in posts],
+        batch_size=FEED_BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+    trim_feeds([user.id])
+
+
+def remove_author(user, author):
+    # Drop the author's posts from the user's timeline after an unfollow
+    remove_authors(user, [author])
+
+
+def remove_authors(user, authors):
+    FeedEntry.objects.filter(user=user, post__author__in=authors).delete()
+
+
+def trim_feeds(user_ids):
+    # Keep at most FEED_MAX_ENTRIES rows (plus ties) per timeline; returns the number of rows deleted
+    return sum(trim_feed(user_id) for user_id in set(user_ids))
+
+
+def trim_feed(user_id):
+    # Seeks the FEED_MAX_ENTRIES-th newest row on (user, created_at) and
+    # deletes everything older, without reading the rest of the timeline
+    cutoff = next(iter(
+        FeedEntry.objects.filter(user_id=user_id).order_by('-created_at')
+        .values_list('created_at', flat=True)[FEED_MAX_ENTRIES - 1:FEED_MAX_ENTRIES]
+    ), None)
+    if cutoff is None:
+        return 0
+    return FeedEntry.objects.filter(user_id=user_id, created_at__lt=cutoff).delete()[0]
+
+
+def overflowing_feeds():
+    # Users whose timeline has grown past FEED_MAX_ENTRIES
+    return (
+        FeedEntry.objects.order_by().values('user_id').annotate(entries=Count('*'))
+        .filter(entries__gt=FEED_MAX_ENTRIES).values_list('user_id', flat=True)
+    )
+
+
+def get_feed_queryset(user):
+    # Precomputed timeline, plus fan-out-on-read for high-audience authors
+    return _feed_queryset(user, list(_pulled_authors(user)))
+
+
+async def aget_feed_queryset(user):
+    return _feed_queryset(user, [author_id async for author_id in _pulled_authors(user)])
+
+
+def _pulled_authors(user):
+    return (
+        User.objects.filter(followers__follower=user, followers_count__gte=FEED_FANOUT_FOLLOWER_LIMIT)
+        .values_list('id', flat=True)
+    )
+
+
+def _feed_queryset(user, pulled_authors):
+    entry_ids = FeedEntry.objects.filter(user=user).order_by('-created_at').values('post_id')[:FEED_MAX_ENTRIES]
+    filters = Q(id__in=entry_ids)
+    if pulled_authors:
+        filters |= Q(author_id__in=pulled_authors)
+
+    return Post.objects.filter(filters).order_by('-created_at')
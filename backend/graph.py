@@ -0,0 +1,262 @@
+import heapq
+import logging
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from itertools import groupby
+
+from django.conf import settings
+from django.db import close_old_connections
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+# "Who to follow" over an in-memory copy of the Follow table. Candidates are
+# the accounts followed by the people a user follows, scored by how many of
+# those people follow them, with a bonus for accounts that already follow the
+# user. The first snapshot is built in the background when the server
+# starts (see Entreefox/wsgi.py and asgi.py). Follows made in this process
+# are laid over the snapshot as they happen; the snapshot is rebuilt in the
+# background once it is MAX_AGE seconds old, to pick up other processes, or
+# after REBUILD_AFTER changes.
+
+# Added to the score of candidates who follow the user
+FOLLOWS_YOU_WEIGHT = 2
+
+
+def options():
+    return getattr(settings, 'SUGGESTIONS', {})
+
+
+class Adjacency:
+    # Compressed sparse rows: the neighbours of sources[i] are
+    # targets[offsets[i]:offsets[i + 1]], in ascending order. Built with NumPy
+    # when it is installed, otherwise with typed arrays from the stdlib.
+
+    def __init__(self, sources, offsets, targets):
+        self.sources = sources
+        self.offsets = offsets
+        self.targets = targets
+
+    @classmethod
+    def from_edges(cls, heads, tails):
+        # Rows keyed by heads; heads and tails are parallel sequences of ids
+        if np is not None:
+            heads = np.asarray(heads, dtype=np.int64)
+            tails = np.asarray(tails, dtype=np.int64)
+            order = np.lexsort((tails, heads))
+            heads, tails = heads[order], tails[order]
+            sources, counts = np.unique(heads, return_counts=True)
+            offsets = np.zeros(len(sources) + 1, dtype=np.int64)
+            np.cumsum(counts, out=offsets[1:])
+            return cls(sources, offsets, tails)
+
+        sources, offsets, targets = array('q'), array('q', [0]), array('q')
+        for source, edges in groupby(sorted(zip(heads, tails)), key=lambda edge: edge[0]):
+            sources.append(source)
+            targets.extend(tail for head, tail in edges)
+            offsets.append(len(targets))
+        return cls(sources, offsets, targets)
+
+    def row(self, node):
+        index = bisect_left(self.sources, node) if np is None else int(np.searchsorted(self.sources, node))
+        if index < len(self.sources) and self.sources[index] == node:
+            return self.targets[self.offsets[index]:self.offsets[index + 1]]
+        return self.targets[0:0]
+
+    def __len__(self):
+        return len(self.targets)
+
+
+class Overlay:
+    # Edge changes since the snapshot, per node
+    def __init__(self):
+        self.added = {}
+        self.removed = {}
+        self.changes = 0
+
+    def add(self, head, tail):
+        self.removed.get(head, set()).discard(tail)
+        self.added.setdefault(head, set()).add(tail)
+        self.changes += 1
+
+    def remove(self, head, tail):
+        self.added.get(head, set()).discard(tail)
+        self.removed.setdefault(head, set()).add(tail)
+        self.changes += 1
+
+    def apply(self, node, row):
+        added, removed = self.added.get(node), self.removed.get(node)
+        if not added and not removed:
+            return row
+        merged = sorted((set(row.tolist() if np is not None else row) - (removed or set())) | (added or set()))
+        return np.array(merged, dtype=np.int64) if np is not None else array('q', merged)
+
+
+class FollowGraph:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._following = None
+        self._followers = None
+        self._overlay_following = Overlay()
+        self._overlay_followers = Overlay()
+        self._built_at = 0.0
+        self._pending = None
+        self._rebuilding = False
+
+    def _snapshot(self):
+        with self._lock:
+            return self._following, self._followers, self._overlay_following, self._overlay_followers
+
+    def following(self, user_id):
+        following, followers, overlay, _ = self._snapshot()
+        return overlay.apply(user_id, following.row(user_id))
+
+    def followers(self, user_id):
+        following, followers, _, overlay = self._snapshot()
+        return overlay.apply(user_id, followers.row(user_id))
+
+    # --- Loading ---
+
+    def build(self):
+        with self._build_lock:
+            self._load()
+
+    def _load(self):
+        # Loads the whole Follow table; changes made meanwhile are replayed on top
+        from .models import Follow
+
+        with self._lock:
+            self._pending = []
+        started = time.monotonic()
+        try:
+            edges = Follow.objects.values_list('follower_id', 'following_id').iterator(chunk_size=10000)
+            if np is not None:
+                pairs = np.fromiter(edges, dtype=np.dtype((np.int64, 2)))
+                followers_of, followed = pairs[:, 0], pairs[:, 1]
+            else:
+                pairs = list(edges)
+                followers_of, followed = [pair[0] for pair in pairs], [pair[1] for pair in pairs]
+            following = Adjacency.from_edges(followers_of, followed)
+            followers = Adjacency.from_edges(followed, followers_of)
+        except Exception:
+            with self._lock:
+                self._pending = None
+            raise
+
+        with self._lock:
+            overlay_following, overlay_followers = Overlay(), Overlay()
+            for change, follower_id, following_id in self._pending:
+                getattr(overlay_following, change)(follower_id, following_id)
+                getattr(overlay_followers, change)(following_id, follower_id)
+            self._following, self._followers = following, followers
+            self._overlay_following, self._overlay_followers = overlay_following, overlay_followers
+            self._built_at = time.monotonic()
+            self._pending = None
+        logger.info("Loaded %d follow edges in %.2fs", len(following), time.monotonic() - started)
+
+    def start(self):
+        # Builds the first snapshot in the background; called at process startup
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+        threading.Thread(target=self._rebuild, name='follow-graph', daemon=True).start()
+
+    def ensure_loaded(self):
+        # False until the first snapshot is ready; requests never build it
+        # themselves. Stale snapshots are rebuilt in the background.
+        if self._following is None:
+            self.start()
+            return False
+        if self._is_stale() and not self._rebuilding:
+            self.start()
+        return True
+
+    def _is_stale(self):
+        config = options()
+        age = time.monotonic() - self._built_at
+        return age > config.get('MAX_AGE', 600) or self._overlay_following.changes > config.get('REBUILD_AFTER', 100000)
+
+    def _rebuild(self):
+        try:
+            self.build()
+        except Exception:
+            logger.exception("Failed to rebuild the follow graph")
+        finally:
+            self._rebuilding = False
+            close_old_connections()
+
+    # --- Incremental updates ---
+
+    def add(self, follower_id, following_id):
+        self._record('add', follower_id, following_id)
+
+    def remove(self, follower_id, following_id):
+        self._record('remove', follower_id, following_id)
+
+    def _record(self, change, follower_id, following_id):
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append((change, follower_id, following_id))
+            if self._following is not None:
+                getattr(self._overlay_following, change)(follower_id, following_id)
+                getattr(self._overlay_followers, change)(following_id, follower_id)
+
+    # --- Suggestions ---
+
+    def suggest(self, user_id, limit=20):
+        # [(user_id, mutual_count, follows_you)], best first; empty until the graph is loaded
+        if not self.ensure_loaded():
+            return []
+        followed = self.following(user_id)
+        followed_by = self.followers(user_id)
+        if np is not None:
+            mutual = self._mutual_counts_numpy(user_id, followed)
+            follows_you = set(followed_by.tolist())
+            exclude = set(followed.tolist())
+        else:
+            mutual = self._mutual_counts_python(user_id, followed)
+            follows_you = set(followed_by)
+            exclude = set(followed)
+        exclude.add(user_id)
+
+        scores = Counter(mutual)
+        for candidate in follows_you - exclude:
+            scores[candidate] += FOLLOWS_YOU_WEIGHT
+        for candidate in exclude:
+            scores.pop(candidate, None)
+
+        # Highest scores first; ties among the shortlist go to the more
+        # followed account, then the older one
+        shortlist = heapq.nlargest(limit * 5, scores.items(), key=lambda item: (item[1], -item[0]))
+        best = sorted(shortlist, key=lambda item: (-item[1], -self._followers_count(item[0]), item[0]))[:limit]
+        return [(candidate, mutual.get(candidate, 0), candidate in follows_you) for candidate, score in best]
+
+    def _followers_count(self, user_id):
+        return len(self.followers(user_id))
+
+    def _mutual_counts_numpy(self, user_id, followed):
+        # Second-hop neighbours of everyone the user follows, counted in one pass
+        if not len(followed):
+            return {}
+        hops = np.concatenate([self.following(int(followee)) for followee in followed])
+        candidates, counts = np.unique(hops, return_counts=True)
+        keep = ~np.isin(candidates, followed) & (candidates != user_id)
+        return dict(zip(candidates[keep].tolist(), counts[keep].tolist()))
+
+    def _mutual_counts_python(self, user_id, followed):
+        counts = Counter()
+        for followee in followed:
+            counts.update(self.following(followee))
+        return counts
+
+
+graph = FollowGraph()
@@ -0,0 +1,364 @@
+import contextvars
+import cProfile
+import io
+import logging
+import os
+import pstats
+import random
+import threading
+import time
+import traceback
+from collections import Counter, defaultdict, deque
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from rest_framework import renderers
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds, in seconds, of the request latency histogram
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Recent N+1 reports and profiles kept for /api/_metrics?format=json
+RECENT_LIMIT = 50
+
+# Frames left out of N+1 call sites
+SKIPPED_FRAMES = (
+    os.path.join('django', 'db', ''),
+    os.path.join('django', 'utils', ''),
+    os.path.join('backend', 'instrumentation.py'),
+)
+
+_current = contextvars.ContextVar('request_recorder', default=None)
+
+
+def options():
+    return getattr(settings, 'INSTRUMENTATION', {})
+
+
+class RequestRecorder:
+    # Everything measured for one request; also the execute_wrapper that
+    # counts and times its SQL. Async views may run queries on several
+    # threads at once, hence the lock.
+    def __init__(self):
+        self.queries = 0
+        self.sql_time = 0.0
+        self.serialization_time = 0.0
+        self.statements = Counter()
+        self.stacks = {}
+        self.serializing = False
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self.sql_time += elapsed
+                self.queries += 1
+                self.statements[sql] += 1
+                repeated = self.statements[sql] == 2
+            if repeated:
+                # Only repeated statements are attributed, so the common path stays cheap
+                self.stacks[sql] = app_stack()
+
+    def duplicates(self, threshold):
+        return [(sql, count) for sql, count in self.statements.items() if count >= threshold]
+
+
+def record_query(execute, sql, params, many, context):
+    # Installed on every connection; hands the query to the recorder of the
+    # request being served, which the context variable carries into the
+    # threads that run sync code and async ORM calls
+    recorder = _current.get()
+    if recorder is None:
+        return execute(sql, params, many, context)
+    return recorder(execute, sql, params, many, context)
+
+
+@receiver(connection_created)
+def install_query_recorder(sender, connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def app_stack(limit=6):
+    # Innermost frames that issued the statement, skipping the ORM and this
+    # module; usually a serializer field or a loop in a view
+    root = str(settings.BASE_DIR)
+    frames = []
+    for frame in traceback.extract_stack():
+        path = frame.filename
+        if any(part in path for part in SKIPPED_FRAMES):
+            continue
+        if 'site-packages' in path:
+            path = path.split('site-packages' + os.sep, 1)[1]
+        elif path.startswith(root):
+            path = os.path.relpath(path, root)
+        frames.append(f'{path}:{frame.lineno} in {frame.name}')
+    return frames[-limit:]
+
+
+class Registry:
+    # Process-wide aggregates per view, rendered by MetricsView
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = Counter()
+            self.latency_buckets = defaultdict(lambda: [0] * len(LATENCY_BUCKETS))
+            self.latency_sum = Counter()
+            self.queries = Counter()
+            self.sql_time = Counter()
+            self.serialization_time = Counter()
+            self.response_bytes = Counter()
+            self.n_plus_one = Counter()
+            self.recent_n_plus_one = deque(maxlen=RECENT_LIMIT)
+            self.recent_profiles = deque(maxlen=RECENT_LIMIT)
+
+    def record(self, view, method, status, duration, recorder, response_bytes, duplicates):
+        with self._lock:
+            self.requests[(view, method, status)] += 1
+            buckets = self.latency_buckets[view]
+            for index, bound in enumerate(LATENCY_BUCKETS):
+                if duration <= bound:
+                    buckets[index] += 1
+            self.latency_sum[view] += duration
+            self.queries[view] += recorder.queries
+            self.sql_time[view] += recorder.sql_time
+            self.serialization_time[view] += recorder.serialization_time
+            self.response_bytes[view] += response_bytes
+            for sql, count in duplicates:
+                self.n_plus_one[view] += 1
+                self.recent_n_plus_one.append({
+                    'view': view,
+                    'count': count,
+                    'sql': sql[:500],
+                    'stack': recorder.stacks.get(sql, []),
+                })
+
+    def add_profile(self, view, text):
+        with self._lock:
+            self.recent_profiles.append({'view': view, 'at': time.time(), 'stats': text})
+
+    def snapshot(self):
+        with self._lock:
+            views = sorted({view for view, method, status in self.requests})
+            per_view = {}
+            for view in views:
+                count = sum(n for (name, method, status), n in self.requests.items() if name == view)
+                per_view[view] = {
+                    'requests': count,
+                    'latency_seconds_sum': self.latency_sum[view],
+                    'latency_buckets': dict(zip(LATENCY_BUCKETS, self.latency_buckets[view])),
+                    'queries': self.queries[view],
+                    'queries_per_request': round(self.queries[view] / count, 2),
+                    'sql_seconds': self.sql_time[view],
+                    'serialization_seconds': self.serialization_time[view],
+                    'response_bytes': self.response_bytes[view],
+                    'n_plus_one': self.n_plus_one[view],
+                }
+            return {
+                'views': per_view,
+                'requests': [{'view': view, 'method': method, 'status': status, 'count': count}
+                             for (view, method, status), count in sorted(self.requests.items())],
+                'recent_n_plus_one': list(self.recent_n_plus_one),
+                'recent_profiles': list(self.recent_profiles),
+            }
+
+
+registry = Registry()
+
+
+class InstrumentationMiddleware:
+    # Per-request query count, SQL time, serialization time, response size and
+    # latency, aggregated per view. Repeated identical statements are reported
+    # as likely N+1 queries with the code that issued them. A fraction of
+    # requests can be run under cProfile (PROFILE_SAMPLE_RATE); async requests
+    # are not profiled. Works in both sync and async stacks, so it does not
+    # pin async views to a thread.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        # Connections opened before this middleware was loaded
+        install_query_recorder(sender=None, connection=connection)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        config = options()
+        if not config.get('ENABLED', True):
+            return self.get_response(request)
+
+        recorder = RequestRecorder()
+        token = _current.set(recorder)
+        profiler = None
+        if random.random() < config.get('PROFILE_SAMPLE_RATE', 0.0):
+            profiler = cProfile.Profile()
+        started = time.perf_counter()
+        try:
+            if profiler is not None:
+                response = profiler.runcall(self.get_response, request)
+            else:
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.finish(request, response, recorder, time.perf_counter() - started, config)
+        if profiler is not None:
+            save_profile(view_name(request), profiler, config)
+        return response
+
+    async def __acall__(self, request):
+        config = options()
+        if not config.get('ENABLED', True):
+            return await self.get_response(request)
+
+        recorder = RequestRecorder()
+        token = _current.set(recorder)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.finish(request, response, recorder, time.perf_counter() - started, config)
+        return response
+
+    def finish(self, request, response, recorder, duration, config):
+        view = view_name(request)
+        duplicates = recorder.duplicates(config.get('N_PLUS_ONE_THRESHOLD', 5))
+        for sql, count in duplicates:
+            logger.warning(
+                "Possible N+1 in %s: %d x %s\n  %s", view, count, sql[:200], '\n  '.join(recorder.stacks.get(sql, [])),
+            )
+        registry.record(view, request.method, response.status_code, duration, recorder, response_size(response), duplicates)
+
+        if shows_server_timing(request, config):
+            response['Server-Timing'] = (
+                f'db;dur={recorder.sql_time * 1000:.1f};desc="{recorder.queries} queries", '
+                f'serialize;dur={recorder.serialization_time * 1000:.1f}, '
+                f'total;dur={duration * 1000:.1f}'
+            )
+
+
+def shows_server_timing(request, config):
+    # Backend timings are only sent to staff unless SERVER_TIMING says otherwise
+    audience = 'all' if settings.DEBUG else config.get('SERVER_TIMING', 'staff')
+    if audience == 'all':
+        return True
+    user = getattr(request, 'user', None)
+    return audience == 'staff' and user is not None and user.is_staff
+
+
+def view_name(request):
+    # The URL name, or the dotted path of the view for unnamed routes
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unresolved'
+    if match.url_name:
+        return match.view_name
+    view = getattr(match.func, 'view_class', match.func)
+    return f'{view.__module__}.{view.__qualname__}'
+
+
+def response_size(response):
+    if getattr(response, 'streaming', False):
+        return int(response.get('Content-Length') or 0)
+    return len(response.content)
+
+
+def save_profile(view, profiler, config):
+    directory = config.get('PROFILE_DIR')
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        name = f"{view.replace(':', '-').replace('/', '-')}-{time.time_ns()}.prof"
+        profiler.dump_stats(os.path.join(directory, name))
+    stream = io.StringIO()
+    pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(25)
+    registry.add_profile(view, stream.getvalue())
+
+
+class TimedSerializerMixin:
+    # Base of this app's serializers. to_representation is where fields are
+    # rendered and any queries they trigger run, so time spent there is
+    # serialization time. Nested serializers and the items of a list are
+    # counted once, by the outermost call.
+    def to_representation(self, instance):
+        recorder = _current.get()
+        if recorder is None or recorder.serializing:
+            return super().to_representation(instance)
+        recorder.serializing = True
+        started = time.perf_counter()
+        try:
+            return super().to_representation(instance)
+        finally:
+            recorder.serialization_time += time.perf_counter() - started
+            recorder.serializing = False
+
+
+class PrometheusRenderer(renderers.BaseRenderer):
+    media_type = 'text/plain'
+    format = 'prometheus'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return prometheus(data['metrics'], data['cache']).encode(self.charset)
+
+
+def prometheus(snapshot, cache_stats):
+    # Text exposition format, https://prometheus.io/docs/instrumenting/exposition_formats/
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for labels, value in samples:
+            label_text = ','.join(f'{key}="{escape(val)}"' for key, val in labels.items())
+            lines.append(f'{name}{{{label_text}}} {value}' if label_text else f'{name} {value}')
+
+    views = snapshot['views']
+    metric('entreefox_requests_total', 'counter', 'Requests handled.',
+           [({'view': row['view'], 'method': row['method'], 'status': row['status']}, row['count']) for row in snapshot['requests']])
+
+    histogram = []
+    for view, data in views.items():
+        # Buckets are recorded cumulatively already
+        for bound, count in data['latency_buckets'].items():
+            histogram.append(({'view': view, 'le': bound}, count))
+        histogram.append(({'view': view, 'le': '+Inf'}, data['requests']))
+    lines.append('# HELP entreefox_request_duration_seconds Request latency.')
+    lines.append('# TYPE entreefox_request_duration_seconds histogram')
+    for labels, value in histogram:
+        lines.append(f'entreefox_request_duration_seconds_bucket{{view="{escape(labels["view"])}",le="{labels["le"]}"}} {value}')
+    for view, data in views.items():
+        lines.append(f'entreefox_request_duration_seconds_sum{{view="{escape(view)}"}} {data["latency_seconds_sum"]:.6f}')
+        lines.append(f'entreefox_request_duration_seconds_count{{view="{escape(view)}"}} {data["requests"]}')
+
+    for name, key, help_text in (
+        ('entreefox_db_queries_total', 'queries', 'SQL statements executed.'),
+        ('entreefox_db_duration_seconds_total', 'sql_seconds', 'Time spent in SQL.'),
+        ('entreefox_serialization_duration_seconds_total', 'serialization_seconds', 'Time spent serializing responses.'),
+        ('entreefox_response_bytes_total', 'response_bytes', 'Response body bytes.'),
+        ('entreefox_n_plus_one_total', 'n_plus_one', 'Repeated statements flagged as likely N+1 queries.'),
+    ):
+        metric(name, 'counter', help_text, [({'view': view}, data[key]) for view, data in views.items()])
+
+    metric('entreefox_cache_hits_total', 'counter', 'Response cache hits.',
+           [({'namespace': namespace}, data['hits']) for namespace, data in cache_stats.items()])
+    metric('entreefox_cache_misses_total', 'counter', 'Response cache misses.',
+           [({'namespace': namespace}, data['misses']) for namespace, data in cache_stats.items()])
+    return '\n'.join(lines) + '\n'
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
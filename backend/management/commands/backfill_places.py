@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from backend.caching import invalidate_on_commit, object_scope
+from backend.counters import refresh_place_counts
+from backend.models import Post
+from backend.places import place_key, resolve_places
+
+
+class Command(BaseCommand):
+    help = "Link existing posts to the Place of their location, streaming posts without one in chunks"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        # Walks primary key ranges; each chunk is its own transaction, so an
+        # interrupted run can be resumed
+        pending = Post.objects.filter(place__isnull=True, location__isnull=False).exclude(location='')
+        linked = 0
+        last_id = 0
+        while True:
+            posts = list(pending.filter(id__gt=last_id).order_by('id').only('id', 'location')[:chunk_size])
+            if not posts:
+                break
+            with transaction.atomic():
+                places = resolve_places(post.location for post in posts)
+                for post in posts:
+                    post.place = places.get(place_key(post.location))
+                updated = [post for post in posts if post.place is not None]
+                Post.objects.bulk_update(updated, ['place'])
+                refresh_place_counts({post.place_id for post in updated})
+                # Cached posts carry their place id
+                invalidate_on_commit(*[object_scope(Post, post.id) for post in updated])
+            linked += len(updated)
+            last_id = posts[-1].id
+
+        self.stdout.write(self.style.SUCCESS(f"Linked {linked} posts to places"))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from backend.models import Post
+from backend.tags import index_posts
+
+
+class Command(BaseCommand):
+    help = "Index the hashtags and mentions of existing posts, streaming the post table in chunks"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        # Old posts are indexed without notifying the users they mention; each
+        # chunk is its own transaction, so an interrupted run can be resumed
+        posts = Post.objects.only('id', 'author_id', 'content', 'created_at').order_by('id')
+        total = 0
+        chunk = []
+        for post in posts.iterator(chunk_size=chunk_size):
+            chunk.append(post)
+            if len(chunk) >= chunk_size:
+                index_posts(chunk)
+                total += len(chunk)
+                chunk = []
+        if chunk:
+            index_posts(chunk)
+            total += len(chunk)
+
+        self.stdout.write(self.style.SUCCESS(f"Indexed tags and mentions of {total} posts"))
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from backend import benchmarks
+
+
+class Command(BaseCommand):
+    help = "Compare the async read endpoints under ASGI with the sync ones under WSGI at the same concurrency"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--requests', type=int, default=200, help="Requests per scenario and server")
+        parser.add_argument('--concurrency', type=int, default=64, help="Clients sending requests back to back")
+        parser.add_argument('--wsgi-threads', type=int, default=8, help="Worker threads of the WSGI server")
+        parser.add_argument('--db-latency', type=float, default=2.0,
+                            help="Milliseconds added to every query, for the round trip to a database server")
+        parser.add_argument('--scenario', action='append', help="Only run these scenarios")
+        parser.add_argument('--keepdb', action='store_true', help="Reuse the seeded benchmark database between runs")
+
+    def handle(self, *args, **options):
+        scenarios = benchmarks.SERVER_SCENARIOS
+        if options['scenario']:
+            scenarios = [scenario for scenario in scenarios if scenario.name in options['scenario']]
+            if not scenarios:
+                raise CommandError("No matching scenarios")
+
+        with benchmarks.benchmark_database(users=options['users'], keepdb=options['keepdb'], log=self.stdout.write):
+            sampler = benchmarks.Sampler()
+            self.stdout.write(
+                f"Running {len(scenarios)} scenarios with {options['concurrency']} clients, "
+                f"{options['wsgi_threads']} WSGI threads and {options['db_latency']}ms per query..."
+            )
+            results = benchmarks.run_server_benchmark(
+                sampler, scenarios, requests=options['requests'], concurrency=options['concurrency'],
+                wsgi_threads=options['wsgi_threads'], db_latency=options['db_latency'] / 1000,
+            )
+
+        header = f"{'scenario':<16}{'server':<7}{'p50 ms':>10}{'p95 ms':>10}{'queries':>9}{'req/s':>9}{'speedup':>9}"
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for name, servers in results.items():
+            for server, result in servers.items():
+                speedup = ''
+                if server == 'asgi':
+                    speedup = f"{result['throughput_rps'] / servers['wsgi']['throughput_rps']:.2f}x"
+                self.stdout.write(
+                    f"{name:<16}{server:<7}{result['p50_ms']:>10}{result['p95_ms']:>10}"
+                    f"{result['queries_per_request']:>9}{result['throughput_rps']:>9}{speedup:>9}"
+                )
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from backend.benchmarks import generate, run_auth_benchmark
+
+
+class Command(BaseCommand):
+    help = "Measure the per-request cost of access token authentication, with and without the user cache"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=5000)
+        parser.add_argument('--users', type=int, default=50, help="Distinct tokens cycled through")
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0)
+        try:
+            generate(users=options['users'], posts_per_user=0, conversations=0)
+            results = run_auth_benchmark(iterations=options['iterations'], users=options['users'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        header = f"{'path':<28}{'mean us':>10}{'p50 ms':>10}{'p99 ms':>10}{'queries':>9}"
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for name, result in results.items():
+            self.stdout.write(
+                f"{name:<28}{result['mean_us']:>10}{result['p50_ms']:>10}{result['p99_ms']:>10}{result['queries_per_request']:>9}"
+            )
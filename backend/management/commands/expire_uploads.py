@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from backend.uploads import expire
+
+
+class Command(BaseCommand):
+    help = "Delete abandoned chunked uploads and their temporary files; meant to run periodically"
+
+    def handle(self, *args, **options):
+        sessions, files = expire()
+        self.stdout.write(self.style.SUCCESS(f"Expired {sessions} uploads and {files} orphaned part files"))
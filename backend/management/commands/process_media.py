@@ -0,0 +1,33 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from backend.media import MEDIA_FIELDS, get_executor, needs_processing, process_image, process_video, record
+from backend.models import Post, User
+
+
+class Command(BaseCommand):
+    help = "Build renditions and media metadata for uploads that have not been processed yet"
+
+    def handle(self, *args, **options):
+        media_root = default_storage.path('')
+        jobs = []
+        for model in (Post, User):
+            for instance in model.objects.iterator(chunk_size=500):
+                for field_name, asset_field in MEDIA_FIELDS[model.__name__]:
+                    if not needs_processing(instance, field_name, asset_field):
+                        continue
+                    name = getattr(instance, field_name).name
+                    kind = 'video' if field_name == 'video' else 'image'
+                    worker = process_video if kind == 'video' else process_image
+                    future = get_executor().submit(worker, default_storage.path(name), media_root)
+                    jobs.append((future, model, instance.pk, field_name, asset_field, name, kind))
+
+        failed = 0
+        for future, model, pk, field_name, asset_field, name, kind in jobs:
+            try:
+                record(model, pk, field_name, asset_field, name, kind, future.result())
+            except Exception as error:
+                failed += 1
+                self.stderr.write(f"{name}: {error}")
+
+        self.stdout.write(self.style.SUCCESS(f"Processed {len(jobs) - failed} files, {failed} failed"))
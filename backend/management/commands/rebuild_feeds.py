@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from backend.feed import backfill_authors
+from backend.models import FeedEntry, User
+
+
+class Command(BaseCommand):
+    help = "Rebuild the materialized home timelines from the Follow graph"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, help="Only rebuild the timeline of this user id")
+
+    def handle(self, *args, **options):
+        users = User.objects.all()
+        if options['user']:
+            users = users.filter(id=options['user'])
+
+        rebuilt = 0
+        for user in users.iterator(chunk_size=500):
+            FeedEntry.objects.filter(user=user).delete()
+            following = User.objects.filter(followers__follower=user).only('id', 'followers_count')
+            backfill_authors(user, list(following))
+            rebuilt += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {rebuilt} timelines"))
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from backend.models import Post, User
+from backend.search import get_backend
+
+
+class Command(BaseCommand):
+    help = "Rebuild the post and user search index, streaming both tables in chunks"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        backend = get_backend()
+
+        with transaction.atomic():
+            backend.clear()
+            users = self._stream(User.objects.order_by('id'), backend.index_users, chunk_size)
+            posts = self._stream(Post.objects.select_related('author').order_by('id'), backend.index_posts, chunk_size)
+
+        self.stdout.write(self.style.SUCCESS(f"Indexed {users} users and {posts} posts"))
+
+    def _stream(self, queryset, index, chunk_size):
+        total = 0
+        chunk = []
+        for row in queryset.iterator(chunk_size=chunk_size):
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                index(chunk)
+                total += len(chunk)
+                chunk = []
+        if chunk:
+            index(chunk)
+            total += len(chunk)
+        return total
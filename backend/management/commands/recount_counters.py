@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from backend.counters import recount_places, recount_posts, recount_users
+from backend.models import Place, Post, User
+
+
+class Command(BaseCommand):
+    help = "Repair drift in the denormalized follower, following, post, like, comment and place counters"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        users = self._repair(User, recount_users, batch_size)
+        posts = self._repair(Post, recount_posts, batch_size)
+        places = self._repair(Place, recount_places, batch_size)
+        self.stdout.write(self.style.SUCCESS(f"Fixed {users} users, {posts} posts and {places} places"))
+
+    def _repair(self, model, recount, batch_size):
+        # Walk the table in primary key ranges so memory stays bounded
+        fixed = 0
+        last_id = 0
+        while True:
+            ids = list(model.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size])
+            if not ids:
+                return fixed
+            with transaction.atomic():
+                fixed += recount(model.objects.filter(id__in=ids))
+            last_id = ids[-1]
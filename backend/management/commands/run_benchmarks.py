@@ -0,0 +1,81 @@
+import os
+import platform
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from backend import benchmarks
+
+DEFAULT_BASELINE = os.path.join(settings.BASE_DIR, 'benchmarks', 'baseline.json')
+
+
+class Command(BaseCommand):
+    help = "Benchmark the hot API endpoints on a throwaway database and compare against the stored baseline"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--requests', type=int, default=200, help="Requests per endpoint")
+        parser.add_argument('--mixed-requests', type=int, default=1000)
+        parser.add_argument('--concurrency', type=int, default=4)
+        parser.add_argument('--scenario', action='append', help="Only run these scenarios")
+        parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+        parser.add_argument('--save-baseline', action='store_true', help="Store this run as the new baseline")
+        parser.add_argument('--tolerance', type=float, default=0.25, help="Allowed p95 slowdown before failing")
+        parser.add_argument('--keepdb', action='store_true', help="Reuse the seeded benchmark database between runs")
+
+    def handle(self, *args, **options):
+        scenarios = benchmarks.SCENARIOS
+        if options['scenario']:
+            scenarios = [scenario for scenario in scenarios if scenario.name in options['scenario']]
+            if not scenarios:
+                raise CommandError("No matching scenarios")
+
+        with benchmarks.benchmark_database(users=options['users'], keepdb=options['keepdb'], log=self.stdout.write):
+            report = self._run(scenarios, options)
+
+        self._print(report['results'])
+        if options['save_baseline']:
+            os.makedirs(os.path.dirname(options['baseline']), exist_ok=True)
+            benchmarks.save_baseline(options['baseline'], report)
+            self.stdout.write(self.style.SUCCESS(f"Baseline written to {options['baseline']}"))
+            return
+
+        if not os.path.exists(options['baseline']):
+            self.stdout.write(self.style.WARNING("No baseline to compare against; run with --save-baseline"))
+            return
+        baseline = benchmarks.load_baseline(options['baseline'])
+        if baseline.get('users') != options['users']:
+            self.stdout.write(self.style.WARNING(f"Baseline was recorded with {baseline.get('users')} users; comparison may be skewed"))
+        regressions = benchmarks.compare(report['results'], baseline['results'], options['tolerance'])
+        if regressions:
+            raise CommandError("Regressions against the baseline:\n  " + "\n  ".join(regressions))
+        self.stdout.write(self.style.SUCCESS("No regressions against the baseline"))
+
+    def _run(self, scenarios, options):
+        sampler = benchmarks.Sampler()
+        results = {}
+        for scenario in scenarios:
+            self.stdout.write(f"Running {scenario.name}...")
+            results[scenario.name] = benchmarks.run_scenario(scenario, sampler, requests=options['requests'])
+        self.stdout.write("Running mixed load...")
+        results['mixed'] = benchmarks.run_mixed(scenarios, sampler, requests=options['mixed_requests'], concurrency=options['concurrency'])
+        return {
+            'users': options['users'],
+            'database': connection.vendor,
+            'python': platform.python_version(),
+            'results': results,
+        }
+
+    def _print(self, results):
+        header = f"{'scenario':<16}{'requests':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'queries':>9}{'req/s':>9}"
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for name, result in results.items():
+            if not result.get('requests'):
+                self.stdout.write(f"{name:<16}{0:>9}")
+                continue
+            self.stdout.write(
+                f"{name:<16}{result['requests']:>9}{result['p50_ms']:>10}{result['p95_ms']:>10}{result['p99_ms']:>10}"
+                f"{result['queries_per_request']:>9}{result['throughput_rps']:>9}"
+            )
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from backend.benchmarks import generate
+
+
+class Command(BaseCommand):
+    help = "Fill the database with synthetic users, a power-law follow graph, posts, likes, comments and conversations"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--posts-per-user', type=int, default=10)
+        parser.add_argument('--follows-per-user', type=int, default=25)
+        parser.add_argument('--conversations', type=int, default=300)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        counts = generate(
+            users=options['users'],
+            posts_per_user=options['posts_per_user'],
+            follows_per_user=options['follows_per_user'],
+            conversations=options['conversations'],
+            seed=options['seed'],
+            log=self.stdout.write,
+        )
+        self.stdout.write(self.style.SUCCESS("Seeded " + ", ".join(f"{count} {name}" for name, count in counts.items())))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from backend.feed import overflowing_feeds, trim_feeds
+
+
+class Command(BaseCommand):
+    help = "Cut materialized home timelines back to FEED_MAX_ENTRIES; meant to run periodically"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, help="Only trim the timeline of this user id")
+
+    def handle(self, *args, **options):
+        user_ids = [options['user']] if options['user'] else list(overflowing_feeds())
+        deleted = trim_feeds(user_ids)
+        self.stdout.write(self.style.SUCCESS(f"Trimmed {len(user_ids)} timelines, deleting {deleted} entries"))
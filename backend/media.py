@@ -0,0 +1,332 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import subprocess
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+
+logger = logging.getLogger(__name__)
+
+# Longest edge, in pixels, of each image rendition
+RENDITIONS = {
+    'thumb': 160,
+    'feed': 720,
+    'full': 1600,
+}
+RENDITION_FORMAT = 'WEBP'
+RENDITION_QUALITY = 80
+RENDITION_ROOT = 'renditions'
+RENDITION_PATH_RE = re.compile(rf'^{RENDITION_ROOT}/[0-9a-f]{{2}}/(?P<hash>[0-9a-f]{{64}})/(?P<name>[\w.-]+)$')
+
+# Save options of the original formats rewritten without metadata; JPEGs keep
+# their quantization tables so re-encoding loses as little as possible
+STRIPPED_FORMATS = {
+    'JPEG': {'quality': 'keep', 'subsampling': 'keep'},
+    'PNG': {},
+    'WEBP': {'lossless': True},
+}
+
+# Media directories served by the application; anything else under MEDIA_ROOT is not exposed
+SERVED_DIRS = ('posts/', 'profile_pics/', f'{RENDITION_ROOT}/')
+# Image originals, served only once processing has stripped their metadata
+IMAGE_DIRS = ('posts/images/', 'profile_pics/')
+VERSION_PARAM = 'v'
+# Characters of the content hash in ?v=
+VERSION_LENGTH = 16
+
+# Model file fields handled by the pipeline, mapped to the MediaAsset FK that records the result
+MEDIA_FIELDS = {
+    'Post': (('image', 'image_asset'), ('video', 'video_asset')),
+    'User': (('profile_pic', 'profile_pic_asset'),),
+}
+
+
+# --- Worker side: plain functions run in the process pool, no Django access ---
+
+def file_digest(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as source:
+        for chunk in iter(lambda: source.read(chunk_size), b''):
+            digest.update(chunk)
+            size += len(chunk)
+    return digest.hexdigest(), size
+
+
+def rendition_dir(content_hash):
+    # Content-addressed, so identical uploads share one set of renditions
+    return os.path.join(RENDITION_ROOT, content_hash[:2], content_hash)
+
+
+def render_image(image, media_root, content_hash, prefix=''):
+    from PIL import Image
+
+    renditions = {}
+    relative_dir = rendition_dir(content_hash)
+    os.makedirs(os.path.join(media_root, relative_dir), exist_ok=True)
+    for name, edge in RENDITIONS.items():
+        relative = os.path.join(relative_dir, f'{prefix}{name}.webp')
+        target = os.path.join(media_root, relative)
+        if not os.path.exists(target):
+            copy = image.copy()
+            copy.thumbnail((edge, edge), Image.LANCZOS)
+            # Saved without the exif/icc payload of the original
+            copy.save(target, RENDITION_FORMAT, quality=RENDITION_QUALITY, method=4)
+        renditions[name] = relative.replace(os.sep, '/')
+    return renditions
+
+
+def strip_metadata(path):
+    # Rewrite an original without its EXIF (GPS position, camera serial) and
+    # XMP payloads, turned upright first as the orientation tag goes with them.
+    # Returns False if the file had none or its format is not rewritten.
+    from PIL import Image, ImageOps
+
+    with Image.open(path) as original:
+        if original.format not in STRIPPED_FORMATS or getattr(original, 'is_animated', False):
+            return False
+        if not original.getexif() and not {'exif', 'xmp', 'XML:com.adobe.xmp'} & original.info.keys():
+            return False
+        image_format = original.format
+        ImageOps.exif_transpose(original, in_place=True)
+        options = STRIPPED_FORMATS[image_format]
+        if original.info.get('icc_profile'):
+            options = {**options, 'icc_profile': original.info['icc_profile']}
+        with open(f'{path}.tmp', 'wb') as stripped:
+            original.save(stripped, image_format, **options)
+    os.replace(f'{path}.tmp', path)
+    return True
+
+
+def process_image(path, media_root):
+    from PIL import Image, ImageOps
+
+    strip_metadata(path)
+    content_hash, size = file_digest(path)
+    with Image.open(path) as original:
+        image = ImageOps.exif_transpose(original)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+        width, height = image.size
+        renditions = render_image(image, media_root, content_hash)
+    return {'content_hash': content_hash, 'size': size, 'width': width, 'height': height, 'renditions': renditions}
+
+
+def process_video(path, media_root):
+    content_hash, size = file_digest(path)
+    result = {'content_hash': content_hash, 'size': size, 'width': None, 'height': None, 'renditions': {}}
+
+    # Poster frames and dimensions need ffmpeg; without it only size and hash are recorded
+    if not shutil.which('ffmpeg') or not shutil.which('ffprobe'):
+        return result
+
+    probe = subprocess.run(
+        ['ffprobe', '-v', 'error', '-select_streams', 'v:0', '-show_entries', 'stream=width,height', '-of', 'json', path],
+        capture_output=True, text=True, timeout=60,
+    )
+    if probe.returncode == 0:
+        streams = json.loads(probe.stdout or '{}').get('streams') or [{}]
+        result['width'], result['height'] = streams[0].get('width'), streams[0].get('height')
+
+    relative_dir = rendition_dir(content_hash)
+    os.makedirs(os.path.join(media_root, relative_dir), exist_ok=True)
+    frame = os.path.join(media_root, relative_dir, 'poster-frame.png')
+    grab = subprocess.run(
+        ['ffmpeg', '-y', '-v', 'error', '-ss', '1', '-i', path, '-frames:v', '1', frame],
+        capture_output=True, timeout=120,
+    )
+    if grab.returncode != 0 or not os.path.exists(frame):
+        # Very short clips have no frame at one second; take the first one
+        subprocess.run(['ffmpeg', '-y', '-v', 'error', '-i', path, '-frames:v', '1', frame], capture_output=True, timeout=120)
+    if os.path.exists(frame):
+        from PIL import Image
+
+        with Image.open(frame) as poster:
+            result['renditions'] = render_image(poster.convert('RGB'), media_root, content_hash, prefix='poster-')
+        os.remove(frame)
+    return result
+
+
+# --- Parent side: scheduling and recording results ---
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                options = getattr(settings, 'MEDIA_PIPELINE', {})
+                _executor = ProcessPoolExecutor(max_workers=options.get('WORKERS', 2))
+    return _executor
+
+
+def schedule(instance, field_name, asset_field):
+    # Process an uploaded file after the current transaction commits
+    name = getattr(instance, field_name).name
+    kind = 'video' if field_name == 'video' else 'image'
+    model = type(instance)
+    pk = instance.pk
+
+    def submit():
+        path = default_storage.path(name)
+        media_root = default_storage.path('')
+        worker = process_video if kind == 'video' else process_image
+        if not getattr(settings, 'MEDIA_PIPELINE', {}).get('ASYNC', True):
+            record(model, pk, field_name, asset_field, name, kind, worker(path, media_root))
+            return
+        future = get_executor().submit(worker, path, media_root)
+        future.add_done_callback(lambda done: _record_async(done, model, pk, field_name, asset_field, name, kind))
+
+    transaction.on_commit(submit)
+
+
+def _record_async(future, model, pk, field_name, asset_field, name, kind):
+    try:
+        record(model, pk, field_name, asset_field, name, kind, future.result())
+    except Exception:
+        logger.exception("Media processing failed for %s", name)
+    finally:
+        close_old_connections()
+
+
+def record(model, pk, field_name, asset_field, name, kind, result):
+    from .caching import invalidate, object_scope
+    from .models import MediaAsset
+
+    asset, created = MediaAsset.objects.get_or_create(
+        content_hash=result['content_hash'],
+        defaults={
+            'kind': kind,
+            'original': name,
+            'size': result['size'],
+            'width': result['width'],
+            'height': result['height'],
+            'renditions': result['renditions'],
+        },
+    )
+    changes = {asset_field: asset}
+    if not created and asset.original != name:
+        # Identical bytes are already stored: point at the existing original and drop the copy
+        changes[field_name] = asset.original
+        if model.objects.filter(pk=pk).update(**changes) and not _still_referenced(name):
+            default_storage.delete(name)
+    else:
+        model.objects.filter(pk=pk).update(**changes)
+    invalidate(object_scope(model, pk))
+    return asset
+
+
+def _still_referenced(name):
+    from .models import Post, User
+
+    return (
+        Post.objects.filter(image=name).exists()
+        or Post.objects.filter(video=name).exists()
+        or User.objects.filter(profile_pic=name).exists()
+    )
+
+
+def needs_processing(instance, field_name, asset_field):
+    file = getattr(instance, field_name)
+    if not file:
+        return False
+    asset_id = getattr(instance, f'{asset_field}_id')
+    if asset_id is None:
+        return True
+    from .models import MediaAsset
+
+    return not MediaAsset.objects.filter(id=asset_id, original=file.name).exists()
+
+
+def rendition_urls(asset, request=None):
+    # Public URLs of an asset's renditions, absolute when a request is available
+    if asset is None:
+        return None
+    urls = {}
+    for name, path in asset.renditions.items():
+        url = default_storage.url(path)
+        urls[name] = request.build_absolute_uri(url) if request is not None else url
+    return {'width': asset.width, 'height': asset.height, 'size': asset.size, 'renditions': urls}
+
+
+def versioned_url(url, file, asset):
+    # Cache-busting URL of an original: the content hash changes with the bytes,
+    # so responses for a versioned URL can be cached as immutable
+    if not url or asset is None or asset.original != file.name:
+        return url
+    separator = '&' if '?' in url else '?'
+    return f'{url}{separator}{VERSION_PARAM}={asset.content_hash[:VERSION_LENGTH]}'
+
+
+def is_current_version(etag, version):
+    # True if ?v= names exactly the content behind a content-hash ETag
+    return (
+        version is not None and len(version) == VERSION_LENGTH
+        and etag.startswith('"') and etag[1:1 + VERSION_LENGTH] == version
+    )
+
+
+def content_etag(name):
+    # Strong ETag from the content hash, when the file has been processed
+    match = RENDITION_PATH_RE.match(name)
+    if match:
+        return '"{}-{}"'.format(match.group('hash')[:32], match.group('name'))
+    from .models import MediaAsset
+
+    content_hash = MediaAsset.objects.filter(original=name).values_list('content_hash', flat=True).first()
+    if content_hash:
+        return f'"{content_hash[:32]}"'
+    return None
+
+
+def parse_range(header, size):
+    # (start, end) of a single "bytes=" range, None to serve the whole file,
+    # or False when the range cannot be satisfied
+    unit, _, spec = (header or '').partition('=')
+    if unit.strip() != 'bytes' or not spec or ',' in spec:
+        # Multipart ranges are rare for media; clients fall back to a full response
+        return None
+    first, _, last = spec.strip().partition('-')
+    try:
+        if not first:
+            length = int(last)
+            if length <= 0:
+                return False
+            return max(size - length, 0), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size or end < start:
+        return False
+    return start, min(end, size - 1)
+
+
+class RangeFile:
+    # Read-only window over an open file, for FileResponse to stream a byte range
+    def __init__(self, file, start, length):
+        self.file = file
+        self.remaining = length
+        file.seek(start)
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b''
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
@@ -0,0 +1,59 @@
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Conversation, ConversationParticipant, Message
+from .realtime import get_broker
+
+
+def conversation_topic(conversation_id):
+    return f'conversation:{conversation_id}'
+
+
+def publish(conversation_id, event):
+    # Deliver an event to the conversation channel once the transaction commits
+    topic = conversation_topic(conversation_id)
+    transaction.on_commit(lambda: get_broker().publish(topic, event))
+
+
+def send_message(conversation, sender, content):
+    from .serializers import MessageSerializer
+
+    with transaction.atomic():
+        message = Message.objects.create(conversation=conversation, sender=sender, content=content)
+        Conversation.objects.filter(id=conversation.id).update(last_message=message, updated_at=timezone.now())
+        memberships = ConversationParticipant.objects.filter(conversation=conversation)
+        memberships.exclude(user=sender).update(unread_count=F('unread_count') + 1)
+        memberships.filter(user=sender).update(last_read_message=message)
+    publish(conversation.id, {
+        'type': 'message',
+        'message': MessageSerializer(message).data,
+    })
+    return message
+
+
+def mark_read(conversation, reader, up_to_id=None):
+    # Mark the other participants' messages as read, optionally only up to a message id
+    unread = conversation.messages.filter(is_read=False).exclude(sender=reader)
+    with transaction.atomic():
+        if up_to_id is None:
+            updated = unread.update(is_read=True)
+            remaining = 0
+            last_read_id = Conversation.objects.filter(id=conversation.id).values_list('last_message_id', flat=True).first()
+        else:
+            updated = unread.filter(id__lte=up_to_id).update(is_read=True)
+            remaining = unread.filter(id__gt=up_to_id).count()
+            last_read_id = conversation.messages.filter(id__lte=up_to_id).order_by('-id').values_list('id', flat=True).first()
+        membership = ConversationParticipant.objects.select_for_update().get(conversation=conversation, user=reader)
+        membership.unread_count = remaining
+        if last_read_id is not None and (membership.last_read_message_id or 0) < last_read_id:
+            membership.last_read_message_id = last_read_id
+        membership.save(update_fields=['unread_count', 'last_read_message'])
+    if updated:
+        publish(conversation.id, {
+            'type': 'read',
+            'user_id': reader.id,
+            'user': reader.username,
+            'up_to_id': up_to_id,
+        })
+    return updated
@@ -0,0 +1,64 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:25
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def _count_of(model, field):
+    counts = model.objects.filter(**{field: OuterRef('pk')}).order_by().values(field).annotate(n=Count('*')).values('n')
+    return Coalesce(Subquery(counts), Value(0))
+
+
+def populate_counters(apps, schema_editor):
+    User = apps.get_model('backend', 'User')
+    Post = apps.get_model('backend', 'Post')
+    Follow = apps.get_model('backend', 'Follow')
+    Like = apps.get_model('backend', 'Like')
+    Comment = apps.get_model('backend', 'Comment')
+
+    User.objects.update(
+        followers_count=_count_of(Follow, 'following'),
+        following_count=_count_of(Follow, 'follower'),
+        posts_count=_count_of(Post, 'author'),
+    )
+    Post.objects.update(
+        likes_count=_count_of(Like, 'post'),
+        comments_count=_count_of(Comment, 'post'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0007_feedentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='comments_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='likes_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='followers_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='following_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='posts_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(populate_counters, migrations.RunPython.noop),
+    ]
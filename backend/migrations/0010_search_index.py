@@ -0,0 +1,51 @@
+from django.db import migrations
+
+
+def create_fts_tables(apps, schema_editor):
+    # Full-text search tables are SQLite FTS5 specific; other databases use
+    # backend.search.SimpleSearchBackend (or their own backend) instead.
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+
+    User = apps.get_model('backend', 'User')
+    Post = apps.get_model('backend', 'Post')
+
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS backend_post_fts "
+        "USING fts5(content, author, location, tokenize='unicode61', prefix='2 3')"
+    )
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS backend_user_fts "
+        "USING fts5(username, email, tokenize='unicode61', prefix='1 2 3')"
+    )
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.executemany(
+            'INSERT INTO backend_user_fts(rowid, username, email) VALUES (%s, %s, %s)',
+            list(User.objects.values_list('id', 'username', 'email')),
+        )
+        cursor.executemany(
+            'INSERT INTO backend_post_fts(rowid, content, author, location) VALUES (%s, %s, %s, %s)',
+            [
+                (post_id, content or '', username, location or '')
+                for post_id, content, username, location in Post.objects.values_list('id', 'content', 'author__username', 'location')
+            ],
+        )
+
+
+def drop_fts_tables(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute('DROP TABLE IF EXISTS backend_post_fts')
+    schema_editor.execute('DROP TABLE IF EXISTS backend_user_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0009_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts_tables, drop_fts_tables),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0010_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='others_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,74 @@
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def populate_read_state(apps, schema_editor):
+    Conversation = apps.get_model('backend', 'Conversation')
+    ConversationParticipant = apps.get_model('backend', 'ConversationParticipant')
+    Message = apps.get_model('backend', 'Message')
+
+    newest = Message.objects.filter(conversation=OuterRef('pk')).order_by('-created_at', '-id').values('id')[:1]
+    Conversation.objects.update(last_message=Subquery(newest))
+
+    unread = (
+        Message.objects.filter(conversation=OuterRef('conversation'), is_read=False)
+        .exclude(sender=OuterRef('user'))
+        .order_by()
+        .values('conversation')
+        .annotate(n=Count('*'))
+        .values('n')
+    )
+    ConversationParticipant.objects.update(unread_count=Coalesce(Subquery(unread), Value(0)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0011_notification_others_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='backend.message'),
+        ),
+        # Turn the implicit participants table into an explicit through model
+        # without recreating it: only the migration state changes here...
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='ConversationParticipant',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('conversation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='memberships', to='backend.conversation')),
+                        ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='conversation_memberships', to=settings.AUTH_USER_MODEL)),
+                    ],
+                    options={
+                        'db_table': 'backend_conversation_participants',
+                        'unique_together': {('conversation', 'user')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='conversation',
+                    name='participants',
+                    field=models.ManyToManyField(related_name='conversations', through='backend.ConversationParticipant', to=settings.AUTH_USER_MODEL),
+                ),
+            ],
+        ),
+        # ...and the read-state columns are added to the existing table
+        migrations.AddField(
+            model_name='conversationparticipant',
+            name='last_read_message',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='backend.message'),
+        ),
+        migrations.AddField(
+            model_name='conversationparticipant',
+            name='unread_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(populate_read_state, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:33
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0012_conversation_read_state'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaAsset',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_hash', models.CharField(max_length=64, unique=True)),
+                ('kind', models.CharField(choices=[('image', 'Image'), ('video', 'Video')], max_length=10)),
+                ('original', models.CharField(max_length=255)),
+                ('size', models.PositiveBigIntegerField()),
+                ('width', models.PositiveIntegerField(blank=True, null=True)),
+                ('height', models.PositiveIntegerField(blank=True, null=True)),
+                ('renditions', models.JSONField(blank=True, default=dict)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='image_asset',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='backend.mediaasset'),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='video_asset',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='backend.mediaasset'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='profile_pic_asset',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='backend.mediaasset'),
+        ),
+    ]
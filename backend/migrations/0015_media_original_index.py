@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0014_upload_sessions'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='mediaasset',
+            name='original',
+            field=models.CharField(db_index=True, max_length=255),
+        ),
+    ]
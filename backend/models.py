@@ -1,3 +1,5 @@
+import uuid
+
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
 from django.db import models
 
@@ -20,16 +22,41 @@ class UserManager(BaseUserManager):
         extra_fields.setdefault("is_superuser", True)
         return self.create_user(username, email, password, **extra_fields)
 
+class MediaAsset(models.Model):
+    # One stored original per distinct content hash, with its processed renditions
+    KINDS = [
+        ('image', 'Image'),
+        ('video', 'Video'),
+    ]
+
+    content_hash = models.CharField(max_length=64, unique=True)
+    kind = models.CharField(max_length=10, choices=KINDS)
+    original = models.CharField(max_length=255, db_index=True)
+    size = models.PositiveBigIntegerField()
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    renditions = models.JSONField(default=dict, blank=True)  # rendition name -> storage path
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.kind} {self.content_hash[:12]}"
+
 class User(AbstractBaseUser, PermissionsMixin):
     username = models.CharField(max_length=150, unique=True)
     email = models.EmailField(unique=True)
     bio = models.TextField(blank=True, null=True)
     profile_pic = models.ImageField(upload_to="profile_pics/", blank=True, null=True)
+    profile_pic_asset = models.ForeignKey(MediaAsset, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
     
     is_active = models.BooleanField(default=True)
     is_staff = models.BooleanField(default=False)
     date_joined = models.DateTimeField(auto_now_add=True)
 
+    # Denormalized counters, kept in sync by backend.counters
+    followers_count = models.PositiveIntegerField(default=0)
+    following_count = models.PositiveIntegerField(default=0)
+    posts_count = models.PositiveIntegerField(default=0)
+
     objects = UserManager()
 
     USERNAME_FIELD = 'username'
@@ -55,19 +82,67 @@ class Follow(models.Model):
 
     class Meta:
         unique_together = ('follower', 'following')  # to prevent duplicate follows
+        indexes = [
+            # back the keyset-paginated follower/following lists
+            models.Index(fields=['following', '-created_at', '-id'], name='follow_following_created_idx'),
+            models.Index(fields=['follower', '-created_at', '-id'], name='follow_follower_created_idx'),
+        ]
 
     def __str__(self):
         return f"{self.follower.username} -> {self.following.username}"
     
+class PostQuerySet(models.QuerySet):
+    def with_feed_annotations(self, user=None):
+        # Everything PostSerializer needs, loaded in the same query as the posts
+        queryset = self.select_related('author', 'image_asset', 'video_asset')
+        if user is not None and user.is_authenticated:
+            liked = Like.objects.filter(post=models.OuterRef('pk'), user=user)
+            return queryset.annotate(user_has_liked=models.Exists(liked))
+        return queryset.annotate(user_has_liked=models.Value(False))
+
+class Place(models.Model):
+    # Canonical form of the free-text post locations, written by backend.places.
+    # Post.location keeps the text as the author typed it.
+    key = models.CharField(max_length=255, unique=True)  # see backend.places.place_key
+    name = models.CharField(max_length=255)  # as first written
+    latitude = models.FloatField(null=True, blank=True)
+    longitude = models.FloatField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    # Denormalized counter, kept in sync by backend.counters
+    posts_count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return self.name
+
 class Post(models.Model):
     author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='posts')
     content = models.TextField(max_length=500, blank=True)
     image = models.ImageField(upload_to='posts/images/', blank=True, null=True)
     video = models.FileField(upload_to='posts/videos/', blank=True, null=True)
+    # Processed renditions of image/video, filled in by backend.media
+    image_asset = models.ForeignKey(MediaAsset, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    video_asset = models.ForeignKey(MediaAsset, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
     location = models.CharField(max_length=255, blank=True, null=True)
+    place = models.ForeignKey(Place, on_delete=models.SET_NULL, null=True, blank=True, related_name='posts')
     emojis = models.CharField(max_length=100, blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    # Denormalized counters, kept in sync by backend.counters
+    likes_count = models.PositiveIntegerField(default=0)
+    comments_count = models.PositiveIntegerField(default=0)
+
+    objects = PostQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='post_created_idx'),
+            # an author's posts, newest first: profiles and feed merges of high-follower authors
+            models.Index(fields=['author', '-created_at', '-id'], name='post_author_created_idx'),
+            # location timelines
+            models.Index(fields=['place', '-created_at', '-id'], name='post_place_created_idx'),
+        ]
+
     def __str__(self):
         return f"{self.author.username} - {self.created_at.strftime('%Y-%m-%d %H:%M')}"
     
@@ -78,10 +153,41 @@ class Like(models.Model):
 
     class Meta:
         unique_together = ('user', 'post')  # to prevent duplicate likes
+        indexes = [
+            # recent likes, for the trending refresh
+            models.Index(fields=['created_at'], name='like_created_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username} liked Post {self.post.id}"
 
+class Tag(models.Model):
+    # One row per hashtag per post, written by backend.tags
+    name = models.CharField(max_length=100)  # normalized: no '#', case-folded
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='tags')
+    created_at = models.DateTimeField()  # copy of post.created_at so the timeline sorts without a join
+
+    class Meta:
+        unique_together = ('post', 'name')
+        indexes = [
+            models.Index(fields=['name', '-created_at', '-id'], name='tag_name_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"#{self.name}: Post {self.post_id}"
+
+class Mention(models.Model):
+    # One row per @username per post, written by backend.tags
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='mentions')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='mentions')
+    created_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('post', 'user')
+
+    def __str__(self):
+        return f"@{self.user_id}: Post {self.post_id}"
+
 class Comment(models.Model):
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='comments')
     author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='comments')
@@ -90,6 +196,11 @@ class Comment(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['post', '-created_at', '-id'], name='comment_post_created_idx'),
+            # recent comments, for the trending refresh
+            models.Index(fields=['created_at'], name='comment_created_idx'),
+        ]
 
     def __str__(self):
         return f"{self.author.username} commented on Post {self.post.id}"
@@ -99,6 +210,7 @@ class Notification(models.Model):
         ('like', 'Like'),
         ('comment', 'Comment'),
         ('follow', 'Follow'),
+        ('mention', 'Mention'),
     ]
     
     recipient = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notifications')
@@ -107,25 +219,64 @@ class Notification(models.Model):
     post = models.ForeignKey(Post, on_delete=models.CASCADE, null=True, blank=True, related_name='notifications')
     comment = models.ForeignKey(Comment, on_delete=models.CASCADE, null=True, blank=True, related_name='notifications')
     is_read = models.BooleanField(default=False)
+    # Number of other actors coalesced into this notification ("X and 41 others")
+    others_count = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['recipient', '-created_at', '-id'], name='notif_recipient_created_idx'),
+            # unread counts, mark-all-read and coalescing only look at unread rows;
+            # kept to one column so the planner prefers it over the FK index
+            models.Index(fields=['recipient'], condition=models.Q(is_read=False), name='notif_unread_idx'),
+        ]
 
     def __str__(self):
         return f"{self.actor.username} {self.notification_type} - {self.recipient.username}"
 
+class NotificationActor(models.Model):
+    # The distinct actors folded into a coalesced notification, so that an
+    # actor toggling a like or follow repeatedly is only counted once
+    notification = models.ForeignKey(Notification, on_delete=models.CASCADE, related_name='actors')
+    actor = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+
+    class Meta:
+        unique_together = ('notification', 'actor')
+
+    def __str__(self):
+        return f"{self.actor_id} in Notification {self.notification_id}"
+
 class Conversation(models.Model):
-    participants = models.ManyToManyField(User, related_name='conversations')
+    participants = models.ManyToManyField(User, related_name='conversations', through='ConversationParticipant')
+    # Denormalized pointer to the newest message, kept by backend.messaging
+    last_message = models.ForeignKey('Message', on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ['-updated_at']
+        indexes = [
+            models.Index(fields=['-updated_at', '-id'], name='conversation_updated_idx'),
+        ]
 
     def __str__(self):
         return f"Conversation {self.id}"
 
+class ConversationParticipant(models.Model):
+    # Per-participant read state; this is the table behind Conversation.participants
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='memberships')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='conversation_memberships')
+    last_read_message = models.ForeignKey('Message', on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    unread_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        db_table = 'backend_conversation_participants'
+        unique_together = ('conversation', 'user')
+
+    def __str__(self):
+        return f"{self.user.username} in Conversation {self.conversation_id}"
+
 class Message(models.Model):
     conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='messages')
     sender = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sent_messages')
@@ -135,6 +286,49 @@ class Message(models.Model):
 
     class Meta:
         ordering = ['created_at']
+        indexes = [
+            # backs the before_id/after_id history paging in ConversationDetailView
+            models.Index(fields=['conversation', '-created_at', '-id'], name='message_conv_created_idx'),
+            # mark_read: the other participants' unread messages in a conversation
+            models.Index(fields=['conversation'], condition=models.Q(is_read=False), name='message_unread_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.sender.username} - {self.content[:30]}"
+
+class UploadSession(models.Model):
+    # A resumable, chunked upload; chunks are appended to a temporary file
+    # until the upload is finalized into a post
+    STATUSES = [
+        ('active', 'Active'),
+        ('complete', 'Complete'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='upload_sessions')
+    filename = models.CharField(max_length=255)
+    total_size = models.PositiveBigIntegerField()
+    received = models.PositiveBigIntegerField(default=0)
+    sha256 = models.CharField(max_length=64, blank=True)  # expected checksum of the whole file, if the client sent one
+    status = models.CharField(max_length=10, choices=STATUSES, default='active')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Upload {self.id} ({self.received}/{self.total_size})"
+
+class FeedEntry(models.Model):
+    # Materialized home timeline: one row per (reader, post), written on fan-out
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='feed_entries')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='feed_entries')
+    created_at = models.DateTimeField()  # copy of post.created_at so the timeline sorts without a join
+
+    class Meta:
+        unique_together = ('user', 'post')
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', '-created_at'], name='feedentry_user_created_idx'),
+        ]
 
     def __str__(self):
-        return f"{self.sender.username} - {self.content[:30]}"
\ No newline at end of file
+        return f"Feed of {self.user.username}: Post {self.post_id}"
@@ -0,0 +1,314 @@
+import atexit
+import itertools
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from dataclasses import asdict, dataclass
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Comment, Notification, NotificationActor, Post, User
+
+logger = logging.getLogger(__name__)
+
+# Notification types merged into one unread row per (recipient, type, post),
+# e.g. "X and 41 others liked your post". Comments always get their own row.
+COALESCED_TYPES = ('like', 'follow')
+
+
+@dataclass(frozen=True)
+class NotificationEvent:
+    recipient_id: int
+    actor_id: int
+    notification_type: str
+    post_id: int = None
+    comment_id: int = None
+
+    @property
+    def group(self):
+        if self.notification_type in COALESCED_TYPES:
+            return (self.recipient_id, self.notification_type, self.post_id)
+        return None
+
+
+class Journal:
+    # Local durable stand-in for a message queue: events are appended to a
+    # per-process file before they are queued. A flush seals the file and
+    # removes it once its events are written; events of a failed batch stay
+    # in it. Journals left behind by dead processes are replayed.
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f'{os.getpid()}.jsonl')
+        self._sealed = itertools.count(1)
+        self._lock = threading.Lock()
+        self._file = open(self.path, 'a', encoding='utf-8')
+
+    def append(self, event):
+        with self._lock:
+            self._file.write(json.dumps(asdict(event)) + '\n')
+            self._file.flush()
+
+    def seal(self):
+        # Move the events written so far to their own file; returns its path
+        with self._lock:
+            self._file.close()
+            path = os.path.join(self.directory, f'{os.getpid()}.{next(self._sealed)}.jsonl')
+            os.replace(self.path, path)
+            self._file = open(self.path, 'a', encoding='utf-8')
+        return path
+
+    def release(self, path, unwritten=()):
+        # Drop a sealed file, keeping the events that were not written
+        if not unwritten:
+            os.remove(path)
+            return
+        with open(f'{path}.tmp', 'w', encoding='utf-8') as pending:
+            pending.writelines(json.dumps(asdict(event)) + '\n' for event in unwritten)
+        os.replace(f'{path}.tmp', path)
+
+    def recover(self):
+        # Events from journals whose process is gone; those files are removed
+        events = []
+        for name in sorted(os.listdir(self.directory)):
+            pid = name.partition('.')[0]
+            if not name.endswith('.jsonl') or not pid.isdigit() or int(pid) == os.getpid() or _is_alive(int(pid)):
+                continue
+            path = os.path.join(self.directory, name)
+            with open(path, encoding='utf-8') as orphan:
+                events.extend(NotificationEvent(**json.loads(line)) for line in orphan if line.strip())
+            os.remove(path)
+        return events
+
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class NotificationPipeline:
+    # Takes notification writes off the request path: views enqueue events
+    # and a background worker writes them in batches, coalescing bursts.
+
+    def __init__(self, batch_size=500, flush_interval=0.5, run_async=True, journal_dir=None):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.run_async = run_async
+        self.journal = Journal(journal_dir) if journal_dir else None
+        self._queue = queue.Queue()
+        self._flush_lock = threading.Lock()
+        self._put_lock = threading.Lock()
+        self._worker = None
+        self._start_lock = threading.Lock()
+
+    def enqueue(self, event):
+        self._put(event)
+        if not self.run_async:
+            self.flush()
+        else:
+            self._ensure_worker()
+
+    def _put(self, event):
+        # Journal and queue together so a sealed journal holds exactly the
+        # events queued before it was sealed
+        with self._put_lock:
+            if self.journal is not None:
+                self.journal.append(event)
+            self._queue.put(event)
+
+    def _ensure_worker(self):
+        if self._worker is not None:
+            return
+        with self._start_lock:
+            if self._worker is None:
+                if self.journal is not None:
+                    for event in self.journal.recover():
+                        self._put(event)
+                self._worker = threading.Thread(target=self._run, name='notification-pipeline', daemon=True)
+                self._worker.start()
+                atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception:
+                # Journaled events are retried by the next process to start
+                logger.exception("Failed to write notification batch")
+            finally:
+                close_old_connections()
+
+    def flush(self):
+        # Write the queued events in batches; returns the number of events handled
+        with self._flush_lock:
+            with self._put_lock:
+                events = []
+                while True:
+                    try:
+                        events.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                sealed = self.journal.seal() if self.journal is not None and events else None
+            for start in range(0, len(events), self.batch_size):
+                try:
+                    self._write(events[start:start + self.batch_size])
+                except Exception:
+                    if sealed is not None:
+                        self.journal.release(sealed, events[start:])
+                    raise
+            if sealed is not None:
+                self.journal.release(sealed)
+        return len(events)
+
+    @staticmethod
+    def _write(batch):
+        try:
+            write_batch(batch)
+        except IntegrityError:
+            # A row an event points to was deleted during the write;
+            # write the events one by one so only that one is lost
+            for event in batch:
+                try:
+                    write_batch([event])
+                except IntegrityError:
+                    logger.warning("Dropped notification %s: a referenced row is gone", event)
+
+
+def write_batch(events):
+    # Collapse a batch of events into bulk inserts and updates
+    from .signals import publish_notifications
+
+    now = timezone.now()
+    created = []
+    grouped = {}
+    for event in live_events(dict.fromkeys(events)):  # drops exact repeats, e.g. like/unlike/like spam
+        if event.group is None:
+            created.append(Notification(
+                recipient_id=event.recipient_id,
+                actor_id=event.actor_id,
+                notification_type=event.notification_type,
+                post_id=event.post_id,
+                comment_id=event.comment_id,
+            ))
+        else:
+            # Distinct actors in the order they acted
+            actors = grouped.setdefault(event.group, {})
+            actors.pop(event.actor_id, None)
+            actors[event.actor_id] = None
+
+    with transaction.atomic():
+        updated = []
+        new_actors = []
+        if grouped:
+            existing = {}
+            unread = Notification.objects.filter(is_read=False).filter(reduce(or_, [
+                Q(recipient_id=recipient_id, notification_type=notification_type, post_id=post_id)
+                for recipient_id, notification_type, post_id in grouped
+            ]))
+            for notification in unread.order_by('created_at'):
+                existing[(notification.recipient_id, notification.notification_type, notification.post_id)] = notification
+            counted = set(NotificationActor.objects.filter(
+                notification__in=existing.values(),
+                actor_id__in={actor_id for actors in grouped.values() for actor_id in actors},
+            ).values_list('notification_id', 'actor_id'))
+
+            for group, actors in grouped.items():
+                actor_ids = list(actors)
+                notification = existing.get(group)
+                if notification is not None:
+                    # Actors already folded into this notification are not counted again
+                    fresh = [
+                        actor_id for actor_id in actor_ids
+                        if actor_id != notification.actor_id and (notification.id, actor_id) not in counted
+                    ]
+                    if not fresh:
+                        continue
+                    notification.others_count += len(fresh)
+                    notification.actor_id = fresh[-1]
+                    notification.created_at = now
+                    updated.append(notification)
+                    new_actors.append((notification, fresh))
+                else:
+                    recipient_id, notification_type, post_id = group
+                    notification = Notification(
+                        recipient_id=recipient_id,
+                        actor_id=actor_ids[-1],
+                        notification_type=notification_type,
+                        post_id=post_id,
+                        others_count=len(actor_ids) - 1,
+                    )
+                    created.append(notification)
+                    new_actors.append((notification, actor_ids))
+
+        created = Notification.objects.bulk_create(created)
+        Notification.objects.bulk_update(updated, ['actor', 'others_count', 'created_at'])
+        NotificationActor.objects.bulk_create([
+            NotificationActor(notification=notification, actor_id=actor_id)
+            for notification, actor_ids in new_actors for actor_id in actor_ids
+        ], ignore_conflicts=True)
+        transaction.on_commit(lambda: publish_notifications(created + updated))
+
+
+def live_events(events):
+    # Events whose users, post and comment still exist. A post deleted while
+    # its like was queued would otherwise fail the whole batch.
+    events = list(events)
+    user_ids = {event.recipient_id for event in events} | {event.actor_id for event in events}
+    post_ids = {event.post_id for event in events if event.post_id is not None}
+    comment_ids = {event.comment_id for event in events if event.comment_id is not None}
+    users = set(User.objects.filter(id__in=user_ids).values_list('id', flat=True))
+    posts = set(Post.objects.filter(id__in=post_ids).values_list('id', flat=True)) if post_ids else set()
+    comments = set(Comment.objects.filter(id__in=comment_ids).values_list('id', flat=True)) if comment_ids else set()
+    return [
+        event for event in events
+        if event.recipient_id in users and event.actor_id in users
+        and (event.post_id is None or event.post_id in posts)
+        and (event.comment_id is None or event.comment_id in comments)
+    ]
+
+
+_pipeline = None
+_pipeline_lock = threading.Lock()
+
+
+def get_pipeline():
+    global _pipeline
+    if _pipeline is None:
+        with _pipeline_lock:
+            if _pipeline is None:
+                options = getattr(settings, 'NOTIFICATION_PIPELINE', {})
+                _pipeline = NotificationPipeline(
+                    batch_size=options.get('BATCH_SIZE', 500),
+                    flush_interval=options.get('FLUSH_INTERVAL', 0.5),
+                    run_async=options.get('ASYNC', True),
+                    journal_dir=options.get('JOURNAL_DIR'),
+                )
+    return _pipeline
+
+
+def notify(recipient, actor, notification_type, post=None, comment=None):
+    # Queue a notification once the current transaction commits; it is
+    # written by the pipeline, not in the request
+    event = NotificationEvent(
+        recipient_id=recipient.id,
+        actor_id=actor.id,
+        notification_type=notification_type,
+        post_id=post.id if post is not None else None,
+        comment_id=comment.id if comment is not None else None,
+    )
+    transaction.on_commit(lambda: get_pipeline().enqueue(event))
@@ -0,0 +1,196 @@
+import base64
+import json
+from functools import reduce
+from operator import or_
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    # Cursor pagination over a composite key such as (created_at, id).
+    # The cursor carries the key of the last row seen, so every page is a
+    # bounded index range scan instead of an OFFSET scan.
+    ordering = ('-created_at', '-id')
+    page_size = api_settings.PAGE_SIZE or 20
+    max_page_size = 100
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        window = self.page_window(queryset, request)
+        return self.finish_page(list(window))
+
+    async def apaginate_queryset(self, queryset, request):
+        # Same page through the async ORM, for async views
+        window = self.page_window(queryset, request)
+        return self.finish_page([row async for row in window])
+
+    def page_window(self, queryset, request):
+        # The rows of the requested page plus one, to tell whether there are more
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.limit = self.get_page_size(request)
+        self.fields = [field.lstrip('-') for field in self.ordering]
+        self.position, self.reverse = self.decode_cursor(request)
+        descending = self.ordering[0].startswith('-')
+        # Walking backwards flips the comparison and the sort order
+        descending_scan = descending != self.reverse
+
+        if self.position is not None:
+            self.position = self.parse_position(queryset, self.position)
+            queryset = queryset.filter(self.keyset_filter(self.fields, self.position, descending_scan))
+        queryset = queryset.order_by(*[f'-{field}' if descending_scan else field for field in self.fields])
+        return queryset[:self.limit + 1]
+
+    def finish_page(self, rows):
+        has_more = len(rows) > self.limit
+        rows = rows[:self.limit]
+        if self.reverse:
+            rows.reverse()
+
+        self.page = rows
+        self.has_next = has_more if not self.reverse else self.position is not None
+        self.has_previous = has_more if self.reverse else self.position is not None
+        return rows
+
+    def keyset_filter(self, fields, position, descending_scan):
+        # (a, b) < (x, y)  ==  a < x OR (a = x AND b < y)
+        lookup = 'lt' if descending_scan else 'gt'
+        clauses = []
+        for index, field in enumerate(fields):
+            equal = {name: position[i] for i, name in enumerate(fields[:index])}
+            clauses.append(Q(**equal, **{f'{field}__{lookup}': position[index]}))
+        return reduce(or_, clauses)
+
+    def get_page_size(self, request):
+        try:
+            requested = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if requested <= 0:
+            return self.page_size
+        return min(requested, self.max_page_size)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+            position, reverse = payload['p'], bool(payload.get('r'))
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return position, reverse
+
+    def parse_position(self, queryset, position):
+        # Cursors come from the client: each value must convert to its field's type
+        try:
+            values = []
+            for name, raw in zip(self.fields, position):
+                field = self.ordering_field(queryset, name)
+                value = field.to_python(raw)
+                if value is None:
+                    raise ValidationError('null')
+                field.run_validators(value)
+                values.append(value)
+        except (ValidationError, TypeError, ValueError, OverflowError):
+            raise NotFound(self.invalid_cursor_message)
+        return values
+
+    def ordering_field(self, queryset, name):
+        # Ordering fields are model fields or annotations
+        annotation = queryset.query.annotations.get(name)
+        if annotation is not None:
+            return annotation.output_field
+        return queryset.model._meta.get_field(name)
+
+    def encode_cursor(self, row, reverse):
+        position = []
+        for field in self.fields:
+            value = getattr(row, field)
+            position.append(value.isoformat() if hasattr(value, 'isoformat') else value)
+        payload = json.dumps({'p': position, 'r': int(reverse)}, separators=(',', ':'))
+        encoded = base64.urlsafe_b64encode(payload.encode('ascii')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class FeedPagination(KeysetPagination):
+    page_size = 20
+    max_page_size = 50
+
+
+class TagPagination(KeysetPagination):
+    page_size = 20
+    max_page_size = 50
+
+
+class PlacePagination(KeysetPagination):
+    page_size = 20
+    max_page_size = 50
+
+
+class CommentPagination(KeysetPagination):
+    page_size = 20
+    max_page_size = 100
+
+
+class NotificationPagination(KeysetPagination):
+    page_size = 30
+    max_page_size = 100
+
+
+class ConversationPagination(KeysetPagination):
+    ordering = ('-updated_at', '-id')
+    page_size = 20
+    max_page_size = 100
+
+
+class FollowPagination(KeysetPagination):
+    # Follower/following lists page over Follow rows, newest follow first
+    page_size = 50
+    max_page_size = 200
+
+
+class UserPagination(KeysetPagination):
+    ordering = ('id',)
+    page_size = 50
+    max_page_size = 200
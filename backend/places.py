@@ -0,0 +1,357 @@
+import logging
+import math
+import re
+import threading
+import time
+import unicodedata
+from bisect import bisect_left, insort
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from .counters import adjust
+from .models import Place
+
+logger = logging.getLogger(__name__)
+
+# Post locations as rows of the Place table. Every spelling of a location
+# that normalizes to the same key ("Paris", " paris ", "PARIS") shares one
+# Place, and location timelines are an index range scan over
+# Post(place, created_at). Places may carry coordinates.
+#
+# Each process also keeps every place in memory, for autocomplete and
+# nearby queries that never touch the database:
+# - Autocomplete looks up a sorted list holding each place under every word
+#   of its key, so "york" finds "new york". Results are ranked by post
+#   count. The best places for prefixes of up to SHORT_PREFIX characters
+#   are precomputed, since those prefixes match too many places to rank on
+#   every keystroke.
+# - Nearby queries use geohashes, which name nested cells of a lat/lon grid
+#   so that places in the same cell share a prefix. A query reads the cell
+#   around the point and its eight neighbours, at the finest precision
+#   whose cells are still at least the radius across, from a sorted list of
+#   place geohashes.
+# Places and counts change as this process commits posts. The whole index is
+# reloaded in the background every REFRESH seconds to pick up other
+# processes.
+
+MAX_NEARBY_RADIUS_KM = 500
+SHORT_PREFIX = 2
+POPULAR_SIZE = 50
+# Longer prefixes stop ranking after this many matches
+SCAN_LIMIT = 5000
+GEOHASH_PRECISION = 9
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+KM_PER_DEGREE = 111.32
+EARTH_RADIUS_KM = 6371.0088
+WORD_RE = re.compile(r'\w+')
+
+
+def options():
+    return getattr(settings, 'PLACES', {})
+
+
+def place_key(location):
+    # "  Paris ,France" -> "paris, france"; None for blank locations
+    key = unicodedata.normalize('NFKC', location or '').casefold()
+    key = re.sub(r'\s*,\s*', ', ', re.sub(r'\s+', ' ', key)).strip(' ,')
+    return key or None
+
+
+# --- Geohashes ---
+
+def geohash(latitude, longitude, precision=GEOHASH_PRECISION):
+    # Bits alternate between longitude and latitude, halving the range each time
+    ranges = ([-180.0, 180.0], [-90.0, 90.0])
+    values = (longitude, latitude)
+    chars = []
+    bits = 0
+    for index in range(precision * 5):
+        bounds, value = ranges[index % 2], values[index % 2]
+        middle = (bounds[0] + bounds[1]) / 2
+        bits <<= 1
+        if value >= middle:
+            bits |= 1
+            bounds[0] = middle
+        else:
+            bounds[1] = middle
+        if index % 5 == 4:
+            chars.append(GEOHASH_ALPHABET[bits])
+            bits = 0
+    return ''.join(chars)
+
+
+def cell_degrees(precision):
+    # (height, width) of a cell in degrees
+    bits = precision * 5
+    return 180.0 / 2 ** (bits // 2), 360.0 / 2 ** ((bits + 1) // 2)
+
+
+def covering_cells(latitude, longitude, radius_km):
+    # Geohash prefixes whose cells hold every point within radius_km
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        height, width = cell_degrees(precision)
+        width_km = width * KM_PER_DEGREE * math.cos(math.radians(latitude))
+        if height * KM_PER_DEGREE >= radius_km and width_km >= radius_km:
+            break
+    cells = set()
+    for row in (-1, 0, 1):
+        for column in (-1, 0, 1):
+            lat = min(max(latitude + row * height, -90.0), 90.0)
+            lon = (longitude + column * width + 180.0) % 360.0 - 180.0
+            cells.add(geohash(lat, lon, precision))
+    return cells
+
+
+def distance_km(lat1, lon1, lat2, lon2):
+    # Haversine
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi, dlambda = phi2 - phi1, math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(a, 1.0)))
+
+
+# --- Writes ---
+
+def resolve_place(location, latitude=None, longitude=None):
+    # The Place for a location, created on first use; coordinates are only
+    # filled in if the place has none yet
+    key = place_key(location)
+    if key is None:
+        return None
+    name = location.strip()[:Place._meta.get_field('name').max_length]
+    place, changed = Place.objects.get_or_create(key=key, defaults={'name': name, 'latitude': latitude, 'longitude': longitude})
+    if not changed and place.latitude is None and latitude is not None:
+        changed = Place.objects.filter(id=place.id, latitude__isnull=True).update(latitude=latitude, longitude=longitude) > 0
+        if changed:
+            place.latitude, place.longitude = latitude, longitude
+    if changed:
+        transaction.on_commit(lambda: place_index.add(place))
+    return place
+
+
+def resolve_places(locations):
+    # {key: Place} for many locations at once, creating the missing ones
+    names = {}
+    for location in locations:
+        key = place_key(location)
+        if key is not None:
+            names.setdefault(key, location.strip()[:Place._meta.get_field('name').max_length])
+    places = {place.key: place for place in Place.objects.filter(key__in=names)}
+    missing = [Place(key=key, name=name) for key, name in names.items() if key not in places]
+    if missing:
+        Place.objects.bulk_create(missing, ignore_conflicts=True)
+        places.update({place.key: place for place in Place.objects.filter(key__in=[place.key for place in missing])})
+    return places
+
+
+def count_post(place_id, delta):
+    # A post was added to (delta 1) or removed from (delta -1) a place
+    if place_id is None:
+        return
+    adjust(Place, place_id, posts_count=delta)
+    transaction.on_commit(lambda: place_index.count(place_id, delta))
+
+
+# --- In-memory index ---
+
+class PlaceIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._loaded = False
+        self._built_at = 0.0
+        self._rebuilding = False
+        self._pending = None
+        self._reset()
+
+    def _reset(self):
+        # place id -> (key, name, latitude, longitude), and post counts
+        self.places = {}
+        self.counts = {}
+        # sorted (word suffix of the key, place id)
+        self.prefixes = []
+        # short prefix -> place ids, most posts first
+        self.popular = {}
+        # sorted (geohash, place id) of places with coordinates
+        self.cells = []
+
+    def _insert(self, place_id, key, name, latitude, longitude, posts_count):
+        if place_id in self.places:
+            self._remove(place_id)
+        self.places[place_id] = (key, name, latitude, longitude)
+        self.counts[place_id] = posts_count
+        for suffix in self._suffixes(key):
+            insort(self.prefixes, (suffix, place_id))
+        if latitude is not None and longitude is not None:
+            insort(self.cells, (geohash(latitude, longitude), place_id))
+
+    def _remove(self, place_id):
+        key, name, latitude, longitude = self.places.pop(place_id)
+        for suffix in self._suffixes(key):
+            index = bisect_left(self.prefixes, (suffix, place_id))
+            if index < len(self.prefixes) and self.prefixes[index] == (suffix, place_id):
+                del self.prefixes[index]
+        if latitude is not None and longitude is not None:
+            entry = (geohash(latitude, longitude), place_id)
+            index = bisect_left(self.cells, entry)
+            if index < len(self.cells) and self.cells[index] == entry:
+                del self.cells[index]
+
+    @staticmethod
+    def _suffixes(key):
+        return {key[match.start():] for match in WORD_RE.finditer(key)}
+
+    def _rank_popular(self):
+        candidates = {}
+        for suffix, place_id in self.prefixes:
+            for length in range(1, min(SHORT_PREFIX, len(suffix)) + 1):
+                candidates.setdefault(suffix[:length], set()).add(place_id)
+        self.popular = {
+            prefix: sorted(ids, key=self._rank)[:POPULAR_SIZE] for prefix, ids in candidates.items()
+        }
+
+    def _rank(self, place_id):
+        return (-self.counts.get(place_id, 0), self.places[place_id][0])
+
+    # --- Incremental updates ---
+
+    def add(self, place):
+        # A new place, or new coordinates, committed in this process
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append(('add', place))
+            if self._loaded:
+                self._add(place)
+
+    def _add(self, place):
+        count = self.counts.get(place.id, place.posts_count)
+        self._insert(place.id, place.key, place.name, place.latitude, place.longitude, count)
+        # New places join the precomputed short-prefix lists where there is room
+        for suffix in self._suffixes(place.key):
+            for length in range(1, min(SHORT_PREFIX, len(suffix)) + 1):
+                ids = self.popular.setdefault(suffix[:length], [])
+                if place.id not in ids and len(ids) < POPULAR_SIZE:
+                    ids.append(place.id)
+
+    def count(self, place_id, delta):
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append(('count', (place_id, delta)))
+            if self._loaded and place_id in self.counts:
+                self.counts[place_id] = max(0, self.counts[place_id] + delta)
+
+    # --- Loading ---
+
+    def build(self):
+        with self._build_lock:
+            self._load()
+
+    def _load(self):
+        with self._lock:
+            self._pending = []
+        started = time.monotonic()
+        try:
+            rows = list(Place.objects.values_list('id', 'key', 'name', 'latitude', 'longitude', 'posts_count').iterator(chunk_size=10000))
+        except Exception:
+            with self._lock:
+                self._pending = None
+            raise
+
+        with self._lock:
+            self._reset()
+            for place_id, key, name, latitude, longitude, posts_count in rows:
+                self.places[place_id] = (key, name, latitude, longitude)
+                self.counts[place_id] = posts_count
+            # Sorted once instead of insort per row
+            self.prefixes = sorted(
+                (suffix, place_id) for place_id, (key, name, latitude, longitude) in self.places.items()
+                for suffix in self._suffixes(key)
+            )
+            self.cells = sorted(
+                (geohash(latitude, longitude), place_id)
+                for place_id, (key, name, latitude, longitude) in self.places.items()
+                if latitude is not None and longitude is not None
+            )
+            self._rank_popular()
+            for change, detail in self._pending:
+                if change == 'add':
+                    self._add(detail)
+                elif detail[0] in self.counts:
+                    self.counts[detail[0]] = max(0, self.counts[detail[0]] + detail[1])
+            self._pending = None
+            self._loaded = True
+            self._built_at = time.monotonic()
+        logger.info("Loaded %d places in %.2fs", len(rows), time.monotonic() - started)
+
+    def ensure_loaded(self):
+        # The first load runs in the caller; refreshes run in the background
+        if not self._loaded:
+            with self._build_lock:
+                if not self._loaded:
+                    self._load()
+        elif time.monotonic() - self._built_at > options().get('REFRESH', 300) and not self._rebuilding:
+            with self._lock:
+                if self._rebuilding:
+                    return
+                self._rebuilding = True
+            threading.Thread(target=self._rebuild, name='places', daemon=True).start()
+
+    def _rebuild(self):
+        try:
+            self.build()
+        except Exception:
+            logger.exception("Failed to reload places")
+        finally:
+            self._rebuilding = False
+            close_old_connections()
+
+    # --- Reading ---
+
+    def describe(self, place_id):
+        key, name, latitude, longitude = self.places[place_id]
+        return {
+            'id': place_id, 'name': name, 'latitude': latitude, 'longitude': longitude,
+            'posts_count': self.counts.get(place_id, 0),
+        }
+
+    def autocomplete(self, prefix, limit=10):
+        # Places with a word starting with prefix, most posts first
+        query = place_key(prefix)
+        if query is None:
+            return []
+        self.ensure_loaded()
+        with self._lock:
+            if len(query) <= SHORT_PREFIX:
+                ranked = self.popular.get(query, [])
+            else:
+                found = set()
+                index = bisect_left(self.prefixes, (query,))
+                while index < len(self.prefixes) and len(found) < SCAN_LIMIT:
+                    suffix, place_id = self.prefixes[index]
+                    if not suffix.startswith(query):
+                        break
+                    found.add(place_id)
+                    index += 1
+                ranked = sorted(found, key=self._rank)
+            return [self.describe(place_id) for place_id in ranked[:limit] if place_id in self.places]
+
+    def nearby(self, latitude, longitude, radius_km, limit=20):
+        # Places with coordinates within radius_km, nearest first, each with its distance_km
+        self.ensure_loaded()
+        found = []
+        with self._lock:
+            for cell in covering_cells(latitude, longitude, radius_km):
+                index = bisect_left(self.cells, (cell,))
+                while index < len(self.cells) and self.cells[index][0].startswith(cell):
+                    place_id = self.cells[index][1]
+                    key, name, lat, lon = self.places[place_id]
+                    distance = distance_km(latitude, longitude, lat, lon)
+                    if distance <= radius_km:
+                        found.append((distance, place_id))
+                    index += 1
+            found.sort()
+            return [dict(self.describe(place_id), distance_km=round(distance, 3)) for distance, place_id in found[:limit]]
+
+
+place_index = PlaceIndex()
@@ -0,0 +1,93 @@
+import asyncio
+import threading
+from functools import lru_cache
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+def user_topic(user_id):
+    return f'user:{user_id}'
+
+
+class Subscription:
+    # Async iterator over the messages published to one topic
+    def __init__(self, broker, topic, queue, loop=None):
+        self.broker = broker
+        self.topic = topic
+        self.queue = queue
+        self.loop = loop
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self.queue.get()
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class Broker:
+    # Pub/sub interface used to push events to connected clients. publish()
+    # may be called from any thread; subscribe() from a running event loop.
+    # A Redis-backed broker would implement the same three methods.
+
+    def subscribe(self, topic):
+        raise NotImplementedError
+
+    def unsubscribe(self, subscription):
+        raise NotImplementedError
+
+    def publish(self, topic, message):
+        raise NotImplementedError
+
+    def has_subscribers(self, topic):
+        # Lets publishers skip building messages nobody is listening for
+        return True
+
+
+class InProcessBroker(Broker):
+    # Fans messages out to subscribers living in this process only
+    queue_size = 100
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+
+    def subscribe(self, topic):
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        subscription = Subscription(self, topic, queue, asyncio.get_running_loop())
+        with self._lock:
+            self._subscribers.setdefault(topic, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.topic)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.topic]
+
+    def publish(self, topic, message):
+        with self._lock:
+            subscribers = list(self._subscribers.get(topic, ()))
+        for subscription in subscribers:
+            subscription.loop.call_soon_threadsafe(self._deliver, subscription.queue, message)
+
+    def has_subscribers(self, topic):
+        with self._lock:
+            return topic in self._subscribers
+
+    @staticmethod
+    def _deliver(queue, message):
+        # Slow consumers lose their oldest messages rather than growing the queue
+        if queue.full():
+            queue.get_nowait()
+        queue.put_nowait(message)
+
+
+@lru_cache(maxsize=None)
+def get_broker():
+    return import_string(getattr(settings, 'REALTIME_BROKER', 'backend.realtime.InProcessBroker'))()
@@ -0,0 +1,98 @@
+from django.db import connections, router, transaction
+
+from .caching import invalidate_on_commit, object_scope
+from .counters import adjust
+from .feed import backfill_author, remove_author
+from .graph import graph
+from .models import Follow, Like, Post, User
+from .notifications import notify
+from .trending import trending
+
+# Likes and follows as set/unset operations. Each change is a single
+# INSERT ... ON CONFLICT DO NOTHING or DELETE whose row count says whether
+# this request changed anything, so concurrent double-taps cannot raise
+# IntegrityError, count twice or notify twice. These bypass model signals;
+# the cache invalidation and graph updates those would do happen here.
+
+
+def insert_ignore(objs):
+    # The INSERT of bulk_create(ignore_conflicts=True), which does not report
+    # what it wrote; returns the number of rows this statement inserted
+    if not objs:
+        return 0
+    model = type(objs[0])
+    connection = connections[router.db_for_write(model)]
+    fields = [field for field in model._meta.concrete_fields if not field.primary_key]
+    quote = connection.ops.quote_name
+    placeholders = '({})'.format(', '.join(['%s'] * len(fields)))
+    statement = 'INSERT INTO {} ({}) VALUES {} ON CONFLICT DO NOTHING'.format(
+        quote(model._meta.db_table),
+        ', '.join(quote(field.column) for field in fields),
+        ', '.join([placeholders] * len(objs)),
+    )
+    params = [field.get_db_prep_save(field.pre_save(obj, True), connection) for obj in objs for field in fields]
+    with connection.cursor() as cursor:
+        cursor.execute(statement, params)
+        return cursor.rowcount
+
+
+def delete_rows(queryset):
+    # One DELETE statement, without the select-then-delete of QuerySet.delete(); returns the row count
+    return queryset._raw_delete(queryset.db)
+
+
+def like(user, post):
+    with transaction.atomic():
+        created = insert_ignore([Like(user=user, post=post)]) > 0
+        if created:
+            adjust(Post, post.id, likes_count=1)
+            invalidate_on_commit(object_scope(Post, post.id))
+            transaction.on_commit(lambda: trending.record(post.id, 'like'))
+            if post.author_id != user.id:
+                notify(User(id=post.author_id), user, 'like', post=post)
+    return created
+
+
+def unlike(user, post):
+    with transaction.atomic():
+        deleted = delete_rows(Like.objects.filter(user=user, post=post)) > 0
+        if deleted:
+            adjust(Post, post.id, likes_count=-1)
+            invalidate_on_commit(object_scope(Post, post.id))
+    return deleted
+
+
+def _invalidate_follow(user, target):
+    invalidate_on_commit(
+        object_scope(User, user.id),
+        object_scope(User, target.id),
+        f'following:{user.id}',
+        f'followers:{target.id}',
+    )
+
+
+def follow(user, target):
+    with transaction.atomic():
+        created = insert_ignore([Follow(follower=user, following=target)]) > 0
+        if created:
+            adjust(User, user.id, following_count=1)
+            adjust(User, target.id, followers_count=1)
+            _invalidate_follow(user, target)
+            transaction.on_commit(lambda: graph.add(user.id, target.id))
+            notify(target, user, 'follow')
+    if created:
+        backfill_author(user, target)
+    return created
+
+
+def unfollow(user, target):
+    with transaction.atomic():
+        deleted = delete_rows(Follow.objects.filter(follower=user, following=target)) > 0
+        if deleted:
+            adjust(User, user.id, following_count=-1)
+            adjust(User, target.id, followers_count=-1)
+            _invalidate_follow(user, target)
+            transaction.on_commit(lambda: graph.remove(user.id, target.id))
+    if deleted:
+        remove_author(user, target)
+    return deleted
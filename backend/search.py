@@ -0,0 +1,180 @@
+import re
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Case, Q, When
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# Searchable post columns, mapped to the ORM path used by the fallback backend
+POST_COLUMNS = {
+    'content': 'content',
+    'author': 'author__username',
+    'location': 'location',
+}
+
+
+def tokenize(query):
+    return TOKEN_RE.findall(query.lower())
+
+
+def ranked(queryset, ids):
+    # Restrict the queryset to ids and keep the ranking order
+    if not ids:
+        return queryset.none()
+    order = Case(*[When(id=pk, then=position) for position, pk in enumerate(ids)])
+    return queryset.filter(id__in=ids).order_by(order)
+
+
+class SearchBackend:
+    # Interface for the post/user search index. Backends keep the index in
+    # sync through the save/delete signals in backend/signals.py.
+
+    def index_posts(self, posts):
+        raise NotImplementedError
+
+    def remove_post(self, post_id):
+        raise NotImplementedError
+
+    def index_users(self, users):
+        raise NotImplementedError
+
+    def remove_user(self, user_id):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def filter_posts(self, queryset, query, column):
+        # Narrow a Post queryset to rows whose column matches every query token
+        raise NotImplementedError
+
+    def rank_posts(self, query, limit):
+        # Ids of the best matching posts, best first
+        raise NotImplementedError
+
+    def rank_users(self, query, limit):
+        # Ids of the best matching users by username/email prefix, best first
+        raise NotImplementedError
+
+
+class SimpleSearchBackend(SearchBackend):
+    # Index-free fallback for databases without a full-text engine
+
+    def index_posts(self, posts):
+        pass
+
+    def remove_post(self, post_id):
+        pass
+
+    def index_users(self, users):
+        pass
+
+    def remove_user(self, user_id):
+        pass
+
+    def clear(self):
+        pass
+
+    def filter_posts(self, queryset, query, column):
+        for token in tokenize(query):
+            queryset = queryset.filter(**{f'{POST_COLUMNS[column]}__icontains': token})
+        return queryset
+
+    def rank_posts(self, query, limit):
+        from .models import Post
+
+        queryset = Post.objects.all()
+        for token in tokenize(query):
+            queryset = queryset.filter(content__icontains=token)
+        return list(queryset.order_by('-created_at').values_list('id', flat=True)[:limit])
+
+    def rank_users(self, query, limit):
+        from .models import User
+
+        queryset = User.objects.all()
+        for token in tokenize(query):
+            queryset = queryset.filter(Q(username__istartswith=token) | Q(email__istartswith=token))
+        return list(queryset.order_by('username').values_list('id', flat=True)[:limit])
+
+
+class SQLiteFTSBackend(SearchBackend):
+    # Inverted index on SQLite FTS5 virtual tables keyed by the model's id.
+    # The tables are created by migration 0010_search_index.
+    post_table = 'backend_post_fts'
+    user_table = 'backend_user_fts'
+
+    # bm25 column weights, in table column order
+    post_weights = (1.0, 2.0, 1.0)  # content, author, location
+    user_weights = (4.0, 1.0)  # username, email
+
+    @staticmethod
+    def match_expression(query, column=None):
+        tokens = tokenize(query)
+        if not tokens:
+            return None
+        terms = ' '.join(f'"{token}"*' for token in tokens)
+        if column:
+            return f'{column} : ({terms})'
+        return terms
+
+    def index_posts(self, posts):
+        rows = [(post.id, post.content or '', post.author.username, post.location or '') for post in posts]
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'INSERT OR REPLACE INTO {self.post_table}(rowid, content, author, location) VALUES (%s, %s, %s, %s)',
+                rows,
+            )
+
+    def remove_post(self, post_id):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.post_table} WHERE rowid = %s', [post_id])
+
+    def index_users(self, users):
+        rows = [(user.id, user.username, user.email) for user in users]
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'INSERT OR REPLACE INTO {self.user_table}(rowid, username, email) VALUES (%s, %s, %s)',
+                rows,
+            )
+
+    def remove_user(self, user_id):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.user_table} WHERE rowid = %s', [user_id])
+
+    def clear(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.post_table}')
+            cursor.execute(f'DELETE FROM {self.user_table}')
+
+    def filter_posts(self, queryset, query, column):
+        expression = self.match_expression(query, column)
+        if expression is None:
+            return queryset
+        matches = RawSQL(f'SELECT rowid FROM {self.post_table} WHERE {self.post_table} MATCH %s', [expression])
+        return queryset.filter(id__in=matches)
+
+    def rank_posts(self, query, limit):
+        return self._rank(self.post_table, self.post_weights, self.match_expression(query), limit)
+
+    def rank_users(self, query, limit):
+        return self._rank(self.user_table, self.user_weights, self.match_expression(query), limit)
+
+    def _rank(self, table, weights, expression, limit):
+        if expression is None:
+            return []
+        weight_args = ', '.join(str(weight) for weight in weights)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid FROM {table} WHERE {table} MATCH %s ORDER BY bm25({table}, {weight_args}) LIMIT %s',
+                [expression, limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+
+@lru_cache(maxsize=None)
+def get_backend():
+    return import_string(getattr(settings, 'SEARCH_BACKEND', 'backend.search.SQLiteFTSBackend'))()
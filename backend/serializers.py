@@ -1,7 +1,9 @@
 from rest_framework import serializers
-from .models import Post, User, Comment, Notification, Conversation, Message
+from .models import Post, User, Comment, Notification, Conversation, Message, UploadSession
+from .instrumentation import TimedSerializerMixin
+from .media import rendition_urls, versioned_url
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     password = serializers.CharField(write_only=True)
 
     class Meta:
@@ -15,50 +17,100 @@ class UserSerializer(serializers.ModelSerializer):
         user.save()
         return user
     
-class UserListSerializer(serializers.ModelSerializer):
+class UserListSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ['id', 'username', 'email', 'bio', 'profile_pic', 'is_staff', 'is_superuser']
 
-class UserProfileSerializer(serializers.ModelSerializer):
-
-    followers_count = serializers.SerializerMethodField()
-    following_count = serializers.SerializerMethodField()
+class UserProfileSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    profile_pic_media = serializers.SerializerMethodField()
 
     class Meta:
         model = User
-        fields = ['id', 'username', 'email', 'bio', 'profile_pic', 'followers_count', 'following_count']
-        read_only_fields = ['id', 'username', 'email']
+        fields = ['id', 'username', 'email', 'bio', 'profile_pic', 'profile_pic_media', 'followers_count', 'following_count', 'posts_count']
+        read_only_fields = ['id', 'username', 'email', 'followers_count', 'following_count', 'posts_count']
+
+    # Saves only the editable columns: the counters on this instance may be
+    # older than the row, which backend.counters updates in place
+    def update(self, user, validated_data):
+        for field, value in validated_data.items():
+            setattr(user, field, value)
+        user.save(update_fields=list(validated_data))
+        return user
 
-    def get_followers_count(self, user):
-        return user.followers.count()
+    def get_profile_pic_media(self, user):
+        return rendition_urls(user.profile_pic_asset, self.context.get('request'))
 
-    def get_following_count(self, user):
-        return user.following.count()
+    def to_representation(self, user):
+        data = super().to_representation(user)
+        data['profile_pic'] = versioned_url(data['profile_pic'], user.profile_pic, user.profile_pic_asset)
+        return data
     
-class PostSerializer(serializers.ModelSerializer):
+class PostSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     author = serializers.ReadOnlyField(source='author.username')
-    likes_count = serializers.SerializerMethodField()
     user_has_liked = serializers.SerializerMethodField()
+    image_media = serializers.SerializerMethodField()
+    video_media = serializers.SerializerMethodField()
+    # Optional coordinates of the location, stored on its Place (backend.places)
+    latitude = serializers.FloatField(write_only=True, required=False, min_value=-90, max_value=90)
+    longitude = serializers.FloatField(write_only=True, required=False, min_value=-180, max_value=180)
 
     class Meta:
         model = Post
         fields = [
-            'id', 'author', 'content', 'image', 'video', 'location', 'emojis', 'created_at',
-            'likes_count', 'user_has_liked'
+            'id', 'author', 'content', 'image', 'image_media', 'video', 'video_media', 'location', 'place', 'emojis',
+            'created_at', 'likes_count', 'comments_count', 'user_has_liked', 'latitude', 'longitude',
         ]
-        read_only_fields = ['id', 'author', 'created_at']
+        read_only_fields = ['id', 'author', 'place', 'created_at', 'likes_count', 'comments_count']
 
-    def get_likes_count(self, post):
-        return post.likes.count()
+    def validate(self, attrs):
+        if ('latitude' in attrs) != ('longitude' in attrs):
+            raise serializers.ValidationError("Send both latitude and longitude, or neither.")
+        return attrs
 
+    # The coordinates are read by the views, not saved on the post
+    def create(self, validated_data):
+        validated_data.pop('latitude', None)
+        validated_data.pop('longitude', None)
+        return super().create(validated_data)
+
+    # Saves only the edited columns, as UserProfileSerializer.update does:
+    # likes_count and comments_count may have moved on since the post was read
+    def update(self, post, validated_data):
+        validated_data.pop('latitude', None)
+        validated_data.pop('longitude', None)
+        if 'place' in validated_data and getattr(validated_data['place'], 'id', None) == post.place_id:
+            del validated_data['place']
+        for field, value in validated_data.items():
+            setattr(post, field, value)
+        post.save(update_fields=list(validated_data))
+        return post
+
+    # Renditions are filled in asynchronously; None until processing finishes
+    def get_image_media(self, post):
+        return rendition_urls(post.image_asset, self.context.get('request'))
+
+    def get_video_media(self, post):
+        return rendition_urls(post.video_asset, self.context.get('request'))
+
+    # Processed files get a content-hashed URL that can be cached forever
+    def to_representation(self, post):
+        data = super().to_representation(post)
+        data['image'] = versioned_url(data['image'], post.image, post.image_asset)
+        data['video'] = versioned_url(data['video'], post.video, post.video_asset)
+        return data
+
+    # Listing views annotate this via Post.objects.with_feed_annotations();
+    # freshly created or updated instances fall back to a query.
     def get_user_has_liked(self, post):
+        if hasattr(post, 'user_has_liked'):
+            return post.user_has_liked
         request = self.context.get('request')
         if request and request.user.is_authenticated:
             return post.likes.filter(user=request.user).exists()
         return False
 
-class CommentSerializer(serializers.ModelSerializer):
+class CommentSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     author = serializers.ReadOnlyField(source='author.username')
 
     class Meta:
@@ -66,16 +118,16 @@ class CommentSerializer(serializers.ModelSerializer):
         fields = ['id', 'author', 'content', 'created_at']
         read_only_fields = ['id', 'author', 'created_at']
 
-class NotificationSerializer(serializers.ModelSerializer):
+class NotificationSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     actor = serializers.ReadOnlyField(source='actor.username')
-    post_id = serializers.IntegerField(source='post.id', read_only=True)
+    post_id = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = Notification
-        fields = ['id', 'actor', 'notification_type', 'post_id', 'is_read', 'created_at']
-        read_only_fields = ['id', 'actor', 'post_id', 'created_at']
+        fields = ['id', 'actor', 'others_count', 'notification_type', 'post_id', 'is_read', 'created_at']
+        read_only_fields = ['id', 'actor', 'others_count', 'post_id', 'created_at']
 
-class MessageSerializer(serializers.ModelSerializer):
+class MessageSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     sender = serializers.ReadOnlyField(source='sender.username')
 
     class Meta:
@@ -83,7 +135,7 @@ class MessageSerializer(serializers.ModelSerializer):
         fields = ['id', 'sender', 'content', 'is_read', 'created_at']
         read_only_fields = ['id', 'sender', 'created_at']
 
-class ConversationSerializer(serializers.ModelSerializer):
+class ConversationSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     participants = serializers.SerializerMethodField()
     last_message = serializers.SerializerMethodField()
     unread_count = serializers.SerializerMethodField()
@@ -93,17 +145,30 @@ class ConversationSerializer(serializers.ModelSerializer):
         fields = ['id', 'participants', 'last_message', 'unread_count', 'created_at', 'updated_at']
         read_only_fields = ['id', 'created_at', 'updated_at']
 
+    # ConversationListView prefetches participants, joins last_message and
+    # annotates unread_count; single conversations fall back to queries.
     def get_participants(self, conversation):
         return [{'id': user.id, 'username': user.username} for user in conversation.participants.all()]
 
     def get_last_message(self, conversation):
-        last_msg = conversation.messages.last()
-        if last_msg:
-            return MessageSerializer(last_msg).data
+        if conversation.last_message_id:
+            return MessageSerializer(conversation.last_message).data
         return None
 
     def get_unread_count(self, conversation):
+        if hasattr(conversation, 'unread_count'):
+            return conversation.unread_count
         request = self.context.get('request')
         if request and request.user.is_authenticated:
-            return conversation.messages.filter(is_read=False).exclude(sender=request.user).count()
-        return 0
\ No newline at end of file
+            membership = conversation.memberships.filter(user=request.user).values_list('unread_count', flat=True).first()
+            return membership or 0
+        return 0
+
+class UploadSessionSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    offset = serializers.IntegerField(source='received', read_only=True)
+
+    class Meta:
+        model = UploadSession
+        fields = ['id', 'filename', 'total_size', 'offset', 'sha256', 'status', 'created_at']
+        read_only_fields = ['id', 'offset', 'status', 'created_at']
+        extra_kwargs = {'total_size': {'min_value': 1}}
@@ -0,0 +1,172 @@
+from django.db import transaction
+from django.db.models import Count
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .authentication import revoke_user_tokens, user_cache
+from .caching import invalidate_on_commit, object_scope
+from .graph import graph
+from .media import MEDIA_FIELDS, needs_processing, schedule
+from .models import Comment, Follow, Like, Notification, Post, User
+from .realtime import get_broker, user_topic
+from .search import get_backend
+from .trending import trending
+
+
+# Keep the search index in sync with posts and users
+@receiver(post_save, sender=Post)
+def add_post_to_search(sender, instance, **kwargs):
+    get_backend().index_posts([instance])
+
+
+@receiver(post_delete, sender=Post)
+def remove_post_from_search(sender, instance, **kwargs):
+    get_backend().remove_post(instance.id)
+
+
+@receiver(post_save, sender=User)
+def add_user_to_search(sender, instance, **kwargs):
+    get_backend().index_users([instance])
+
+
+@receiver(post_delete, sender=User)
+def remove_user_from_search(sender, instance, **kwargs):
+    get_backend().remove_user(instance.id)
+
+
+# Hand new uploads to the media pipeline
+@receiver(post_save, sender=Post)
+@receiver(post_save, sender=User)
+def process_media(sender, instance, **kwargs):
+    for field_name, asset_field in MEDIA_FIELDS[sender.__name__]:
+        if needs_processing(instance, field_name, asset_field):
+            schedule(instance, field_name, asset_field)
+
+
+# Drop cached responses that show the written rows or their counters
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def invalidate_post(sender, instance, **kwargs):
+    invalidate_on_commit(object_scope(Post, instance.id), object_scope(User, instance.author_id), 'posts')
+
+
+@receiver(post_save, sender=Like)
+@receiver(post_delete, sender=Like)
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_post_counters(sender, instance, **kwargs):
+    invalidate_on_commit(object_scope(Post, instance.post_id))
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def invalidate_follow(sender, instance, **kwargs):
+    invalidate_on_commit(
+        object_scope(User, instance.follower_id),
+        object_scope(User, instance.following_id),
+        f'following:{instance.follower_id}',
+        f'followers:{instance.following_id}',
+    )
+
+
+# Keep the in-memory follow graph behind /api/suggestions/ current. The
+# like/follow endpoints write with plain SQL and update it themselves.
+@receiver(post_save, sender=Follow)
+def add_follow_edge(sender, instance, created, **kwargs):
+    if created:
+        transaction.on_commit(lambda: graph.add(instance.follower_id, instance.following_id))
+
+
+@receiver(post_delete, sender=Follow)
+def remove_follow_edge(sender, instance, **kwargs):
+    transaction.on_commit(lambda: graph.remove(instance.follower_id, instance.following_id))
+
+
+# Feed new posts, likes and comments into the trending ranking. Likes made
+# through the like endpoints bypass signals and are recorded there.
+@receiver(post_save, sender=Post)
+def rank_post(sender, instance, created, **kwargs):
+    if created:
+        transaction.on_commit(lambda: trending.add_post(instance))
+
+
+@receiver(post_delete, sender=Post)
+def unrank_post(sender, instance, **kwargs):
+    transaction.on_commit(lambda: trending.discard(instance.id))
+
+
+@receiver(post_save, sender=Like)
+@receiver(post_save, sender=Comment)
+def rank_engagement(sender, instance, created, **kwargs):
+    if created:
+        kind = 'like' if sender is Like else 'comment'
+        transaction.on_commit(lambda: trending.record(instance.post_id, kind))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user(sender, instance, **kwargs):
+    invalidate_on_commit(object_scope(User, instance.id))
+
+
+# Authenticated requests reuse cached user rows; drop them when the row
+# changes, and shut out every token of a deactivated user
+@receiver(post_save, sender=User)
+def refresh_cached_user(sender, instance, **kwargs):
+    user_cache.discard(instance.pk)
+    if not instance.is_active:
+        transaction.on_commit(lambda: revoke_user_tokens(instance.pk))
+
+
+@receiver(post_delete, sender=User)
+def forget_cached_user(sender, instance, **kwargs):
+    user_cache.discard(instance.pk)
+
+
+# Push unread counts to connected websocket clients when a notification is
+# marked read. New notifications are bulk-written by backend.notifications,
+# which calls publish_notifications() itself.
+@receiver(post_save, sender=Notification)
+def push_unread_count(sender, instance, created, **kwargs):
+    if not created:
+        transaction.on_commit(lambda: publish_unread_count(instance.recipient_id))
+
+
+def publish_unread_count(recipient_id):
+    broker = get_broker()
+    topic = user_topic(recipient_id)
+    if broker.has_subscribers(topic):
+        broker.publish(topic, {'type': 'unread_count', 'unread_count': unread_count(recipient_id)})
+
+
+def publish_notifications(notifications):
+    from .serializers import NotificationSerializer
+
+    broker = get_broker()
+    recipients = {notification.recipient_id for notification in notifications}
+    subscribed = {recipient_id for recipient_id in recipients if broker.has_subscribers(user_topic(recipient_id))}
+    if not subscribed:
+        return
+
+    fresh = Notification.objects.filter(
+        id__in=[notification.id for notification in notifications if notification.recipient_id in subscribed],
+    ).select_related('actor').order_by('created_at')
+    grouped = {}
+    for notification in fresh:
+        grouped.setdefault(notification.recipient_id, []).append(notification)
+    unread = dict(
+        Notification.objects.filter(recipient_id__in=grouped, is_read=False)
+        .values('recipient_id').annotate(count=Count('id')).values_list('recipient_id', 'count')
+    )
+    for recipient_id, recipient_notifications in grouped.items():
+        topic = user_topic(recipient_id)
+        for notification in recipient_notifications:
+            broker.publish(topic, {
+                'type': 'notification',
+                'notification': NotificationSerializer(notification).data,
+                'unread_count': unread.get(recipient_id, 0),
+            })
+
+
+def unread_count(recipient_id):
+    return Notification.objects.filter(recipient_id=recipient_id, is_read=False).count()
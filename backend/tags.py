@@ -0,0 +1,84 @@
+import re
+import unicodedata
+
+from django.db import transaction
+
+from .models import Mention, Post, Tag, User
+from .notifications import notify
+
+# #hashtags and @mentions in post text, kept in the Tag and Mention tables so
+# that tag timelines are an index range scan instead of a substring search.
+# Posts are indexed as they are created and re-indexed when edited; only the
+# rows that changed are written, and only newly mentioned users are notified.
+
+# Not preceded by a word character, so e-mail addresses and "a#b" are skipped
+HASHTAG_RE = re.compile(r'(?<![\w#])#(\w+)')
+MENTION_RE = re.compile(r'(?<![\w@])@(\w+(?:[.+-]\w+)*)')
+TAG_MAX_LENGTH = Tag._meta.get_field('name').max_length
+
+
+def normalize_tag(tag):
+    # "#Café", "café" and "CAFÉ" are the same tag
+    return unicodedata.normalize('NFKC', tag.lstrip('#')).casefold()
+
+
+def extract_tags(text):
+    tags = {normalize_tag(match) for match in HASHTAG_RE.findall(text or '')}
+    # "#1" is a number, not a topic
+    return {tag for tag in tags if not tag.isdigit() and len(tag) <= TAG_MAX_LENGTH}
+
+
+def extract_mentions(text):
+    return set(MENTION_RE.findall(text or ''))
+
+
+def index_posts(posts, notify_mentions=False):
+    # Brings the Tag and Mention rows of these posts in line with their text,
+    # in a fixed number of queries per batch
+    posts = list(posts)
+    if not posts:
+        return
+    by_id = {post.id: post for post in posts}
+    wanted_tags = {(post.id, tag) for post in posts for tag in extract_tags(post.content)}
+    usernames = {post.id: extract_mentions(post.content) for post in posts}
+    user_ids = dict(User.objects.filter(
+        username__in={name for names in usernames.values() for name in names},
+    ).values_list('username', 'id'))
+    wanted_mentions = {
+        (post_id, user_ids[name]) for post_id, names in usernames.items() for name in names
+        # Authors mentioning themselves are not recorded
+        if name in user_ids and user_ids[name] != by_id[post_id].author_id
+    }
+
+    with transaction.atomic():
+        tags = {
+            (post_id, name): row_id
+            for row_id, post_id, name in Tag.objects.filter(post_id__in=by_id).values_list('id', 'post_id', 'name')
+        }
+        mentions = {
+            (post_id, user_id): row_id
+            for row_id, post_id, user_id in Mention.objects.filter(post_id__in=by_id).values_list('id', 'post_id', 'user_id')
+        }
+        stale_tags = [row_id for key, row_id in tags.items() if key not in wanted_tags]
+        if stale_tags:
+            Tag.objects.filter(id__in=stale_tags).delete()
+        stale_mentions = [row_id for key, row_id in mentions.items() if key not in wanted_mentions]
+        if stale_mentions:
+            Mention.objects.filter(id__in=stale_mentions).delete()
+
+        Tag.objects.bulk_create(
+            [Tag(post_id=post_id, name=name, created_at=by_id[post_id].created_at) for post_id, name in wanted_tags - tags.keys()],
+            ignore_conflicts=True,
+        )
+        new_mentions = wanted_mentions - mentions.keys()
+        Mention.objects.bulk_create(
+            [Mention(post_id=post_id, user_id=user_id, created_at=by_id[post_id].created_at) for post_id, user_id in new_mentions],
+            ignore_conflicts=True,
+        )
+        if notify_mentions:
+            for post_id, user_id in new_mentions:
+                notify(User(id=user_id), User(id=by_id[post_id].author_id), 'mention', post=Post(id=post_id))
+
+
+def index_post(post, notify_mentions=True):
+    index_posts([post], notify_mentions=notify_mentions)
@@ -1,3 +1,1619 @@
-from django.test import TestCase
+import asyncio
+import base64
+import hashlib
+import io
+import json
+import math
+import os
+import re
+import tempfile
+import threading
+from datetime import timedelta
+from unittest import mock, skipUnless
+from urllib.parse import urlencode
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.checks import run_checks
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import path, resolve
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import benchmarks, media, uploads
+from .authentication import user_cache
+from .consumers import WebSocket, websocket_application
+from .feed import FEED_FANOUT_FOLLOWER_LIMIT
+from .graph import FollowGraph
+from .instrumentation import registry, view_name
+from .messaging import mark_read, send_message
+from .models import Comment, Conversation, ConversationParticipant, FeedEntry, Follow, Like, MediaAsset, Mention, Message, Notification, Place, Post, Tag, UploadSession, User
+from .notifications import NotificationEvent, NotificationPipeline, get_pipeline, write_batch
+from .places import KM_PER_DEGREE, PlaceIndex, cell_degrees, covering_cells, distance_km, geohash, place_key
+from .realtime import user_topic
+from .search import get_backend
+from .serializers import PostSerializer
+from .signals import publish_notifications
+from .tags import extract_mentions, extract_tags
+from .trending import TrendingIndex
+from .views import PostListCreateView, serve_media
+
+# A full table scan shows up as "SCAN <table>" without an index in SQLite's
+# EXPLAIN QUERY PLAN output; index scans read "SCAN <table> USING INDEX ...".
+TABLE_SCAN_RE = re.compile(r'\bSCAN (\w+)(?! USING)(?! VIRTUAL TABLE)\b')
+
+
+def query_plan(sql, params=()):
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+        return '\n'.join(row[-1] for row in cursor.fetchall())
+
+
+def inline_notifications(test):
+    # Writes queued notifications in the test's own transaction instead of
+    # from the background worker, which cannot see (or wait for) it
+    test.enterContext(mock.patch('backend.notifications._pipeline', NotificationPipeline(run_async=False)))
+
+
+@skipUnless(connection.vendor == 'sqlite', 'query plans are checked against SQLite')
+class QueryPlanTests(TestCase):
+    # The queries behind the hot endpoints must be index lookups or index
+    # range scans, never full table scans
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = User.objects.create_user(username='alice', email='alice@example.com', password='secret')
+        cls.bob = User.objects.create_user(username='bob', email='bob@example.com', password='secret')
+        Follow.objects.create(follower=cls.alice, following=cls.bob)
+        cls.place = Place.objects.create(key='paris', name='Paris', posts_count=1)
+        cls.post = Post.objects.create(author=cls.bob, content='hello world #greetings', location='Paris', place=cls.place)
+        Tag.objects.create(name='greetings', post=cls.post, created_at=cls.post.created_at)
+        Comment.objects.create(post=cls.post, author=cls.alice, content='hi')
+        Notification.objects.create(recipient=cls.bob, actor=cls.alice, notification_type='like', post=cls.post)
+        cls.conversation = Conversation.objects.create()
+        ConversationParticipant.objects.create(conversation=cls.conversation, user=cls.alice)
+        ConversationParticipant.objects.create(conversation=cls.conversation, user=cls.bob)
+        Message.objects.create(conversation=cls.conversation, sender=cls.alice, content='hey')
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def plans_for(self, user, method, url, **kwargs):
+        self.client.force_authenticate(user)
+        with CaptureQueriesContext(connection) as context:
+            response = getattr(self.client, method)(url, **kwargs)
+        self.assertLess(response.status_code, 400, response.content)
+        plans = []
+        for query in context.captured_queries:
+            sql = query['sql']
+            if sql.split(None, 1)[0].upper() in ('SELECT', 'UPDATE', 'DELETE'):
+                plans.append((sql, query_plan(sql)))
+        return plans
+
+    def assertNoTableScans(self, user, method, url, **kwargs):
+        plans = self.plans_for(user, method, url, **kwargs)
+        for sql, plan in plans:
+            self.assertIsNone(TABLE_SCAN_RE.search(plan), f'{sql}\n{plan}')
+        return plans
+
+    def assertUsesIndex(self, plans, index_name):
+        self.assertTrue(any(index_name in plan for sql, plan in plans), f'{index_name} not used by:\n' + '\n'.join(plan for sql, plan in plans))
+
+    def test_feed(self):
+        self.assertNoTableScans(self.alice, 'get', '/api/feed/')
+
+    def test_feed_with_high_follower_author(self):
+        User.objects.filter(id=self.bob.id).update(followers_count=10 ** 6)
+        self.assertNoTableScans(self.alice, 'get', '/api/feed/')
+
+    def test_author_posts(self):
+        plan = query_plan(*Post.objects.filter(author=self.bob).order_by('-created_at', '-id')[:20].query.sql_with_params())
+        self.assertIn('post_author_created_idx', plan)
+
+    def test_post_list(self):
+        plans = self.assertNoTableScans(self.alice, 'get', '/api/posts/')
+        self.assertUsesIndex(plans, 'post_created_idx')
+
+    def test_post_detail(self):
+        self.assertNoTableScans(self.alice, 'get', f'/api/posts/{self.post.id}/')
+
+    def test_post_edit(self):
+        self.assertNoTableScans(self.bob, 'patch', f'/api/posts/{self.post.id}/', data={'content': 'hi @alice #hello', 'location': 'Lyon'})
+
+    def test_tag_timeline(self):
+        plans = self.assertNoTableScans(self.alice, 'get', '/api/tags/Greetings/')
+        self.assertUsesIndex(plans, 'tag_name_created_idx')
+
+    def test_place_timeline(self):
+        plans = self.assertNoTableScans(self.alice, 'get', f'/api/places/{self.place.id}/posts/')
+        self.assertUsesIndex(plans, 'post_place_created_idx')
+
+    def test_comments(self):
+        plans = self.assertNoTableScans(self.alice, 'get', f'/api/posts/{self.post.id}/comments/')
+        self.assertUsesIndex(plans, 'comment_post_created_idx')
+
+    def test_like_toggle(self):
+        self.assertNoTableScans(self.alice, 'post', f'/api/posts/{self.post.id}/like/')
+
+    def test_follow_toggle(self):
+        self.assertNoTableScans(self.alice, 'post', f'/api/follow/{self.bob.id}/')
+
+    def test_toggles_write_with_one_statement(self):
+        self.client.force_authenticate(self.alice)
+        for method in ('put', 'delete'):
+            with CaptureQueriesContext(connection) as context:
+                self.assertEqual(getattr(self.client, method)(f'/api/posts/{self.post.id}/like/').status_code, 200)
+            touching = [query['sql'].split(None, 1)[0] for query in context.captured_queries if '"backend_like"' in query['sql']]
+            self.assertEqual(touching, ['INSERT' if method == 'put' else 'DELETE'])
+
+    def test_followers(self):
+        self.assertNoTableScans(self.alice, 'get', f'/api/users/{self.bob.id}/followers/')
+
+    def test_profile(self):
+        self.assertNoTableScans(self.alice, 'get', '/api/profile/')
+
+    def test_notifications(self):
+        plans = self.assertNoTableScans(self.bob, 'get', '/api/notifications/')
+        self.assertUsesIndex(plans, 'notif_recipient_created_idx')
+
+    def test_unread_count(self):
+        plans = self.assertNoTableScans(self.bob, 'get', '/api/notifications/unread-count/')
+        self.assertUsesIndex(plans, 'notif_unread_idx')
+
+    def test_conversations(self):
+        self.assertNoTableScans(self.alice, 'get', '/api/conversations/')
+
+    def test_conversation_history(self):
+        plans = self.assertNoTableScans(self.alice, 'get', f'/api/conversations/{self.conversation.id}/')
+        self.assertUsesIndex(plans, 'message_conv_created_idx')
+
+    def test_mark_conversation_read(self):
+        plans = self.assertNoTableScans(self.bob, 'post', f'/api/conversations/{self.conversation.id}/mark-read/')
+        self.assertUsesIndex(plans, 'message_unread_idx')
+
+
+class ConcurrentToggleTests(TransactionTestCase):
+    # Many clients setting the same like or follow at once must produce one
+    # row, a matching counter and a single notification
+    THREADS = 16
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='author', email='author@example.com', password='secret')
+        self.fan = User.objects.create_user(username='fan', email='fan@example.com', password='secret')
+        self.post = Post.objects.create(author=self.author, content='hello world')
+
+    def hammer(self, method, url, data=None):
+        # Sends the same request from THREADS threads released together
+        barrier = threading.Barrier(self.THREADS)
+        responses = []
+
+        def worker():
+            client = APIClient()
+            client.force_authenticate(self.fan)
+            barrier.wait()
+            try:
+                responses.append(getattr(client, method)(url, data, format='json'))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        get_pipeline().flush()
+        self.assertEqual([response.status_code for response in responses], [200] * self.THREADS)
+        return [response.data for response in responses]
+
+    def test_concurrent_likes(self):
+        results = self.hammer('put', f'/api/posts/{self.post.id}/like/')
+        self.assertEqual(sum(result['changed'] for result in results), 1)
+        self.assertEqual(Like.objects.filter(post=self.post).count(), 1)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes_count, 1)
+        self.assertEqual(Notification.objects.filter(recipient=self.author, notification_type='like').count(), 1)
+
+        results = self.hammer('delete', f'/api/posts/{self.post.id}/like/')
+        self.assertEqual(sum(result['changed'] for result in results), 1)
+        self.assertFalse(Like.objects.filter(post=self.post).exists())
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes_count, 0)
+
+    def test_concurrent_follows(self):
+        results = self.hammer('put', f'/api/follow/{self.author.id}/')
+        self.assertEqual(sum(result['changed'] for result in results), 1)
+        self.assertEqual(Follow.objects.filter(follower=self.fan, following=self.author).count(), 1)
+        self.author.refresh_from_db()
+        self.fan.refresh_from_db()
+        self.assertEqual((self.author.followers_count, self.fan.following_count), (1, 1))
+        self.assertEqual(Notification.objects.filter(recipient=self.author, notification_type='follow').count(), 1)
+
+        results = self.hammer('delete', f'/api/follow/{self.author.id}/')
+        self.assertEqual(sum(result['changed'] for result in results), 1)
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.followers_count, 0)
+
+    def test_concurrent_batches(self):
+        other = Post.objects.create(author=self.author, content='second')
+        operations = [{'post_id': self.post.id, 'action': 'like'}, {'post_id': other.id, 'action': 'like'}]
+        results = self.hammer('post', '/api/posts/likes/batch/', {'operations': operations})
+        statuses = [result['status'] for response in results for result in response['results']]
+        self.assertEqual(statuses.count('liked'), 2)
+        self.assertEqual(statuses.count('already_liked'), 2 * self.THREADS - 2)
+        self.assertEqual(Notification.objects.filter(recipient=self.author, notification_type='like').count(), 2)
+        self.assertEqual(list(Post.objects.order_by('id').values_list('likes_count', flat=True)), [1, 1])
+
+        results = self.hammer('post', '/api/follow/batch/', {'operations': [{'user_id': self.author.id, 'action': 'follow'}]})
+        self.assertEqual([response['results'][0]['status'] for response in results].count('followed'), 1)
+        self.assertEqual(Notification.objects.filter(recipient=self.author, notification_type='follow').count(), 1)
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.followers_count, 1)
+
+
+class FeedTests(TestCase):
+    # Posts reach follower timelines on write, except those of high-audience
+    # authors, which are merged in on read
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='author', email='author@example.com', password='secret')
+        self.reader = User.objects.create_user(username='reader', email='reader@example.com', password='secret')
+        self.other = User.objects.create_user(username='other', email='other@example.com', password='secret')
+        Follow.objects.create(follower=self.reader, following=self.author)
+        self.client = APIClient()
+
+    def post_as(self, user, content):
+        self.client.force_authenticate(user)
+        response = self.client.post('/api/posts/', {'content': content}, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        return response.data['id']
+
+    def feed_ids(self, user):
+        self.client.force_authenticate(user)
+        response = self.client.get('/api/feed/')
+        self.assertEqual(response.status_code, 200)
+        return [post['id'] for post in response.data['results']]
+
+    def test_fan_out(self):
+        post_id = self.post_as(self.author, 'hello')
+        self.assertEqual(list(FeedEntry.objects.values_list('user_id', 'post_id')), [(self.reader.id, post_id)])
+        self.assertEqual(self.feed_ids(self.reader), [post_id])
+        self.assertEqual(self.feed_ids(self.other), [])
+
+    def test_trim_bound(self):
+        with mock.patch('backend.feed.FEED_MAX_ENTRIES', 3):
+            post_ids = [self.post_as(self.author, f'post {index}') for index in range(5)]
+            # Fan-out leaves trimming to the periodic job; readers still see only the newest rows
+            self.assertEqual(FeedEntry.objects.filter(user=self.reader).count(), 5)
+            self.assertEqual(self.feed_ids(self.reader), post_ids[:-4:-1])
+
+            call_command('trim_feeds', stdout=open(os.devnull, 'w'))
+            self.assertEqual(
+                sorted(FeedEntry.objects.filter(user=self.reader).values_list('post_id', flat=True)),
+                post_ids[2:],
+            )
+            self.assertEqual(self.feed_ids(self.reader), post_ids[:-4:-1])
+
+    def test_rebuild(self):
+        Follow.objects.create(follower=self.reader, following=self.other)
+        post_ids = [self.post_as(author, 'hello') for author in (self.author, self.other, self.reader)]
+        FeedEntry.objects.all().delete()
+        # One backfill for all followed authors, not one per author
+        with self.assertNumQueries(6):
+            call_command('rebuild_feeds', user=self.reader.id, stdout=open(os.devnull, 'w'))
+        self.assertEqual(self.feed_ids(self.reader), post_ids[1::-1])
+
+    def test_high_follower_author_is_pulled(self):
+        User.objects.filter(id=self.author.id).update(followers_count=FEED_FANOUT_FOLLOWER_LIMIT)
+        self.author.refresh_from_db()
+        post_id = self.post_as(self.author, 'to everyone')
+        self.assertFalse(FeedEntry.objects.exists())
+        self.assertEqual(self.feed_ids(self.reader), [post_id])
+        self.assertEqual(self.feed_ids(self.other), [])
+
+
+class CounterTests(TestCase):
+    # The denormalized counters follow every write path and can be repaired
+
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user(username='alice', email='alice@example.com', password='secret')
+        self.bob = User.objects.create_user(username='bob', email='bob@example.com', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def counts(self, user):
+        user.refresh_from_db()
+        return user.followers_count, user.following_count, user.posts_count
+
+    def test_user_counters(self):
+        self.client.put(f'/api/follow/{self.bob.id}/')
+        self.client.put(f'/api/follow/{self.bob.id}/')
+        self.assertEqual(self.counts(self.alice), (0, 1, 0))
+        self.assertEqual(self.counts(self.bob), (1, 0, 0))
+
+        post_id = self.client.post('/api/posts/', {'content': 'hello'}, format='json').data['id']
+        self.assertEqual(self.counts(self.alice), (0, 1, 1))
+        self.client.delete(f'/api/posts/{post_id}/')
+        self.client.delete(f'/api/follow/{self.bob.id}/')
+        self.assertEqual(self.counts(self.alice), (0, 0, 0))
+        self.assertEqual(self.counts(self.bob), (0, 0, 0))
+
+    def test_post_counters(self):
+        post = Post.objects.create(author=self.bob, content='hello')
+        self.client.put(f'/api/posts/{post.id}/like/')
+        comment_id = self.client.post(f'/api/posts/{post.id}/comments/', {'content': 'hi'}, format='json').data['id']
+        self.client.post(f'/api/posts/{post.id}/comments/', {'content': 'again'}, format='json')
+        post.refresh_from_db()
+        self.assertEqual((post.likes_count, post.comments_count), (1, 2))
+
+        self.client.delete(f'/api/posts/{post.id}/like/')
+        self.client.delete(f'/api/posts/{post.id}/comments/{comment_id}/')
+        post.refresh_from_db()
+        self.assertEqual((post.likes_count, post.comments_count), (0, 1))
+
+    def test_edit_keeps_concurrent_counts(self):
+        post = Post.objects.create(author=self.alice, content='hello', location='Paris')
+        original_validate = PostSerializer.validate
+
+        def like_meanwhile(serializer, attrs):
+            # A like and a comment land after the edit has loaded the post
+            Post.objects.filter(id=post.id).update(likes_count=3, comments_count=2)
+            return original_validate(serializer, attrs)
+
+        with mock.patch.object(PostSerializer, 'validate', like_meanwhile):
+            response = self.client.patch(f'/api/posts/{post.id}/', {'content': 'edited', 'location': 'Lyon'}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        post.refresh_from_db()
+        self.assertEqual((post.content, post.location, post.place.name), ('edited', 'Lyon', 'Lyon'))
+        self.assertEqual((post.likes_count, post.comments_count), (3, 2))
+
+    def test_counters_never_go_negative(self):
+        post = Post.objects.create(author=self.bob, content='hello')
+        Like.objects.create(user=self.alice, post=post)
+        self.client.delete(f'/api/posts/{post.id}/like/')
+        post.refresh_from_db()
+        self.assertEqual(post.likes_count, 0)
+
+    def test_recount_repairs_drift(self):
+        Follow.objects.create(follower=self.alice, following=self.bob)
+        post = Post.objects.create(author=self.bob, content='hello')
+        Like.objects.create(user=self.alice, post=post)
+        User.objects.filter(id=self.bob.id).update(followers_count=7, posts_count=0)
+
+        call_command('recount_counters', stdout=open(os.devnull, 'w'))
+        self.assertEqual(self.counts(self.bob), (1, 0, 1))
+        self.assertEqual(self.counts(self.alice), (0, 1, 0))
+        post.refresh_from_db()
+        self.assertEqual(post.likes_count, 1)
+
+
+class CursorTests(TestCase):
+    # Keyset cursors round-trip, and tampered ones are a 404, never a 500
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = User.objects.create_user(username='alice', email='alice@example.com', password='secret')
+        cls.bob = User.objects.create_user(username='bob', email='bob@example.com', password='secret')
+        Follow.objects.create(follower=cls.alice, following=cls.bob)
+        cls.posts = [Post.objects.create(author=cls.bob, content=f'post {index}') for index in range(5)]
+        for post in cls.posts:
+            Notification.objects.create(recipient=cls.bob, actor=cls.alice, notification_type='like', post=post)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.bob)
+
+    def cursor(self, payload):
+        return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+    def test_round_trip(self):
+        expected = [post.id for post in reversed(self.posts)]
+        response = self.client.get('/api/posts/?page_size=2')
+        seen = [post['id'] for post in response.data['results']]
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            seen += [post['id'] for post in response.data['results']]
+        self.assertEqual(seen, expected)
+
+        previous = self.client.get(response.data['previous'])
+        self.assertEqual([post['id'] for post in previous.data['results']], expected[2:4])
+
+    def test_follow_lists_page_in_follow_order(self):
+        # Followed in the reverse of signup order, all at the same instant
+        fans = [User.objects.create_user(username=f'fan{index}', email=f'fan{index}@example.com', password='secret') for index in range(5)]
+        at = timezone.now()
+        for fan in reversed(fans):
+            Follow.objects.create(follower=fan, following=self.alice)
+        Follow.objects.filter(following=self.alice).update(created_at=at)
+        response = self.client.get(f'/api/users/{self.alice.id}/followers/?page_size=2')
+        seen = [user['id'] for user in response.data['results']]
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            seen += [user['id'] for user in response.data['results']]
+        self.assertEqual(seen, [fan.id for fan in fans])
+
+    def test_tampered_cursor(self):
+        now = self.posts[0].created_at.isoformat()
+        cursors = [
+            'not base64!', self.cursor([1, 2]), self.cursor({'p': 'x'}), self.cursor({'p': [now]}),
+            self.cursor({'p': ['garbage', 1]}), self.cursor({'p': [{'x': 1}, 1]}), self.cursor({'p': [now, 'abc']}),
+            self.cursor({'p': [None, None]}), self.cursor({'p': [now, 10 ** 30]}),
+        ]
+        urls = ['/api/posts/', '/api/feed/', '/api/notifications/', f'/api/users/{self.bob.id}/followers/']
+        for url in urls:
+            for cursor in cursors:
+                with self.subTest(url=url, cursor=cursor):
+                    response = self.client.get(url, {'cursor': cursor})
+                    self.assertEqual(response.status_code, 404, response.content)
+
+
+class WebSocketFrameTests(TestCase):
+    async def test_ignores_frames_that_are_not_objects(self):
+        frames = ['[1, 2]', '3', '"typing"', 'null', '{bad json', '{"type": "typing"}']
+        messages = [{'type': 'websocket.receive', 'text': text} for text in frames] + [{'type': 'websocket.disconnect'}]
+
+        async def receive():
+            return messages.pop(0)
+
+        socket = WebSocket({'query_string': b''}, receive, None)
+        self.assertEqual(await socket.receive_json(), {'type': 'typing'})
+        self.assertIsNone(await socket.receive_json())
+
+
+class NotificationPipelineTests(TestCase):
+    # Bursts of likes and follows collapse into one unread row per post,
+    # counting each distinct actor once
+
+    def setUp(self):
+        self.author = User.objects.create_user(username='author', email='author@example.com', password='secret')
+        self.fans = [User.objects.create_user(username=f'fan{index}', email=f'fan{index}@example.com', password='secret') for index in range(3)]
+        self.post = Post.objects.create(author=self.author, content='hello')
+
+    def like(self, fan, post=None):
+        return NotificationEvent(self.author.id, fan.id, 'like', post_id=(post or self.post).id)
+
+    def test_coalesces_a_burst(self):
+        a, b, c = self.fans
+        write_batch([self.like(a), self.like(b), self.like(a), self.like(c), self.like(c)])
+        notification = Notification.objects.get()
+        self.assertEqual((notification.actor_id, notification.others_count), (c.id, 2))
+
+    def test_alternating_actors_are_counted_once(self):
+        a, b, c = self.fans
+        for fan in (a, b, a, b, a):
+            write_batch([self.like(fan)])
+        # Repeats by counted actors neither count nor resurface the notification
+        notification = Notification.objects.get()
+        self.assertEqual((notification.actor_id, notification.others_count), (b.id, 1))
+
+        write_batch([self.like(c), self.like(b)])
+        notification.refresh_from_db()
+        self.assertEqual((notification.actor_id, notification.others_count), (c.id, 2))
+
+    def test_read_notifications_are_not_reused(self):
+        a, b, c = self.fans
+        write_batch([self.like(a), self.like(b)])
+        Notification.objects.update(is_read=True)
+        write_batch([self.like(a)])
+        self.assertEqual(
+            sorted(Notification.objects.values_list('is_read', 'others_count')),
+            [(False, 0), (True, 1)],
+        )
+
+    def test_comments_are_not_coalesced(self):
+        a, b, c = self.fans
+        comments = [Comment.objects.create(post=self.post, author=fan, content='hi') for fan in (a, b)]
+        write_batch([NotificationEvent(self.author.id, comment.author_id, 'comment', self.post.id, comment.id) for comment in comments])
+        self.assertEqual(Notification.objects.filter(notification_type='comment').count(), 2)
+
+    def test_events_for_deleted_rows_are_dropped(self):
+        a, b, c = self.fans
+        doomed = Post.objects.create(author=self.author, content='gone soon')
+        events = [self.like(a, doomed), self.like(b)]
+        doomed.delete()
+        write_batch(events)
+        self.assertEqual(list(Notification.objects.values_list('post_id', 'actor_id')), [(self.post.id, b.id)])
+
+
+class NotificationFlushTests(TransactionTestCase):
+    # Foreign keys are only checked on commit, so this needs real transactions
+
+    def test_flush_falls_back_to_single_writes(self):
+        author = User.objects.create_user(username='author', email='author@example.com', password='secret')
+        fan = User.objects.create_user(username='fan', email='fan@example.com', password='secret')
+        post = Post.objects.create(author=author, content='hello')
+        pipeline = NotificationPipeline(run_async=False)
+        events = [
+            NotificationEvent(author.id, fan.id, 'like', post_id=post.id + 1000),
+            NotificationEvent(author.id, fan.id, 'follow'),
+        ]
+        # As if the post was deleted after the existence check
+        with mock.patch('backend.notifications.live_events', side_effect=list):
+            for event in events:
+                pipeline._queue.put(event)
+            with self.assertLogs('backend.notifications', 'WARNING'):
+                self.assertEqual(pipeline.flush(), 2)
+        self.assertEqual(list(Notification.objects.values_list('notification_type', flat=True)), ['follow'])
+
+    def journaled(self):
+        directory = self.enterContext(tempfile.TemporaryDirectory())
+        return directory, NotificationPipeline(run_async=False, journal_dir=directory)
+
+    def test_journal_is_removed_once_written(self):
+        author = User.objects.create_user(username='author', email='author@example.com', password='secret')
+        fan = User.objects.create_user(username='fan', email='fan@example.com', password='secret')
+        directory, pipeline = self.journaled()
+        pipeline.enqueue(NotificationEvent(author.id, fan.id, 'follow'))
+        self.assertEqual(Notification.objects.count(), 1)
+        self.assertEqual(os.listdir(directory), [f'{os.getpid()}.jsonl'])
+        self.assertEqual(os.path.getsize(pipeline.journal.path), 0)
+
+    def test_failed_batch_stays_journaled(self):
+        author = User.objects.create_user(username='author', email='author@example.com', password='secret')
+        fan = User.objects.create_user(username='fan', email='fan@example.com', password='secret')
+        directory, pipeline = self.journaled()
+        pipeline.batch_size = 1
+        failed = NotificationEvent(author.id, fan.id, 'comment')
+        written = NotificationEvent(author.id, fan.id, 'follow')
+        with mock.patch('backend.notifications.write_batch', side_effect=[None, OperationalError('locked')]):
+            for event in (written, failed):
+                pipeline._put(event)
+            with self.assertRaises(OperationalError):
+                pipeline.flush()
+        # Only the unwritten event is kept, and a later flush leaves it alone
+        pipeline.enqueue(NotificationEvent(fan.id, author.id, 'follow'))
+        self.assertEqual(Notification.objects.count(), 1)
+        sealed = [name for name in os.listdir(directory) if name != f'{os.getpid()}.jsonl']
+        self.assertEqual(sealed, [f'{os.getpid()}.1.jsonl'])
+        with open(os.path.join(directory, sealed[0]), encoding='utf-8') as journal:
+            self.assertEqual([NotificationEvent(**json.loads(line)) for line in journal], [failed])
+
+    def test_publish_groups_by_recipient(self):
+        author = User.objects.create_user(username='author', email='author@example.com', password='secret')
+        other = User.objects.create_user(username='other', email='other@example.com', password='secret')
+        fans = [User.objects.create_user(username=f'fan{i}', email=f'fan{i}@example.com', password='secret') for i in range(3)]
+        notifications = [
+            Notification.objects.create(recipient=recipient, actor=fan, notification_type='follow')
+            for recipient in (author, other) for fan in fans
+        ]
+        broker = mock.Mock()
+        with mock.patch('backend.signals.get_broker', return_value=broker), self.assertNumQueries(2):
+            publish_notifications(notifications)
+        published = [(call.args[0], call.args[1]['unread_count']) for call in broker.publish.call_args_list]
+        self.assertEqual(published, [(user_topic(author.id), 3)] * 3 + [(user_topic(other.id), 3)] * 3)
+
+
+class InboxTests(TestCase):
+    # The inbox shows each conversation's last message and the reader's
+    # unread count from the denormalized columns
+
+    def setUp(self):
+        self.alice = User.objects.create_user(username='alice', email='alice@example.com', password='secret')
+        self.bob = User.objects.create_user(username='bob', email='bob@example.com', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+        self.conversation_id = self.client.post('/api/conversations/create/', {'user_id': self.bob.id}, format='json').data['id']
+
+    def send(self, user, content):
+        self.client.force_authenticate(user)
+        return self.client.post(f'/api/conversations/{self.conversation_id}/messages/', {'content': content}, format='json').data['id']
+
+    def inbox(self, user):
+        self.client.force_authenticate(user)
+        conversation, = self.client.get('/api/conversations/').data['results']
+        return conversation['unread_count'], conversation['last_message'] and conversation['last_message']['content']
+
+    def test_unread_counts(self):
+        self.assertEqual(self.inbox(self.alice), (0, None))
+        first = self.send(self.bob, 'one')
+        self.send(self.bob, 'two')
+        self.send(self.bob, 'three')
+        self.assertEqual(self.inbox(self.alice), (3, 'three'))
+        self.assertEqual(self.inbox(self.bob), (0, 'three'))
+
+        mark_read(Conversation.objects.get(id=self.conversation_id), self.alice, up_to_id=first)
+        self.assertEqual(self.inbox(self.alice), (2, 'three'))
+
+        self.client.force_authenticate(self.alice)
+        self.client.post(f'/api/conversations/{self.conversation_id}/mark-read/')
+        self.assertEqual(self.inbox(self.alice), (0, 'three'))
+        self.assertFalse(Message.objects.filter(is_read=False).exists())
+
+        self.send(self.alice, 'four')
+        self.assertEqual(self.inbox(self.alice), (0, 'four'))
+        self.assertEqual(self.inbox(self.bob), (1, 'four'))
+
+
+class SocketClient:
+    # Drives websocket_application in-process, as a connected client would
+
+    def __init__(self, path, token, **params):
+        self.incoming = asyncio.Queue()
+        self.outgoing = asyncio.Queue()
+        scope = {'type': 'websocket', 'path': path, 'query_string': urlencode({'token': token, **params}).encode()}
+        self.incoming.put_nowait({'type': 'websocket.connect'})
+        self.task = asyncio.ensure_future(websocket_application(scope, self.incoming.get, self.outgoing.put))
+
+    async def receive(self):
+        message = await asyncio.wait_for(self.outgoing.get(), timeout=5)
+        if message['type'] != 'websocket.send':
+            return message
+        return json.loads(message['text'])
+
+    async def send(self, data):
+        await self.incoming.put({'type': 'websocket.receive', 'text': json.dumps(data)})
+
+    async def disconnect(self):
+        await self.incoming.put({'type': 'websocket.disconnect'})
+        await asyncio.wait_for(self.task, timeout=5)
+
+
+class MessagingTests(TransactionTestCase):
+    # Conversation sockets deliver messages and typing indicators, and a
+    # reconnecting client gets only what it missed, over the socket or REST
+
+    def setUp(self):
+        self.alice = User.objects.create_user(username='alice', email='alice@example.com', password='secret')
+        self.bob = User.objects.create_user(username='bob', email='bob@example.com', password='secret')
+        self.conversation = Conversation.objects.create()
+        for user in (self.alice, self.bob):
+            ConversationParticipant.objects.create(conversation=self.conversation, user=user)
+        self.tokens = {user: str(AccessToken.for_user(user)) for user in (self.alice, self.bob)}
+        self.client = APIClient()
+        self.client.force_authenticate(self.bob)
+
+    async def connect(self, user, last_id=0):
+        # The resume event is sent once the socket is subscribed
+        socket = SocketClient(f'/ws/conversations/{self.conversation.id}/', self.tokens[user], last_id=last_id)
+        self.assertEqual((await socket.receive())['type'], 'websocket.accept')
+        resume = await socket.receive()
+        self.assertEqual(resume['type'], 'resume')
+        return socket, resume
+
+    def send(self, user, content):
+        return send_message(self.conversation, user, content).id
+
+    def history(self, **params):
+        response = self.client.get(f'/api/conversations/{self.conversation.id}/', params)
+        return response.status_code, response.data
+
+    async def test_delivery(self):
+        alice, _ = await self.connect(self.alice)
+        bob, _ = await self.connect(self.bob)
+        await alice.send({'type': 'message', 'content': 'hello'})
+        for socket in (alice, bob):
+            event = await socket.receive()
+            self.assertEqual(event['type'], 'message')
+            self.assertEqual((event['message']['content'], event['message']['sender']), ('hello', 'alice'))
+        self.assertEqual(
+            await ConversationParticipant.objects.filter(user=self.bob).values_list('unread_count', flat=True).aget(), 1,
+        )
+
+        # Read receipts are written when the socket flushes them, here on disconnect
+        await bob.send({'type': 'read', 'message_id': event['message']['id']})
+        await bob.disconnect()
+        self.assertEqual(await alice.receive(), {'type': 'read', 'user_id': self.bob.id, 'user': 'bob', 'up_to_id': event['message']['id']})
+        self.assertEqual(
+            await ConversationParticipant.objects.filter(user=self.bob).values_list('unread_count', flat=True).aget(), 0,
+        )
+        await alice.disconnect()
+
+    async def test_typing(self):
+        alice, _ = await self.connect(self.alice)
+        bob, _ = await self.connect(self.bob)
+        await alice.send({'type': 'typing'})
+        self.assertEqual(await bob.receive(), {'type': 'typing', 'user_id': self.alice.id, 'user': 'alice'})
+        self.assertFalse(await Message.objects.aexists())
+        # Alice does not get her own indicator back, only the next message
+        await bob.send({'type': 'message', 'content': 'hi'})
+        self.assertEqual((await alice.receive())['type'], 'message')
+        await alice.disconnect()
+        await bob.disconnect()
+
+    async def test_resume(self):
+        ids = [await sync_to_async(self.send)(self.alice, f'message {index}') for index in range(4)]
+        bob, resume = await self.connect(self.bob, last_id=ids[1])
+        self.assertEqual([message['id'] for message in resume['messages']], ids[2:])
+        self.assertFalse(resume['has_more'])
+        await bob.disconnect()
+
+        with mock.patch('backend.consumers.RESUME_LIMIT', 1):
+            bob, resume = await self.connect(self.bob, last_id=ids[1])
+        self.assertEqual(([message['id'] for message in resume['messages']], resume['has_more']), ([ids[2]], True))
+        await bob.disconnect()
+
+    def test_history_paging(self):
+        ids = [self.send(self.alice, f'message {index}') for index in range(5)]
+        status_code, data = self.history(after_id=ids[1], limit=2)
+        self.assertEqual((status_code, [message['id'] for message in data['results']], data['has_more']), (200, ids[2:4], True))
+        status_code, data = self.history(after_id=ids[3])
+        self.assertEqual(([message['id'] for message in data['results']], data['has_more']), ([ids[4]], False))
+        status_code, data = self.history(before_id=ids[3], limit=2)
+        self.assertEqual(([message['id'] for message in data['results']], data['has_more']), (ids[1:3], True))
+        status_code, data = self.history(limit=2)
+        self.assertEqual([message['id'] for message in data['results']], ids[3:])
+
+        self.assertEqual(self.history(after_id=ids[0], before_id=ids[4])[0], 400)
+        self.assertEqual(self.history(after_id='first')[0], 400)
+        self.assertEqual(self.history(after_id=ids[4] + 100)[0], 404)
+
+
+class MediaVersionTests(TestCase):
+    # Only the exact version emitted by media.versioned_url is cached as immutable
+
+    def setUp(self):
+        self.root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=self.root.name))
+        os.makedirs(os.path.join(self.root.name, 'posts', 'images'))
+        with open(os.path.join(self.root.name, 'posts', 'images', 'photo.png'), 'wb') as file:
+            file.write(b'not really a png')
+        self.content_hash = hashlib.sha256(b'not really a png').hexdigest()
+        MediaAsset.objects.create(content_hash=self.content_hash, kind='image', original='posts/images/photo.png', size=16)
+
+    def cache_control(self, version):
+        response = self.client.get('/media/posts/images/photo.png', {'v': version} if version is not None else {})
+        self.assertEqual(response.status_code, 200)
+        return response['Cache-Control']
+
+    def test_immutable_only_for_exact_version(self):
+        self.assertIn('immutable', self.cache_control(self.content_hash[:16]))
+        for version in (None, '', self.content_hash[:1], self.content_hash[:15], self.content_hash[:17], 'f' * 16):
+            with self.subTest(version=version):
+                self.assertNotIn('immutable', self.cache_control(version))
+
+
+def photo(size=(1200, 800), color='teal', orientation=None):
+    # JPEG bytes with a GPS position and a camera model in their EXIF
+    from PIL import Image
+
+    exif = Image.Exif()
+    exif[0x0110] = 'Test Camera'
+    exif.get_ifd(0x8825)[2] = (48.0, 51.0, 29.0)
+    if orientation is not None:
+        exif[0x0112] = orientation
+    output = io.BytesIO()
+    Image.new('RGB', size, color).save(output, 'JPEG', exif=exif)
+    output.seek(0)
+    output.name = 'photo.jpg'
+    return output
+
+
+@override_settings(MEDIA_PIPELINE={'ASYNC': False})
+class MediaPipelineTests(TestCase):
+    # Uploaded images get renditions and metadata on commit, without their EXIF
+
+    def setUp(self):
+        cache.clear()
+        self.root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=self.root.name))
+        self.author = User.objects.create_user(username='author', email='author@example.com', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.author)
+
+    def post_image(self, image):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/posts/', {'content': 'look', 'image': image}, format='multipart')
+        self.assertEqual(response.status_code, 201, response.content)
+        return Post.objects.select_related('image_asset').get(id=response.data['id'])
+
+    def test_renditions(self):
+        from PIL import Image
+
+        post = self.post_image(photo(orientation=6))
+        asset = post.image_asset
+        # Orientation 6 is a quarter turn, applied before the tag is dropped
+        self.assertEqual((asset.kind, asset.width, asset.height), ('image', 800, 1200))
+        self.assertEqual(sorted(asset.renditions), sorted(media.RENDITIONS))
+        for name, edge in media.RENDITIONS.items():
+            with Image.open(os.path.join(self.root.name, asset.renditions[name])) as rendition:
+                self.assertEqual((rendition.format, max(rendition.size)), ('WEBP', min(edge, 1200)))
+
+    def test_original_is_stripped(self):
+        from PIL import Image
+
+        post = self.post_image(photo())
+        path = os.path.join(self.root.name, post.image.name)
+        with Image.open(path) as original:
+            self.assertEqual(dict(original.getexif()), {})
+            self.assertEqual(original.size, (1200, 800))
+        # The asset describes the stripped file, which is what gets served
+        self.assertEqual(post.image_asset.content_hash, media.file_digest(path)[0])
+        response = self.client.get(f'/media/{post.image.name}')
+        self.assertEqual(response.status_code, 200)
+        with open(path, 'rb') as original:
+            self.assertEqual(response.getvalue(), original.read())
+
+    def test_unprocessed_original_is_not_served(self):
+        post = Post.objects.create(author=self.author, content='raw', image=SimpleUploadedFile('raw.jpg', photo().read()))
+        self.assertEqual(self.client.get(f'/media/{post.image.name}').status_code, 404)
+
+    def test_identical_uploads_share_one_asset(self):
+        first = self.post_image(photo())
+        second = self.post_image(photo())
+        self.assertEqual(MediaAsset.objects.count(), 1)
+        self.assertEqual(second.image_asset_id, first.image_asset_id)
+        self.assertEqual(second.image.name, first.image.name)
+        self.assertEqual(os.listdir(os.path.join(self.root.name, 'posts', 'images')), [os.path.basename(first.image.name)])
+        self.assertNotEqual(self.post_image(photo(color='olive')).image_asset_id, first.image_asset_id)
+
+    def test_process_media_command(self):
+        # Saved without running the commit hooks, as if processing had been skipped
+        post = Post.objects.create(author=self.author, content='raw', image=SimpleUploadedFile('raw.jpg', photo().read()))
+        self.assertIsNone(post.image_asset_id)
+        output = io.StringIO()
+        call_command('process_media', stdout=output)
+        self.assertIn('Processed 1 files, 0 failed', output.getvalue())
+        post.refresh_from_db()
+        self.assertEqual(post.image_asset.renditions.keys(), media.RENDITIONS.keys())
+        call_command('process_media', stdout=output)
+        self.assertIn('Processed 0 files, 0 failed', output.getvalue())
+
+
+class ResponseCacheTests(TestCase):
+    # Cached reads reflect writes as soon as the writing transaction commits
+
+    def setUp(self):
+        inline_notifications(self)
+        cache.clear()
+        self.alice = User.objects.create_user(username='alice', email='alice@example.com', password='secret')
+        self.bob = User.objects.create_user(username='bob', email='bob@example.com', password='secret')
+        self.post = Post.objects.create(author=self.bob, content='hello')
+        self.client = APIClient()
+        self.client.force_authenticate(self.bob)
+
+    def get(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def write(self, method, url, data=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = getattr(self.client, method)(url, data, format='json')
+        self.assertLess(response.status_code, 400, response.content)
+        return response
+
+    def test_post_detail(self):
+        url = f'/api/posts/{self.post.id}/'
+        self.assertEqual(self.get(url)['content'], 'hello')
+        with CaptureQueriesContext(connection) as context:
+            self.get(url)
+        # Only the viewer's like is read; the post itself comes from the cache
+        self.assertEqual(len(context.captured_queries), 1)
+
+        self.write('patch', url, {'content': 'edited'})
+        self.assertEqual(self.get(url)['content'], 'edited')
+        self.client.force_authenticate(self.alice)
+        self.write('put', f'/api/posts/{self.post.id}/like/')
+        self.write('post', f'/api/posts/{self.post.id}/comments/', {'content': 'hi'})
+        data = self.get(url)
+        self.assertEqual((data['likes_count'], data['comments_count'], data['user_has_liked']), (1, 1, True))
+
+    def test_post_list(self):
+        self.assertEqual([post['id'] for post in self.get('/api/posts/')['results']], [self.post.id])
+        post_id = self.write('post', '/api/posts/', {'content': 'second'}).data['id']
+        self.assertEqual([post['id'] for post in self.get('/api/posts/')['results']], [post_id, self.post.id])
+        self.write('delete', f'/api/posts/{post_id}/')
+        self.assertEqual([post['id'] for post in self.get('/api/posts/')['results']], [self.post.id])
+
+    def test_follow_lists(self):
+        followers_url = f'/api/users/{self.bob.id}/followers/'
+        following_url = f'/api/users/{self.alice.id}/following/'
+        self.assertEqual(self.get(followers_url)['results'], [])
+        self.assertEqual(self.get(following_url)['results'], [])
+
+        self.client.force_authenticate(self.alice)
+        self.write('put', f'/api/follow/{self.bob.id}/')
+        self.assertEqual([user['id'] for user in self.get(followers_url)['results']], [self.alice.id])
+        self.assertEqual([user['id'] for user in self.get(following_url)['results']], [self.bob.id])
+
+        self.write('delete', f'/api/follow/{self.bob.id}/')
+        self.assertEqual(self.get(followers_url)['results'], [])
+        self.assertEqual(self.get(following_url)['results'], [])
+
+
+class InstrumentationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        registry.reset()
+        self.user = User.objects.create_user(username='user', email='user@example.com', password='secret')
+        self.admin = User.objects.create_user(username='admin', email='admin@example.com', password='secret', is_staff=True)
+        Post.objects.create(author=self.user, content='hello')
+        self.client = APIClient()
+
+    def test_server_timing_is_staff_only(self):
+        self.assertNotIn('Server-Timing', self.client.get('/api/posts/'))
+        self.client.force_authenticate(self.user)
+        self.assertNotIn('Server-Timing', self.client.get('/api/posts/'))
+        self.client.force_authenticate(self.admin)
+        self.assertIn('db;dur=', self.client.get('/api/posts/')['Server-Timing'])
+
+        self.client.logout()
+        with self.settings(INSTRUMENTATION={'SERVER_TIMING': 'all'}):
+            self.assertIn('Server-Timing', self.client.get('/api/posts/'))
+        with self.settings(INSTRUMENTATION={'SERVER_TIMING': 'none'}):
+            self.client.force_authenticate(self.admin)
+            self.assertNotIn('Server-Timing', self.client.get('/api/posts/'))
+
+    def test_serialization_time(self):
+        self.client.get('/api/posts/')
+        metrics = registry.snapshot()['views']['posts']
+        self.assertEqual(metrics['requests'], 1)
+        self.assertGreater(metrics['serialization_seconds'], 0)
+        self.assertGreater(metrics['queries'], 0)
+
+    def test_view_name(self):
+        def request(path, urlconf=None):
+            return mock.Mock(resolver_match=resolve(path, urlconf))
+
+        self.assertEqual(view_name(request('/api/posts/')), 'posts')
+        self.assertEqual(view_name(request('/api/', urlconf=UnnamedRoutes)), 'backend.views.PostListCreateView')
+        self.assertEqual(view_name(request('/media/', urlconf=UnnamedRoutes)), 'backend.views.serve_media')
+        self.assertEqual(view_name(mock.Mock(resolver_match=None)), 'unresolved')
+
+
+class UnnamedRoutes:
+    urlpatterns = [path('api/', PostListCreateView.as_view()), path('media/', serve_media)]
+
+
+class AuthenticationTests(TestCase):
+    # Bearer tokens are checked against cached user rows and the revocation list
+
+    def setUp(self):
+        inline_notifications(self)
+        cache.clear()
+        user_cache.clear()
+        caches['revocations'].clear()
+        self.addCleanup(caches['revocations'].clear)
+        self.addCleanup(user_cache.clear)
+        self.alice = User.objects.create_user(username='alice', email='alice@example.com', password='secret')
+        self.bob = User.objects.create_user(username='bob', email='bob@example.com', password='secret')
+        self.client = APIClient()
+
+    def login(self, user):
+        response = self.client.post('/api/login/', {'username': user.username, 'password': 'secret'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def as_user(self, tokens):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {tokens['access']}")
+        return client
+
+    def test_cached_user_skips_select(self):
+        client = self.as_user(self.login(self.alice))
+        self.assertEqual(client.get('/api/test-auth/').status_code, 200)
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(client.get('/api/test-auth/').status_code, 200)
+        self.assertEqual(context.captured_queries, [])
+
+    def test_profile_update_keeps_counters(self):
+        alice = self.as_user(self.login(self.alice))
+        bob = self.as_user(self.login(self.bob))
+        # Both users are now cached with zero counters
+        self.assertEqual(alice.get('/api/profile/').data['followers_count'], 0)
+        self.assertEqual(bob.get('/api/profile/').data['following_count'], 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(bob.put(f'/api/follow/{self.alice.id}/').status_code, 200)
+        self.assertEqual(alice.get('/api/profile/').data['followers_count'], 1)
+        self.assertEqual(bob.get('/api/profile/').data['following_count'], 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = alice.patch('/api/profile/', {'bio': 'hello'}, format='json')
+        self.assertEqual((response.data['bio'], response.data['followers_count']), ('hello', 1))
+        self.alice.refresh_from_db()
+        self.assertEqual((self.alice.bio, self.alice.followers_count), ('hello', 1))
+        self.assertEqual(alice.get('/api/profile/').data['followers_count'], 1)
+
+    def test_logout_revokes_tokens(self):
+        tokens = self.login(self.alice)
+        client = self.as_user(tokens)
+        self.assertEqual(client.post('/api/logout/', {'refresh': tokens['refresh']}, format='json').status_code, 200)
+        self.assertEqual(client.get('/api/test-auth/').status_code, 401)
+        self.assertEqual(self.client.post('/api/token/refresh/', {'refresh': tokens['refresh']}, format='json').status_code, 401)
+        # Other sessions are unaffected
+        self.assertEqual(self.as_user(self.login(self.alice)).get('/api/test-auth/').status_code, 200)
+
+    def test_revocations_survive_response_cache_churn(self):
+        tokens = self.login(self.alice)
+        client = self.as_user(tokens)
+        client.post('/api/logout/')
+        for index in range(1000):
+            cache.set(f'churn:{index}', index)
+        cache.clear()
+        self.assertEqual(client.get('/api/test-auth/').status_code, 401)
+
+    def test_deactivation_revokes_all_tokens(self):
+        client = self.as_user(self.login(self.alice))
+        self.assertEqual(client.get('/api/test-auth/').status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.alice.is_active = False
+            self.alice.save()
+        self.assertEqual(client.get('/api/test-auth/').status_code, 401)
+
+
+class RevocationCacheCheckTests(TestCase):
+    # Outside DEBUG, revocations must go to a cache every process can see
+
+    def test_process_local_cache(self):
+        locmem = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+        redis = {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://127.0.0.1:6379'}
+        for debug, backend, errors in ((True, locmem, []), (False, locmem, ['backend.E001']), (False, redis, [])):
+            with self.subTest(debug=debug, backend=backend['BACKEND']), override_settings(DEBUG=debug, CACHES={'default': locmem, 'revocations': backend}):
+                self.assertEqual([error.id for error in run_checks(include_deployment_checks=True, tags=['caches'])], errors)
+
+
+class AsyncViewTests(TransactionTestCase):
+    # The async endpoints answer like their DRF counterparts; /home/ runs its
+    # parts in pool threads, so the rows must be committed
+
+    def setUp(self):
+        inline_notifications(self)
+        cache.clear()
+        user_cache.clear()
+        self.addCleanup(user_cache.clear)
+        self.alice = User.objects.create_user(username='alice', email='alice@example.com', password='secret')
+        self.bob = User.objects.create_user(username='bob', email='bob@example.com', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+        self.client.put(f'/api/follow/{self.bob.id}/')
+        self.client.force_authenticate(self.bob)
+        self.client.put(f'/api/follow/{self.alice.id}/')
+        self.post_ids = [self.client.post('/api/posts/', {'content': f'post {index}'}, format='json').data['id'] for index in range(3)]
+        self.client.force_authenticate(self.alice)
+        self.client.put(f'/api/posts/{self.post_ids[0]}/like/')
+        token = self.client.post('/api/login/', {'username': 'alice', 'password': 'secret'}, format='json').data['access']
+        self.headers = {'Authorization': f'Bearer {token}'}
+
+    async def test_home(self):
+        response = await self.async_client.get('/api/async/home/', headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['profile']['username'], 'alice')
+        self.assertEqual(data['unread_count'], 1)
+        self.assertEqual([post['id'] for post in data['feed']['results']], self.post_ids[::-1])
+
+    async def test_matches_sync_views(self):
+        for path in ('feed/', f'posts/{self.post_ids[0]}/', 'notifications/', 'conversations/'):
+            with self.subTest(path=path):
+                expected = await sync_to_async(self.client.get)(f'/api/{path}')
+                response = await self.async_client.get(f'/api/async/{path}', headers=self.headers)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.json(), json.loads(expected.content))
+
+    async def test_errors(self):
+        self.assertEqual((await self.async_client.get('/api/async/feed/')).status_code, 401)
+        self.assertEqual((await self.async_client.post('/api/async/feed/', headers=self.headers)).status_code, 405)
+        self.assertEqual((await self.async_client.get('/api/async/posts/0/', headers=self.headers)).status_code, 404)
+
+
+class BatchTests(TestCase):
+    # One request mixing new, repeated, superseded and invalid operations
+
+    def setUp(self):
+        inline_notifications(self)
+        cache.clear()
+        self.alice = User.objects.create_user(username='alice', email='alice@example.com', password='secret')
+        self.bob = User.objects.create_user(username='bob', email='bob@example.com', password='secret')
+        self.carol = User.objects.create_user(username='carol', email='carol@example.com', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def statuses(self, url, key, operations):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url, {'operations': [{key: target, 'action': action} for target, action in operations]}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        return [result['status'] for result in response.data['results']]
+
+    def test_mixed_likes(self):
+        liked = Post.objects.create(author=self.bob, content='already liked')
+        fresh = Post.objects.create(author=self.bob, content='new')
+        flipped = Post.objects.create(author=self.carol, content='liked then unliked')
+        Like.objects.create(user=self.alice, post=liked)
+        Post.objects.filter(id=liked.id).update(likes_count=1)
+
+        statuses = self.statuses('/api/posts/likes/batch/', 'post_id', [
+            (liked.id, 'like'), (fresh.id, 'like'), (fresh.id, 'like'), (flipped.id, 'like'),
+            (flipped.id, 'unlike'), (10 ** 6, 'like'), (liked.id, 'unlike'),
+        ])
+        self.assertEqual(statuses, ['superseded', 'superseded', 'liked', 'superseded', 'not_liked', 'not_found', 'unliked'])
+        self.assertEqual(set(Like.objects.values_list('post_id', flat=True)), {fresh.id})
+        self.assertEqual(
+            dict(Post.objects.values_list('id', 'likes_count')),
+            {liked.id: 0, fresh.id: 1, flipped.id: 0},
+        )
+        self.assertEqual(list(Notification.objects.values_list('recipient_id', 'post_id')), [(self.bob.id, fresh.id)])
+
+    def test_mixed_follows(self):
+        Follow.objects.create(follower=self.alice, following=self.carol)
+        User.objects.filter(id=self.carol.id).update(followers_count=1)
+        User.objects.filter(id=self.alice.id).update(following_count=1)
+
+        statuses = self.statuses('/api/follow/batch/', 'user_id', [
+            (self.bob.id, 'follow'), (self.bob.id, 'follow'), (self.alice.id, 'follow'),
+            (10 ** 6, 'unfollow'), (self.carol.id, 'follow'), (self.carol.id, 'unfollow'),
+        ])
+        self.assertEqual(statuses, ['superseded', 'followed', 'invalid', 'not_found', 'superseded', 'unfollowed'])
+        self.assertEqual(list(Follow.objects.values_list('follower_id', 'following_id')), [(self.alice.id, self.bob.id)])
+        self.assertEqual(
+            dict(User.objects.values_list('username', 'followers_count')),
+            {'alice': 0, 'bob': 1, 'carol': 0},
+        )
+        self.alice.refresh_from_db()
+        self.assertEqual(self.alice.following_count, 1)
+        self.assertEqual(list(Notification.objects.values_list('recipient_id', 'notification_type')), [(self.bob.id, 'follow')])
+        self.assertEqual(self.statuses('/api/follow/batch/', 'user_id', [(self.bob.id, 'follow')]), ['already_following'])
+
+    def test_queries_do_not_grow_with_batch_size(self):
+        others = [
+            User.objects.create_user(username=f'user{index}', email=f'user{index}@example.com', password='secret')
+            for index in range(8)
+        ]
+        posts = [Post.objects.create(author=self.bob, content=f'post {index}') for index in range(8)]
+
+        def queries(url, key, operations):
+            # The request itself; notifications are written after it commits
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.post(url, {'operations': [{key: target, 'action': action} for target, action in operations]}, format='json')
+            self.assertEqual(response.status_code, 200)
+            return len(context.captured_queries)
+
+        likes = [queries('/api/posts/likes/batch/', 'post_id', [(post.id, action) for post in posts[:size]]) for size, action in ((2, 'like'), (8, 'like'), (8, 'unlike'))]
+        follows = [queries('/api/follow/batch/', 'user_id', [(other.id, action) for other in others[:size]]) for size, action in ((2, 'follow'), (8, 'follow'), (8, 'unfollow'))]
+        self.assertEqual(likes[0], likes[1])
+        self.assertEqual(follows[0], follows[1])
+        self.assertEqual(Post.objects.filter(likes_count=0).count(), 8)
+        self.assertEqual(Follow.objects.count(), 0)
+
+
+class TrendingTests(TestCase):
+    # Ranking by time-decayed likes, comments and recency, overall and per location
+
+    def setUp(self):
+        inline_notifications(self)
+        cache.clear()
+        self.index = TrendingIndex()
+        for module in ('views', 'relations', 'signals'):
+            self.enterContext(mock.patch(f'backend.{module}.trending', self.index))
+        self.alice = User.objects.create_user(username='alice', email='alice@example.com', password='secret')
+        self.bob = User.objects.create_user(username='bob', email='bob@example.com', password='secret')
+        self.carol = User.objects.create_user(username='carol', email='carol@example.com', password='secret')
+        self.client = APIClient()
+
+    def post(self, content, location='', age=None):
+        post = Post.objects.create(author=self.alice, content=content, location=location)
+        if age is not None:
+            Post.objects.filter(id=post.id).update(created_at=timezone.now() - age)
+        return post
+
+    def ranked(self, **params):
+        response = self.client.get('/api/posts/trending/', params)
+        self.assertEqual(response.status_code, 200)
+        return [post['content'] for post in response.data['results']]
+
+    def test_order_from_stored_activity(self):
+        liked = self.post('two likes')
+        commented = self.post('one comment')
+        self.post('quiet')
+        stale = self.post('old likes', age=timedelta(days=2))
+        Like.objects.create(user=self.bob, post=liked)
+        Like.objects.create(user=self.carol, post=liked)
+        Comment.objects.create(author=self.bob, post=commented, content='nice')
+        for user in (self.alice, self.bob, self.carol):
+            Like.objects.create(user=user, post=stale)
+        Like.objects.filter(post=stale).update(created_at=timezone.now() - timedelta(days=1))
+
+        # A comment outweighs two likes; likes from a day ago fall behind a new post
+        self.assertEqual(self.ranked(), ['one comment', 'two likes', 'quiet', 'old likes'])
+
+    def test_likes_rerank_live_and_per_location(self):
+        for content, location in (('first', 'Paris'), ('second', 'Paris'), ('third', 'Berlin')):
+            self.post(content, location)
+        # Without activity the newest post leads
+        self.assertEqual(self.ranked(location='Paris'), ['second', 'first'])
+
+        first = Post.objects.get(content='first')
+        self.client.force_authenticate(self.bob)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.post(f'/api/posts/{first.id}/like/').status_code, 200)
+        self.client.force_authenticate(None)
+
+        self.assertEqual(self.ranked()[0], 'first')
+        self.assertEqual(self.ranked(location='Paris'), ['first', 'second'])
+        self.assertEqual(self.ranked(location='Berlin'), ['third'])
+
+
+class BenchmarkTests(TestCase):
+    # run_benchmarks end to end on a tiny data set, and the stored baseline
+
+    def setUp(self):
+        inline_notifications(self)
+        cache.clear()
+        user_cache.clear()
+
+    def test_scenarios_run(self):
+        benchmarks.generate(users=12, posts_per_user=2, conversations=4, messages_per_conversation=3)
+        sampler = benchmarks.Sampler()
+        results = {}
+        with self.captureOnCommitCallbacks(execute=True):
+            for scenario in benchmarks.SCENARIOS:
+                results[scenario.name] = benchmarks.run_scenario(scenario, sampler, requests=3, warmup=1)
+        for name, result in results.items():
+            self.assertEqual(result['requests'], 3, name)
+            self.assertGreater(result['queries_per_request'], 0, name)
+
+        self.assertEqual(benchmarks.compare(results, results), [])
+        slower = {'feed': dict(results['feed'], p95_ms=results['feed']['p95_ms'] * 2, queries_per_request=results['feed']['queries_per_request'] + 1)}
+        self.assertEqual(len(benchmarks.compare(slower, results)), 2)
+
+    def test_baseline_covers_every_scenario(self):
+        baseline = benchmarks.load_baseline(os.path.join(settings.BASE_DIR, 'benchmarks', 'baseline.json'))
+        self.assertLessEqual({scenario.name for scenario in benchmarks.SCENARIOS} | {'mixed'}, set(baseline['results']))
+
+
+class UploadTests(TestCase):
+    # Resumable chunked uploads of post videos
+
+    def setUp(self):
+        cache.clear()
+        self.root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=self.root.name))
+        self.alice = User.objects.create_user(username='alice', email='alice@example.com', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+        self.data = b'0123456789' * 10
+
+    def start(self, **extra):
+        response = self.client.post('/api/uploads/', dict({'filename': 'clip.mp4', 'total_size': len(self.data)}, **extra), format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        return response.data['id']
+
+    def put(self, upload_id, offset, chunk, **headers):
+        return self.client.put(f'/api/uploads/{upload_id}/?offset={offset}', chunk, content_type='application/octet-stream', **headers)
+
+    def test_rejects_empty_and_oversized_files(self):
+        for total_size in (0, -1, uploads.MAX_UPLOAD_SIZE + 1):
+            with self.subTest(total_size=total_size):
+                response = self.client.post('/api/uploads/', {'filename': 'clip.mp4', 'total_size': total_size}, format='json')
+                self.assertEqual(response.status_code, 400)
+        upload_id = self.start()
+        self.assertEqual(self.put(upload_id, 0, self.data + b'!').status_code, 400)
+
+    def test_offset_mismatch(self):
+        upload_id = self.start()
+        self.assertEqual(self.put(upload_id, 0, self.data[:40]).status_code, 200)
+        response = self.put(upload_id, 10, self.data[10:50])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['offset'], 40)
+
+    def test_checksum_failure_keeps_offset(self):
+        upload_id = self.start()
+        response = self.put(upload_id, 0, self.data[:40], HTTP_X_CHUNK_SHA256='0' * 64)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['offset'], 0)
+        good = hashlib.sha256(self.data[:40]).hexdigest()
+        self.assertEqual(self.put(upload_id, 0, self.data[:40], HTTP_X_CHUNK_SHA256=good).data['offset'], 40)
+
+    def test_resume_after_interrupted_chunk(self):
+        upload_id = self.start()
+        self.put(upload_id, 0, self.data[:30])
+        # The connection drops after 20 of the 50 announced bytes
+        with self.assertRaises(uploads.ChunkError):
+            uploads.write_chunk(UploadSession.objects.get(id=upload_id), io.BytesIO(self.data[30:50]), 50)
+        offset = self.client.get(f'/api/uploads/{upload_id}/').data['offset']
+        self.assertEqual(offset, 30)
+        self.assertEqual(self.put(upload_id, offset, self.data[offset:]).data['offset'], len(self.data))
+        with open(uploads.part_path(UploadSession.objects.get(id=upload_id)), 'rb') as part:
+            self.assertEqual(part.read(), self.data)
+
+    def test_finalize(self):
+        upload_id = self.start(sha256=hashlib.sha256(self.data).hexdigest())
+        self.put(upload_id, 0, self.data[:60])
+        self.assertEqual(self.client.post(f'/api/uploads/{upload_id}/finalize/', {'content': 'clip'}).status_code, 400)
+        self.put(upload_id, 60, self.data[60:])
+
+        response = self.client.post(f'/api/uploads/{upload_id}/finalize/', {'content': 'clip'})
+        self.assertEqual(response.status_code, 201, response.content)
+        post = Post.objects.get(id=response.data['id'])
+        with post.video.open('rb') as video:
+            self.assertEqual(video.read(), self.data)
+        self.assertEqual(UploadSession.objects.get(id=upload_id).status, 'complete')
+        # A repeated (or concurrent) finalize finds no active session
+        self.assertEqual(self.client.post(f'/api/uploads/{upload_id}/finalize/', {'content': 'clip'}).status_code, 404)
+        self.assertEqual(Post.objects.count(), 1)
+
+    def test_expire_abandoned_uploads(self):
+        stale, fresh = self.start(), self.start()
+        orphan = os.path.join(self.root.name, uploads.TEMP_DIR, 'orphan.part')
+        open(orphan, 'wb').close()
+        later = timezone.now() + timedelta(seconds=uploads.EXPIRE_AFTER + 60)
+        UploadSession.objects.filter(id=fresh).update(updated_at=later)
+        os.utime(orphan, (0, 0))
+
+        self.assertEqual(uploads.expire(now=later), (1, 1))
+        self.assertEqual(list(UploadSession.objects.values_list('id', flat=True)), [UploadSession.objects.get(id=fresh).id])
+        self.assertFalse(os.path.exists(orphan))
+        self.assertFalse(os.path.exists(os.path.join(self.root.name, uploads.TEMP_DIR, f'{stale}.part')))
+        self.assertTrue(os.path.exists(os.path.join(self.root.name, uploads.TEMP_DIR, f'{fresh}.part')))
+
+
+class SuggestionTests(TestCase):
+    # Who to follow, from the in-memory follow graph
+
+    def setUp(self):
+        cache.clear()
+        self.users = {
+            name: User.objects.create_user(username=name, email=f'{name}@example.com', password='secret')
+            for name in ('alice', 'bob', 'carol', 'dave', 'erin', 'frank')
+        }
+        for follower, following in (('alice', 'bob'), ('alice', 'carol'), ('bob', 'dave'), ('bob', 'erin'), ('carol', 'dave'), ('frank', 'alice')):
+            Follow.objects.create(follower=self.users[follower], following=self.users[following])
+        self.graph = FollowGraph()
+        self.graph.build()
+
+    def suggested(self, name):
+        names = {user.id: user_name for user_name, user in self.users.items()}
+        return [(names[user_id], mutual, follows_you) for user_id, mutual, follows_you in self.graph.suggest(self.users[name].id)]
+
+    def test_ranking_and_exclusions(self):
+        # dave: two mutual follows; frank: follows alice back; erin: one mutual.
+        # dave and frank tie on score and dave has more followers.
+        self.assertEqual(self.suggested('alice'), [('dave', 2, False), ('frank', 0, True), ('erin', 1, False)])
+
+    def test_ranking_without_numpy(self):
+        with mock.patch('backend.graph.np', None):
+            self.graph = FollowGraph()
+            self.graph.build()
+            self.assertEqual(self.suggested('alice'), [('dave', 2, False), ('frank', 0, True), ('erin', 1, False)])
+
+    def test_overlay_before_rebuild(self):
+        alice, bob, dave = self.users['alice'], self.users['bob'], self.users['dave']
+        self.graph.add(alice.id, dave.id)
+        self.graph.remove(alice.id, bob.id)
+        self.assertEqual(self.suggested('alice'), [('frank', 0, True)])
+        self.assertEqual(list(self.graph.following(alice.id)), sorted([self.users['carol'].id, dave.id]))
+        self.assertEqual(list(self.graph.followers(dave.id)), sorted([alice.id, bob.id, self.users['carol'].id]))
+
+    def test_not_built_in_requests(self):
+        graph = FollowGraph()
+        with mock.patch.object(graph, 'start') as start, self.assertNumQueries(0):
+            self.assertEqual(graph.suggest(self.users['alice'].id), [])
+        start.assert_called_once_with()
+
+    def test_view(self):
+        client = APIClient()
+        client.force_authenticate(self.users['alice'])
+        with mock.patch('backend.views.graph', self.graph):
+            response = client.get('/api/suggestions/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(user['username'], user['mutual_count'], user['follows_you']) for user in response.data['results']],
+            [('dave', 2, False), ('frank', 0, True), ('erin', 1, False)],
+        )
+
+
+@skipUnless(connection.vendor == 'sqlite', 'the FTS5 index is SQLite only')
+class SearchTests(TestCase):
+    # Ranked full-text search over the FTS5 index kept in sync by signals
+
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user(username='alice', email='alice@example.com', password='secret')
+        self.bob = User.objects.create_user(username='bob', email='alice.fan@example.com', password='secret')
+        self.alicia = User.objects.create_user(username='alicia', email='alicia@example.com', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def posts(self, query):
+        response = self.client.get('/api/search/posts/', {'q': query})
+        self.assertEqual(response.status_code, 200)
+        return [post['content'] for post in response.data]
+
+    def users(self, query):
+        response = self.client.get('/api/search/users/', {'q': query})
+        self.assertEqual(response.status_code, 200)
+        return [user['username'] for user in response.data]
+
+    def test_ranking_and_prefixes(self):
+        Post.objects.create(author=self.bob, content='cooking dinner with python and rust tonight')
+        Post.objects.create(author=self.bob, content='python')
+        Post.objects.create(author=self.bob, content='nothing to see')
+
+        self.assertEqual(self.posts('python'), ['python', 'cooking dinner with python and rust tonight'])
+        self.assertEqual(self.posts('Pyth'), ['python', 'cooking dinner with python and rust tonight'])
+        # Every word has to match
+        self.assertEqual(self.posts('python rust'), ['cooking dinner with python and rust tonight'])
+        self.assertEqual(self.posts('java'), [])
+        # A username match outweighs an email match; the requester is left out
+        self.client.force_authenticate(self.bob)
+        self.assertEqual(self.users('ali'), ['alice', 'alicia'])
+        self.assertEqual(self.users('alice'), ['alice'])
+        self.client.force_authenticate(self.alicia)
+        self.assertEqual(self.users('alice'), ['alice', 'bob'])
+
+    def test_index_follows_edits_and_deletes(self):
+        post = Post.objects.create(author=self.alice, content='learning python')
+        self.assertEqual(self.client.patch(f'/api/posts/{post.id}/', {'content': 'learning golang'}, format='json').status_code, 200)
+        self.assertEqual(self.posts('python'), [])
+        self.assertEqual(self.posts('golang'), ['learning golang'])
+
+        self.assertEqual(self.client.delete(f'/api/posts/{post.id}/').status_code, 204)
+        self.assertEqual(self.posts('golang'), [])
+
+        self.bob.username = 'robert'
+        self.bob.save()
+        self.assertEqual(self.users('rob'), ['robert'])
+        self.bob.delete()
+        self.assertEqual(self.users('rob'), [])
+
+    def test_rebuild_command(self):
+        Post.objects.create(author=self.bob, content='python')
+        Post.objects.create(author=self.alicia, content='python again')
+        get_backend().clear()
+        self.assertEqual(self.posts('python'), [])
+
+        out = io.StringIO()
+        call_command('rebuild_search_index', chunk_size=1, stdout=out)
+        self.assertIn('Indexed 3 users and 2 posts', out.getvalue())
+        self.assertEqual(self.posts('python'), ['python', 'python again'])
+        self.assertEqual(self.users('ali'), ['alicia', 'bob'])
+
+
+class PlaceTests(TestCase):
+    # Location keys, geohash cells and the in-memory place index
+
+    def place(self, name, posts_count=0, latitude=None, longitude=None):
+        return Place.objects.create(key=place_key(name), name=name, posts_count=posts_count, latitude=latitude, longitude=longitude)
+
+    def index(self):
+        index = PlaceIndex()
+        index.build()
+        return index
+
+    def test_place_key(self):
+        for location, key in (
+            ('Paris', 'paris'), ('  PARIS ', 'paris'), ('  Paris ,France', 'paris, france'),
+            ('New   York,  USA', 'new york, usa'), ('ｐａｒｉｓ', 'paris'), ('Straße', 'strasse'),
+            ('', None), (None, None), (' , ', None),
+        ):
+            with self.subTest(location=location):
+                self.assertEqual(place_key(location), key)
+
+    def test_geohash(self):
+        self.assertEqual(geohash(57.64911, 10.40744, 11), 'u4pruydqqvj')
+        self.assertEqual(geohash(0, 0, 5), 's0000')
+        self.assertEqual(geohash(48.8566, 2.3522), geohash(48.8566, 2.3522, 12)[:9])
+
+    def test_covering_cells_reach_across_cell_edges(self):
+        for radius in (0.5, 5, 20, 150):
+            for fraction in (0.0001, 0.5, 0.9999):
+                # Centres just inside the edges of the cell around Paris at the chosen precision
+                cell = min(covering_cells(48.8566, 2.3522, radius), key=len)
+                height, width = cell_degrees(len(cell))
+                latitude = math.floor(48.8566 / height) * height + fraction * height
+                longitude = math.floor(2.3522 / width) * width + fraction * width
+                cells = covering_cells(latitude, longitude, radius)
+                for bearing in range(0, 360, 45):
+                    distance = radius * 0.999
+                    point = (
+                        latitude + distance * math.cos(math.radians(bearing)) / KM_PER_DEGREE,
+                        longitude + distance * math.sin(math.radians(bearing)) / (KM_PER_DEGREE * math.cos(math.radians(latitude))),
+                    )
+                    if distance_km(latitude, longitude, *point) <= radius:
+                        with self.subTest(radius=radius, fraction=fraction, bearing=bearing):
+                            self.assertTrue(any(geohash(*point).startswith(prefix) for prefix in cells))
+
+    def test_nearby_filters_by_radius(self):
+        self.place('Paris', latitude=48.8566, longitude=2.3522)
+        self.place('Versailles', latitude=48.8049, longitude=2.1204)
+        self.place('Lyon', latitude=45.764, longitude=4.8357)
+        self.place('Nowhere')
+        index = self.index()
+
+        def names(radius):
+            return [(place['name'], round(place['distance_km'])) for place in index.nearby(48.8566, 2.3522, radius)]
+
+        self.assertEqual(names(10), [('Paris', 0)])
+        self.assertEqual(names(20), [('Paris', 0), ('Versailles', 18)])
+        self.assertEqual(names(500), [('Paris', 0), ('Versailles', 18), ('Lyon', 391)])
+
+    def test_nearby_across_the_antimeridian(self):
+        self.place('East', latitude=0.0, longitude=179.999)
+        self.assertEqual([place['name'] for place in self.index().nearby(0.0, -179.999, 1)], ['East'])
+
+    def test_autocomplete_order(self):
+        self.place('York', posts_count=2)
+        self.place('New York', posts_count=5)
+        self.place('Yorkshire', posts_count=9)
+        self.place('Paris', posts_count=1)
+        index = self.index()
+
+        def names(prefix):
+            return [place['name'] for place in index.autocomplete(prefix)]
+
+        # Any word of the name matches, most posts first, for short and long prefixes
+        self.assertEqual(names('york'), ['Yorkshire', 'New York', 'York'])
+        self.assertEqual(names('YO'), ['Yorkshire', 'New York', 'York'])
+        self.assertEqual(names('new y'), ['New York'])
+        self.assertEqual(names('p'), ['Paris'])
+        self.assertEqual(names('  '), [])
+        index.count(Place.objects.get(key='york').id, 10)
+        self.assertEqual(names('york'), ['York', 'Yorkshire', 'New York'])
+
+
+class TagTests(TestCase):
+    # Hashtags and mentions parsed from post text into the Tag and Mention tables
+
+    def setUp(self):
+        inline_notifications(self)
+        cache.clear()
+        self.alice = User.objects.create_user(username='alice', email='alice@example.com', password='secret')
+        self.bob = User.objects.create_user(username='bob', email='bob@example.com', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def test_extract_tags(self):
+        for text, tags in (
+            ('#Café and #café and #CAFÉ', {'café'}),
+            ('#cafe #café', {'cafe', 'café'}),
+            ('#python, #django. (#rest)!', {'python', 'django', 'rest'}),
+            ('#python #python', {'python'}),
+            ('mail me@example.com a#b ##double #1 #2024', set()),
+            ('#' + 'x' * 101, set()),
+            ('', set()),
+        ):
+            with self.subTest(text=text):
+                self.assertEqual(extract_tags(text), tags)
+
+    def test_extract_mentions(self):
+        self.assertEqual(extract_mentions('@alice, @bob. @alice hi @first.last!'), {'alice', 'bob', 'first.last'})
+        self.assertEqual(extract_mentions('me@example.com @@alice'), set())
+        # Usernames are case-sensitive, so mentions are kept as written
+        self.assertEqual(extract_mentions('@Alice'), {'Alice'})
+
+    def post(self, content):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/posts/', {'content': content}, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        return response.data['id']
+
+    def edit(self, post_id, content):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.patch(f'/api/posts/{post_id}/', {'content': content}, format='json').status_code, 200)
+
+    def indexed(self, post_id):
+        return (
+            set(Tag.objects.filter(post_id=post_id).values_list('name', flat=True)),
+            set(Mention.objects.filter(post_id=post_id).values_list('user__username', flat=True)),
+        )
+
+    def test_edit_reindexes(self):
+        post_id = self.post('#One #two hello @bob and @alice')
+        # Authors mentioning themselves are not recorded
+        self.assertEqual(self.indexed(post_id), ({'one', 'two'}, {'bob'}))
+        self.edit(post_id, '#two #Three, bye')
+        self.assertEqual(self.indexed(post_id), ({'two', 'three'}, set()))
+        self.assertEqual([post['id'] for post in self.client.get('/api/tags/THREE/').data['results']], [post_id])
+        self.assertEqual(self.client.get('/api/tags/one/').data['results'], [])
+
+    def test_mention_notifies_once(self):
+        post_id = self.post('@bob @bob look')
+        self.edit(post_id, '@bob look again')
+        self.edit(post_id, 'no mention')
+        self.assertEqual(
+            list(Notification.objects.filter(notification_type='mention').values_list('recipient__username', 'actor__username', 'post_id')),
+            [('bob', 'alice', post_id)],
+        )
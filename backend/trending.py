@@ -0,0 +1,280 @@
+import logging
+import math
+import threading
+import time
+from bisect import bisect_left, insort
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Count
+from django.db.models.functions import Trunc
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Trending posts. Every post, like and comment adds weight * e^(t / tau) to
+# its post's score, where t is when it happened. Decaying all scores by the
+# same e^(-now / tau) does not change their order, so scores never have to be
+# recomputed as time passes: a like now simply outweighs an older one by the
+# decay factor. Scores are kept as logarithms to stay within float range.
+#
+# Each process holds the scores of recent posts and, per location, a bounded
+# sorted top-K. Likes and comments made in this process update them as they
+# commit. A background refresh every REFRESH seconds recomputes them from the
+# posts, likes and comments of the last WINDOW seconds, which brings in other
+# processes' activity and drops unlikes and deleted comments.
+
+NEG_INF = float('-inf')
+
+
+def options():
+    return getattr(settings, 'TRENDING', {})
+
+
+def tau():
+    return options().get('HALF_LIFE', 6 * 3600) / math.log(2)
+
+
+def weight(kind):
+    return options().get('WEIGHTS', {'post': 1.0, 'like': 1.0, 'comment': 3.0})[kind]
+
+
+def term(kind, timestamp, count=1):
+    # log(count * weight * e^(timestamp / tau))
+    return math.log(count * weight(kind)) + timestamp / tau()
+
+
+def logaddexp(a, b):
+    if a == NEG_INF:
+        return b
+    if b == NEG_INF:
+        return a
+    high, low = max(a, b), min(a, b)
+    return high + math.log1p(math.exp(low - high))
+
+
+def location_key(location):
+    # The same key as the Place table, so every spelling of a place shares a slice
+    from .places import place_key
+
+    return place_key(location)
+
+
+class TopK:
+    # The `capacity` highest scoring posts, kept sorted
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.entries = []
+        self.scores = {}
+
+    def update(self, post_id, score):
+        self.discard(post_id)
+        entry = (-score, post_id)
+        if len(self.entries) < self.capacity or entry < self.entries[-1]:
+            insort(self.entries, entry)
+            self.scores[post_id] = score
+            if len(self.entries) > self.capacity:
+                _, dropped = self.entries.pop()
+                del self.scores[dropped]
+
+    def discard(self, post_id):
+        score = self.scores.pop(post_id, None)
+        if score is not None:
+            del self.entries[bisect_left(self.entries, (-score, post_id))]
+
+    def top(self, offset, limit):
+        return [(post_id, -negative) for negative, post_id in self.entries[offset:offset + limit]]
+
+
+class TrendingIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._loaded = False
+        self._built_at = 0.0
+        self._rebuilding = False
+        self._pending = None
+        self._reset()
+
+    def _reset(self):
+        # post id -> log score, and (location key, base term) of posts placed in slices
+        self.engagement = {}
+        self.posts = {}
+        self.slices = {}
+        # posts with activity whose location is not known yet
+        self.unplaced = set()
+
+    # --- Scores ---
+
+    def _score(self, post_id):
+        location, base = self.posts[post_id]
+        return logaddexp(base, self.engagement.get(post_id, NEG_INF))
+
+    def _slice(self, key):
+        top = self.slices.get(key)
+        if top is None:
+            top = self.slices[key] = TopK(options().get('TOP_K', 500))
+        return top
+
+    def _place(self, post_id, location, created_at):
+        self.posts[post_id] = (location_key(location), term('post', created_at.timestamp()))
+        self.unplaced.discard(post_id)
+        self._rerank(post_id)
+
+    def _rerank(self, post_id):
+        location, base = self.posts[post_id]
+        score = self._score(post_id)
+        self._slice(None).update(post_id, score)
+        if location is not None:
+            self._slice(location).update(post_id, score)
+
+    # --- Incremental updates ---
+
+    def add_post(self, post):
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append(('post', post.id, (post.location, post.created_at)))
+            if self._loaded:
+                self._place(post.id, post.location, post.created_at)
+
+    def record(self, post_id, kind, timestamp=None):
+        # A like or comment on post_id, counted once the caller's transaction commits
+        timestamp = time.time() if timestamp is None else timestamp
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append((kind, post_id, timestamp))
+            if self._loaded:
+                self._add_engagement(post_id, term(kind, timestamp))
+
+    def _add_engagement(self, post_id, value):
+        self.engagement[post_id] = logaddexp(self.engagement.get(post_id, NEG_INF), value)
+        if post_id in self.posts:
+            self._rerank(post_id)
+        else:
+            self.unplaced.add(post_id)
+
+    def discard(self, post_id):
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append(('delete', post_id, None))
+            self._discard(post_id)
+
+    def _discard(self, post_id):
+        location, base = self.posts.pop(post_id, (None, None))
+        self.engagement.pop(post_id, None)
+        self.unplaced.discard(post_id)
+        for key in {None, location}:
+            if key in self.slices:
+                self.slices[key].discard(post_id)
+
+    # --- Loading ---
+
+    def build(self):
+        with self._build_lock:
+            self._load()
+
+    def _load(self):
+        from .models import Comment, Like, Post
+
+        with self._lock:
+            self._pending = []
+        started = time.monotonic()
+        since = timezone.now() - timedelta(seconds=options().get('WINDOW', 3 * 24 * 3600))
+        try:
+            # Activity per post and hour; each bucket counts as happening mid-hour
+            engagement = {}
+            now = time.time()
+            for model, kind in ((Like, 'like'), (Comment, 'comment')):
+                buckets = (
+                    model.objects.filter(created_at__gte=since)
+                    .annotate(hour=Trunc('created_at', 'hour'))
+                    .values_list('post_id', 'hour')
+                    .annotate(n=Count('*'))
+                    .order_by()
+                )
+                for post_id, hour, count in buckets:
+                    value = term(kind, min(hour.timestamp() + 1800, now), count)
+                    engagement[post_id] = logaddexp(engagement.get(post_id, NEG_INF), value)
+            recent = Post.objects.filter(created_at__gte=since).values_list('id', 'location', 'created_at')
+            posts = {post_id: (location, created_at) for post_id, location, created_at in recent}
+            older = [post_id for post_id in engagement if post_id not in posts]
+            for post_id, location, created_at in Post.objects.filter(id__in=older).values_list('id', 'location', 'created_at'):
+                posts[post_id] = (location, created_at)
+        except Exception:
+            with self._lock:
+                self._pending = None
+            raise
+
+        with self._lock:
+            self._reset()
+            self.engagement = {post_id: value for post_id, value in engagement.items() if post_id in posts}
+            for post_id, (location, created_at) in posts.items():
+                self._place(post_id, location, created_at)
+            for kind, post_id, detail in self._pending:
+                if kind == 'post':
+                    self._place(post_id, *detail)
+                elif kind == 'delete':
+                    self._discard(post_id)
+                else:
+                    self._add_engagement(post_id, term(kind, detail))
+            self._pending = None
+            self._loaded = True
+            self._built_at = time.monotonic()
+        logger.info("Ranked %d trending posts in %.2fs", len(posts), time.monotonic() - started)
+
+    def ensure_loaded(self):
+        # The first load runs in the caller; refreshes run in the background
+        if not self._loaded:
+            with self._build_lock:
+                if not self._loaded:
+                    self._load()
+        elif time.monotonic() - self._built_at > options().get('REFRESH', 300) and not self._rebuilding:
+            with self._lock:
+                if self._rebuilding:
+                    return
+                self._rebuilding = True
+            threading.Thread(target=self._rebuild, name='trending', daemon=True).start()
+
+    def _rebuild(self):
+        try:
+            self.build()
+        except Exception:
+            logger.exception("Failed to refresh trending posts")
+        finally:
+            self._rebuilding = False
+            close_old_connections()
+
+    def _place_unknown(self):
+        # Posts that got likes or comments before this process saw them
+        from .models import Post
+
+        with self._lock:
+            missing = list(self.unplaced)
+        if not missing:
+            return
+        rows = Post.objects.filter(id__in=missing).values_list('id', 'location', 'created_at')
+        with self._lock:
+            for post_id, location, created_at in rows:
+                if post_id in self.unplaced:
+                    self._place(post_id, location, created_at)
+            # Whatever is left was deleted
+            for post_id in missing:
+                if post_id in self.unplaced:
+                    self._discard(post_id)
+
+    # --- Reading ---
+
+    def top(self, location=None, offset=0, limit=20):
+        # [(post_id, score)], hottest first; score is the log of the decayed weight as of now
+        self.ensure_loaded()
+        self._place_unknown()
+        now = time.time() / tau()
+        with self._lock:
+            top = self.slices.get(location_key(location))
+            if top is None:
+                return []
+            return [(post_id, score - now) for post_id, score in top.top(offset, limit)]
+
+
+trending = TrendingIndex()
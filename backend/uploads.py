@@ -0,0 +1,106 @@
+import hashlib
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from django.utils.text import get_valid_filename
+
+BLOCK_SIZE = 64 * 1024
+
+_options = getattr(settings, 'CHUNKED_UPLOADS', {})
+MAX_CHUNK_SIZE = _options.get('MAX_CHUNK_SIZE', 8 * 1024 * 1024)
+MAX_UPLOAD_SIZE = _options.get('MAX_UPLOAD_SIZE', 2 * 1024 * 1024 * 1024)
+TEMP_DIR = _options.get('TEMP_DIR', 'uploads/tmp')
+EXPIRE_AFTER = _options.get('EXPIRE_AFTER', 24 * 3600)
+
+
+class ChunkError(Exception):
+    pass
+
+
+def part_path(session):
+    return default_storage.path(os.path.join(TEMP_DIR, f'{session.id}.part'))
+
+
+def start(session):
+    path = part_path(session)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, 'wb').close()
+
+
+def write_chunk(session, stream, length, expected_sha256=None):
+    # Stream one chunk from the request body to the end of the part file in
+    # fixed-size blocks, so memory stays bounded whatever the chunk size.
+    # Returns the new offset; a failed chunk leaves the file as it was.
+    path = part_path(session)
+    digest = hashlib.sha256()
+    written = 0
+    with open(path, 'r+b') as part:
+        part.seek(session.received)
+        while written < length:
+            block = stream.read(min(BLOCK_SIZE, length - written))
+            if not block:
+                break
+            part.write(block)
+            digest.update(block)
+            written += len(block)
+
+        if written != length:
+            part.truncate(session.received)
+            raise ChunkError(f"Expected {length} bytes, received {written}.")
+        if expected_sha256 and digest.hexdigest() != expected_sha256.lower():
+            part.truncate(session.received)
+            raise ChunkError("Chunk checksum mismatch.")
+        part.truncate(session.received + written)
+    return session.received + written
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as source:
+        for block in iter(lambda: source.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def assemble(session, upload_to):
+    # Move the completed part file into storage without copying it
+    name = default_storage.get_available_name(os.path.join(upload_to, get_valid_filename(session.filename)))
+    target = default_storage.path(name)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    os.replace(part_path(session), target)
+    return name
+
+
+def discard(session):
+    try:
+        os.remove(part_path(session))
+    except FileNotFoundError:
+        pass
+
+
+def expire(now=None):
+    # Deletes active sessions untouched for EXPIRE_AFTER seconds, their part
+    # files, and part files no session refers to; returns (sessions, files)
+    from .models import UploadSession
+
+    cutoff = (now or timezone.now()) - timedelta(seconds=EXPIRE_AFTER)
+    stale = list(UploadSession.objects.filter(status='active', updated_at__lt=cutoff))
+    for session in stale:
+        discard(session)
+    UploadSession.objects.filter(id__in=[session.id for session in stale]).delete()
+
+    removed = 0
+    directory = default_storage.path(TEMP_DIR)
+    if os.path.isdir(directory):
+        names = {name for name in os.listdir(directory) if name.endswith('.part')}
+        active = {f'{session_id}.part' for session_id in UploadSession.objects.filter(status='active').values_list('id', flat=True)}
+        for name in names - active:
+            path = os.path.join(directory, name)
+            # Leave files of sessions being created right now alone
+            if os.path.getmtime(path) < cutoff.timestamp():
+                os.remove(path)
+                removed += 1
+    return len(stale), removed
@@ -1,31 +1,54 @@
 from django.urls import path
-from .views import FeedView, PostListCreateView, TestAuthView, RegisterView, AllUsersView, ProfileView, FollowToggleView, LikeToggleView, PostDetailView, CommentListCreateView, CommentDetailView, UserSearchView, NotificationListView, NotificationMarkReadView, NotificationUnreadCountView, ConversationListView, ConversationDetailView, ConversationCreateView, MessageCreateView, MessageMarkReadView
-from rest_framework_simplejwt.views import (
-    TokenObtainPairView,
-    TokenRefreshView,
-)
+from .views import FeedView, PostListCreateView, TestAuthView, RegisterView, AllUsersView, ProfileView, FollowToggleView, LikeToggleView, PostDetailView, CommentListCreateView, CommentDetailView, UserSearchView, PostSearchView, NotificationListView, NotificationMarkReadView, NotificationUnreadCountView, FollowersListView, FollowingListView, ConversationListView, ConversationDetailView, ConversationCreateView, MessageCreateView, MessageMarkReadView, UploadCreateView, UploadDetailView, UploadFinalizeView, CacheStatsView, MetricsView, LogoutView, RevocableTokenRefreshView, FollowBatchView, LikeBatchView, NotificationBatchReadView, SuggestionsView, TrendingView, TagTimelineView, PlaceAutocompleteView, PlaceNearbyView, PlaceTimelineView
+from rest_framework_simplejwt.views import TokenObtainPairView
+
+from . import async_views
 
 urlpatterns = [
     path('login/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
-    path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
+    path('token/refresh/', RevocableTokenRefreshView.as_view(), name='token_refresh'),
+    path('logout/', LogoutView.as_view(), name='logout'),
     path('test-auth/', TestAuthView.as_view(), name='test_auth'),
     path('register/', RegisterView.as_view(), name='register'),
     path('all-users/', AllUsersView.as_view(), name='all-users'),
     path('search/users/', UserSearchView.as_view(), name='user-search'),
+    path('search/posts/', PostSearchView.as_view(), name='post-search'),
+    path('cache/stats/', CacheStatsView.as_view(), name='cache-stats'),
+    path('_metrics', MetricsView.as_view(), name='metrics'),
     path('notifications/', NotificationListView.as_view(), name='notifications'),
     path('notifications/<int:notification_id>/read/', NotificationMarkReadView.as_view(), name='notification-mark-read'),
+    path('notifications/read/', NotificationBatchReadView.as_view(), name='notification-batch-read'),
     path('notifications/unread-count/', NotificationUnreadCountView.as_view(), name='notification-unread-count'),
     path('profile/', ProfileView.as_view(), name='profile'),
     path('follow/<int:user_id>/', FollowToggleView.as_view(), name='follow-toggle'),
+    path('follow/batch/', FollowBatchView.as_view(), name='follow-batch'),
+    path('suggestions/', SuggestionsView.as_view(), name='suggestions'),
+    path('users/<int:user_id>/followers/', FollowersListView.as_view(), name='followers-list'),
+    path('users/<int:user_id>/following/', FollowingListView.as_view(), name='following-list'),
     path('posts/', PostListCreateView.as_view(), name='posts'),
+    path('posts/trending/', TrendingView.as_view(), name='trending'),
     path('posts/<int:pk>/', PostDetailView.as_view(), name='post-detail'),
     path('posts/<int:post_id>/like/', LikeToggleView.as_view(), name='like-toggle'),
+    path('posts/likes/batch/', LikeBatchView.as_view(), name='like-batch'),
     path('posts/<int:post_id>/comments/', CommentListCreateView.as_view(), name='comment-list-create'),
     path('posts/<int:post_id>/comments/<int:pk>/', CommentDetailView.as_view(), name='comment-detail'),
     path('feed/', FeedView.as_view(), name='feed'),
+    path('tags/<str:tag>/', TagTimelineView.as_view(), name='tag-timeline'),
+    path('places/', PlaceAutocompleteView.as_view(), name='place-autocomplete'),
+    path('places/nearby/', PlaceNearbyView.as_view(), name='place-nearby'),
+    path('places/<int:place_id>/posts/', PlaceTimelineView.as_view(), name='place-timeline'),
+    path('uploads/', UploadCreateView.as_view(), name='upload-create'),
+    path('uploads/<uuid:upload_id>/', UploadDetailView.as_view(), name='upload-detail'),
+    path('uploads/<uuid:upload_id>/finalize/', UploadFinalizeView.as_view(), name='upload-finalize'),
     path('conversations/', ConversationListView.as_view(), name='conversations'),
     path('conversations/create/', ConversationCreateView.as_view(), name='conversation-create'),
     path('conversations/<int:conversation_id>/', ConversationDetailView.as_view(), name='conversation-detail'),
     path('conversations/<int:conversation_id>/messages/', MessageCreateView.as_view(), name='message-create'),
     path('conversations/<int:conversation_id>/mark-read/', MessageMarkReadView.as_view(), name='message-mark-read'),
+    # Native async versions of the read-heavy endpoints, for the ASGI server
+    path('async/home/', async_views.home, name='async-home'),
+    path('async/feed/', async_views.feed, name='async-feed'),
+    path('async/posts/<int:pk>/', async_views.post_detail, name='async-post-detail'),
+    path('async/notifications/', async_views.notifications, name='async-notifications'),
+    path('async/conversations/', async_views.conversations, name='async-conversations'),
 ]
\ No newline at end of file
@@ -1,17 +1,43 @@
+import mimetypes
+import os
+from operator import attrgetter
+
 from django.shortcuts import get_object_or_404, render
-from django.db.models import Q
+from django.core.files.storage import default_storage
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from django.db import transaction
+from django.db.models import F, Q
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.views import APIView
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 from rest_framework import status
+from rest_framework_simplejwt.exceptions import TokenError
 from rest_framework_simplejwt.tokens import RefreshToken
-from rest_framework_simplejwt.views import TokenObtainPairView
+from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
-from .serializers import UserSerializer, UserListSerializer, UserProfileSerializer, PostSerializer, CommentSerializer, NotificationSerializer, ConversationSerializer, MessageSerializer
+from .serializers import UserSerializer, UserListSerializer, UserProfileSerializer, PostSerializer, CommentSerializer, NotificationSerializer, ConversationSerializer, MessageSerializer, UploadSessionSerializer
 from rest_framework.permissions import IsAdminUser, IsAuthenticatedOrReadOnly, IsAuthenticated
 from rest_framework.generics import ListAPIView, ListCreateAPIView, RetrieveUpdateDestroyAPIView
-from .models import User, Follow, Post, Like, Comment, Notification, Conversation, Message
+from .models import User, Follow, Post, Like, Comment, Notification, Conversation, Message, UploadSession, Tag
 from rest_framework.exceptions import PermissionDenied
+from .feed import fan_out_post, get_feed_queryset
+from .counters import adjust
+from .search import get_backend, ranked
+from .messaging import send_message, mark_read
+from .notifications import notify
+from .relations import follow, like, unfollow, unlike
+from .batch import BATCH_MAX_OPERATIONS, apply_follows, apply_likes, mark_notifications_read
+from .authentication import RevocableTokenRefreshSerializer, revoke
+from . import caching, instrumentation, media, uploads
+from .graph import graph
+from .trending import trending
+from .tags import index_post, normalize_tag
+from .places import MAX_NEARBY_RADIUS_KM, count_post, place_index, resolve_place
+from .pagination import FeedPagination, CommentPagination, NotificationPagination, ConversationPagination, FollowPagination, UserPagination, TagPagination, PlacePagination
 
     
 # Create your views here.
@@ -43,6 +69,7 @@ class AllUsersView(ListAPIView):
     queryset = User.objects.all()
     serializer_class = UserListSerializer
     permission_classes = [IsAdminUser]
+    pagination_class = UserPagination
 
 class MyTokenObtainPairSerializer(TokenObtainPairSerializer):
     @classmethod
@@ -57,74 +84,210 @@ class MyTokenObtainPairSerializer(TokenObtainPairSerializer):
 class MyTokenObtainPairView(TokenObtainPairView):
     serializer_class = MyTokenObtainPairSerializer
 
+class RevocableTokenRefreshView(TokenRefreshView):
+    serializer_class = RevocableTokenRefreshSerializer
+
+class LogoutView(APIView):
+    # Revokes the access token of this request and, if sent, the refresh token
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        revoke(request.auth)
+        raw_refresh = request.data.get('refresh')
+        if raw_refresh:
+            try:
+                refresh = RefreshToken(raw_refresh)
+            except TokenError:
+                return Response({"error": "Invalid refresh token."}, status=status.HTTP_400_BAD_REQUEST)
+            if str(refresh.get('user_id')) != str(request.user.id):
+                return Response({"error": "Invalid refresh token."}, status=status.HTTP_400_BAD_REQUEST)
+            revoke(refresh)
+        return Response({"message": "Logged out"})
+
 class ProfileView(APIView):
     permission_classes = [IsAuthenticated]
 
+    # request.user may come from the authentication cache with stale
+    # counters, so profiles are always read from and written to a fresh row
     def get(self, request):
-        serializer = UserProfileSerializer(request.user)
-        return Response(serializer.data)
+        return Response(profile_data(request.user.id))
 
     def put(self, request):
-        serializer = UserProfileSerializer(request.user, data=request.data)
-        if serializer.is_valid():
-            serializer.save()
-            return Response(serializer.data)
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        return self.update(request, partial=False)
 
     def patch(self, request):
-        serializer = UserProfileSerializer(request.user, data=request.data, partial=True)
+        return self.update(request, partial=True)
+
+    def update(self, request, partial):
+        serializer = UserProfileSerializer(User.objects.get(id=request.user.id), data=request.data, partial=partial)
         if serializer.is_valid():
             serializer.save()
             return Response(serializer.data)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+def profile_data(user_id):
+    return caching.get_or_set(
+        'profile', caching.object_scope(User, user_id), lambda: UserProfileSerializer(User.objects.get(id=user_id)).data,
+    )
+
 class FollowToggleView(APIView):
+    # PUT follows and DELETE unfollows, both idempotent; POST toggles
     permission_classes = [IsAuthenticated]
 
-    def post(self, request, user_id):
+    def get_target(self, request, user_id):
         try:
             target_user = User.objects.get(id=user_id)
         except User.DoesNotExist:
-            return Response({"error": "User not found."}, status=status.HTTP_404_NOT_FOUND)
-
+            return None, Response({"error": "User not found."}, status=status.HTTP_404_NOT_FOUND)
         if target_user == request.user:
-            return Response({"error": "You cannot follow yourself."}, status=status.HTTP_400_BAD_REQUEST)
+            return None, Response({"error": "You cannot follow yourself."}, status=status.HTTP_400_BAD_REQUEST)
+        return target_user, None
+
+    def put(self, request, user_id):
+        target_user, error = self.get_target(request, user_id)
+        if error:
+            return error
+        changed = follow(request.user, target_user)
+        return Response({"following": True, "changed": changed})
+
+    def delete(self, request, user_id):
+        target_user, error = self.get_target(request, user_id)
+        if error:
+            return error
+        changed = unfollow(request.user, target_user)
+        return Response({"following": False, "changed": changed})
 
-        follow_relation = Follow.objects.filter(follower=request.user, following=target_user).first()
-
-        if follow_relation:
-            follow_relation.delete()
+    def post(self, request, user_id):
+        target_user, error = self.get_target(request, user_id)
+        if error:
+            return error
+        if unfollow(request.user, target_user):
             return Response({"message": f"You have unfollowed @{target_user.username}"})
-        else:
-            Follow.objects.create(follower=request.user, following=target_user)
-            # Create notification for followed user
-            Notification.objects.create(
-                recipient=target_user,
-                actor=request.user,
-                notification_type='follow'
+        follow(request.user, target_user)
+        return Response({"message": f"You are now following @{target_user.username}"})
+
+def parse_operations(request, key, actions):
+    # Validates {"operations": [{key: id, "action": ...}, ...]}; returns
+    # ([(id, action)], None) or (None, error response)
+    operations = request.data.get('operations')
+    if not isinstance(operations, list) or not operations:
+        return None, Response({"error": "operations must be a non-empty list."}, status=status.HTTP_400_BAD_REQUEST)
+    if len(operations) > BATCH_MAX_OPERATIONS:
+        return None, Response({"error": f"At most {BATCH_MAX_OPERATIONS} operations per request."}, status=status.HTTP_400_BAD_REQUEST)
+    parsed = []
+    for index, operation in enumerate(operations):
+        target_id = operation.get(key) if isinstance(operation, dict) else None
+        action = operation.get('action') if isinstance(operation, dict) else None
+        if not isinstance(target_id, int) or isinstance(target_id, bool) or action not in actions:
+            return None, Response(
+                {"error": f"operations[{index}] must have an integer {key} and an action of {', '.join(actions)}."},
+                status=status.HTTP_400_BAD_REQUEST,
             )
-            return Response({"message": f"You are now following @{target_user.username}"})
+        parsed.append((target_id, action))
+    return parsed, None
+
+class FollowBatchView(APIView):
+    # Follows and unfollows many users in one transaction, e.g. a contact import
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        operations, error = parse_operations(request, 'user_id', ('follow', 'unfollow'))
+        if error:
+            return error
+        return Response({"results": apply_follows(request.user, operations)})
+
+class SuggestionsView(APIView):
+    # Who to follow: friends of friends and followers not followed back
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        suggestions = graph.suggest(request.user.id, limit=query_limit(request, 20, 100))
+        users = {user['id']: user for user in cached_users(request, [user_id for user_id, mutual, follows_you in suggestions])}
+        results = [
+            {**users[user_id], 'mutual_count': mutual, 'follows_you': follows_you}
+            for user_id, mutual, follows_you in suggestions
+            if user_id in users
+        ]
+        return Response({"results": results})
 
  # to view who a user is following 
 class FollowingListView(ListAPIView):
     serializer_class = UserListSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = FollowPagination
 
     def get_queryset(self):
         user_id = self.kwargs['user_id']
         user = get_object_or_404(User, id=user_id)
-        return User.objects.filter(followers__follower=user)
+        return Follow.objects.filter(follower=user).only('id', 'created_at', 'following_id')
+
+    def list(self, request, *args, **kwargs):
+        return cached_user_page(self, f"following:{self.kwargs['user_id']}", attrgetter('following_id'))
 
 
 # to view a user's followers
 class FollowersListView(ListAPIView):
     serializer_class = UserListSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = FollowPagination
 
     def get_queryset(self):
         user_id = self.kwargs['user_id']
         user = get_object_or_404(User, id=user_id)
-        return User.objects.filter(following__following=user)
+        return Follow.objects.filter(following=user).only('id', 'created_at', 'follower_id')
+
+    def list(self, request, *args, **kwargs):
+        return cached_user_page(self, f"followers:{self.kwargs['user_id']}", attrgetter('follower_id'))
+
+def cached_page(view, namespace, scope, row_id=attrgetter('id')):
+    # Ids and links of one page, cached per URL until the scope is invalidated
+    def load():
+        rows = view.paginate_queryset(view.filter_queryset(view.get_queryset()))
+        return {
+            'ids': [row_id(row) for row in rows],
+            'next': view.paginator.get_next_link(),
+            'previous': view.paginator.get_previous_link(),
+        }
+
+    variant = caching.variant_key(view.request.build_absolute_uri())
+    return caching.get_or_set(namespace, scope, load, variant=variant)
+
+def cached_user_page(view, scope, row_id=attrgetter('id')):
+    page = cached_page(view, 'user-page', scope, row_id)
+    return Response({'next': page['next'], 'previous': page['previous'], 'results': cached_users(view.request, page['ids'])})
+
+def cached_users(request, ids):
+    def load(scopes):
+        users = User.objects.filter(id__in=[scope_ids[scope] for scope in scopes])
+        return {caching.object_scope(User, user.id): UserListSerializer(user, context={'request': request}).data for user in users}
+
+    scope_ids = {caching.object_scope(User, user_id): user_id for user_id in ids}
+    variant = caching.variant_key(request.build_absolute_uri('/'))
+    found = caching.get_many('user-list', list(scope_ids), load, variant=variant)
+    return [found[scope] for scope in scope_ids if scope in found]
+
+def cached_posts(request, ids):
+    # Posts are cached without viewer state; the viewer's likes are laid over
+    # them with one query
+    def load(scopes):
+        posts = Post.objects.with_feed_annotations().filter(id__in=[scope_ids[scope] for scope in scopes])
+        return {caching.object_scope(Post, post.id): serialize_post(request, post) for post in posts}
+
+    scope_ids = {caching.object_scope(Post, post_id): post_id for post_id in ids}
+    variant = caching.variant_key(request.build_absolute_uri('/'))
+    found = caching.get_many('post', list(scope_ids), load, variant=variant)
+    return with_viewer_likes(request, [found[scope] for scope in scope_ids if scope in found])
+
+def serialize_post(request, post):
+    data = dict(PostSerializer(post, context={'request': request}).data)
+    data.pop('user_has_liked')
+    return data
+
+def with_viewer_likes(request, posts):
+    liked = set()
+    if request.user.is_authenticated and posts:
+        liked = set(Like.objects.filter(user=request.user, post_id__in=[post['id'] for post in posts]).values_list('post_id', flat=True))
+    return [dict(post, user_has_liked=post['id'] in liked) for post in posts]
     
 class PostListCreateView(ListCreateAPIView):
     queryset = Post.objects.all().order_by('-created_at')
@@ -132,62 +295,148 @@ class PostListCreateView(ListCreateAPIView):
     permission_classes = [IsAuthenticatedOrReadOnly]
 
     def get_queryset(self):
-        queryset = Post.objects.all().order_by('-created_at')
-        
-        # Filter by author username
-        author = self.request.query_params.get('author', None)
-        if author:
-            queryset = queryset.filter(author__username__icontains=author)
-        
-        # Filter by content
-        content = self.request.query_params.get('content', None)
-        if content:
-            queryset = queryset.filter(content__icontains=content)
-        
-        # Filter by location
-        location = self.request.query_params.get('location', None)
-        if location:
-            queryset = queryset.filter(location__icontains=location)
-        
+        # Only ids are read here; list() fills the posts in from the cache
+        queryset = Post.objects.order_by('-created_at')
+        search = get_backend()
+
+        # Filter by author username, content and location through the search index
+        for column in ('author', 'content', 'location'):
+            value = self.request.query_params.get(column, None)
+            if value:
+                queryset = search.filter_posts(queryset, value, column)
+
         return queryset
 
+    def list(self, request, *args, **kwargs):
+        page = cached_page(self, 'post-page', 'posts')
+        return Response({'next': page['next'], 'previous': page['previous'], 'results': cached_posts(request, page['ids'])})
+
     def perform_create(self, serializer):
-        serializer.save(author=self.request.user)
+        create_post(serializer, self.request.user)
+
+class TrendingView(APIView):
+    # Hottest posts by time-decayed likes, comments and recency, optionally in one ?location=
+    permission_classes = [IsAuthenticatedOrReadOnly]
+
+    def get(self, request):
+        try:
+            offset = max(0, int(request.query_params.get('offset', 0)))
+        except ValueError:
+            offset = 0
+        ranked = trending.top(request.query_params.get('location'), offset, query_limit(request, 20, 100))
+        posts = {post['id']: post for post in cached_posts(request, [post_id for post_id, score in ranked])}
+        results = [dict(posts[post_id], trending_score=round(score, 4)) for post_id, score in ranked if post_id in posts]
+        return Response({"results": results})
+
+class TagTimelineView(ListAPIView):
+    # Posts with a hashtag, newest first, paged over the (tag, created_at) index
+    permission_classes = [IsAuthenticatedOrReadOnly]
+    pagination_class = TagPagination
+
+    def get_queryset(self):
+        return Tag.objects.filter(name=normalize_tag(self.kwargs['tag'])).only('id', 'post_id', 'created_at')
+
+    def list(self, request, *args, **kwargs):
+        rows = self.paginate_queryset(self.get_queryset())
+        return self.get_paginated_response(cached_posts(request, [row.post_id for row in rows]))
+
+def coordinates(serializer):
+    return serializer.validated_data.get('latitude'), serializer.validated_data.get('longitude')
+
+class PlaceAutocompleteView(APIView):
+    # Places with a word starting with ?q=, most posts first; served from memory
+    permission_classes = [IsAuthenticatedOrReadOnly]
+
+    def get(self, request):
+        return Response({"results": place_index.autocomplete(request.query_params.get('q', ''), query_limit(request, 10, 50))})
+
+class PlaceNearbyView(APIView):
+    # Places within ?radius= km (default 10) of ?lat= and ?lon=, nearest first; served from memory
+    permission_classes = [IsAuthenticatedOrReadOnly]
+
+    def get(self, request):
+        try:
+            latitude = float(request.query_params['lat'])
+            longitude = float(request.query_params['lon'])
+            radius = float(request.query_params.get('radius', 10))
+        except (KeyError, ValueError):
+            return Response({"error": "lat and lon are required and must be numbers."}, status=status.HTTP_400_BAD_REQUEST)
+        if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+            return Response({"error": "lat or lon out of range."}, status=status.HTTP_400_BAD_REQUEST)
+        if not 0 < radius <= MAX_NEARBY_RADIUS_KM:
+            return Response({"error": f"radius must be between 0 and {MAX_NEARBY_RADIUS_KM} km."}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({"results": place_index.nearby(latitude, longitude, radius, query_limit(request, 20, 100))})
+
+class PlaceTimelineView(ListAPIView):
+    # Posts at a place, newest first, paged over the (place, created_at) index
+    permission_classes = [IsAuthenticatedOrReadOnly]
+    pagination_class = PlacePagination
+
+    def get_queryset(self):
+        return Post.objects.filter(place_id=self.kwargs['place_id'])
+
+    def list(self, request, *args, **kwargs):
+        page = cached_page(self, 'place-page', 'posts')
+        return Response({'next': page['next'], 'previous': page['previous'], 'results': cached_posts(request, page['ids'])})
+
+def create_post(serializer, author, **extra):
+    with transaction.atomic():
+        place = resolve_place(serializer.validated_data.get('location'), *coordinates(serializer))
+        post = serializer.save(author=author, place=place, **extra)
+        adjust(User, author.id, posts_count=1)
+        count_post(post.place_id, 1)
+        index_post(post)
+    fan_out_post(post)
+    return post
 
 class FeedView(ListAPIView):
     serializer_class = PostSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = FeedPagination
 
     def get_queryset(self):
-        # to get users that the current user is following
-        following_users = self.request.user.following.values_list('following_id', flat=True)
-        return Post.objects.filter(author__id__in=following_users).order_by('-created_at')
+        # precomputed timeline of the users the current user is following
+        return get_feed_queryset(self.request.user).with_feed_annotations(self.request.user)
 
 class LikeToggleView(APIView):
+    # PUT likes and DELETE unlikes, both idempotent; POST toggles
     permission_classes = [IsAuthenticated]
 
-    def post(self, request, post_id):
-        try:
-            post = Post.objects.get(id=post_id)
-        except Post.DoesNotExist:
+    def get_post(self, post_id):
+        return Post.objects.only('id', 'author_id').filter(id=post_id).first()
+
+    def put(self, request, post_id):
+        post = self.get_post(post_id)
+        if post is None:
             return Response({"error": "Post not found."}, status=status.HTTP_404_NOT_FOUND)
+        changed = like(request.user, post)
+        return Response({"liked": True, "changed": changed})
 
-        like_relation = Like.objects.filter(user=request.user, post=post).first()
+    def delete(self, request, post_id):
+        post = self.get_post(post_id)
+        if post is None:
+            return Response({"error": "Post not found."}, status=status.HTTP_404_NOT_FOUND)
+        changed = unlike(request.user, post)
+        return Response({"liked": False, "changed": changed})
 
-        if like_relation:
-            like_relation.delete()
+    def post(self, request, post_id):
+        post = self.get_post(post_id)
+        if post is None:
+            return Response({"error": "Post not found."}, status=status.HTTP_404_NOT_FOUND)
+        if unlike(request.user, post):
             return Response({"message": "Post unliked", "liked": False})
-        else:
-            Like.objects.create(user=request.user, post=post)
-            # Create notification for post author if not liking their own post
-            if post.author != request.user:
-                Notification.objects.create(
-                    recipient=post.author,
-                    actor=request.user,
-                    notification_type='like',
-                    post=post
-                )
-            return Response({"message": "Post liked", "liked": True})
+        like(request.user, post)
+        return Response({"message": "Post liked", "liked": True})
+
+class LikeBatchView(APIView):
+    # Likes and unlikes many posts in one transaction
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        operations, error = parse_operations(request, 'post_id', ('like', 'unlike'))
+        if error:
+            return error
+        return Response({"results": apply_likes(request.user, operations)})
 
 class PostDetailView(RetrieveUpdateDestroyAPIView):
     queryset = Post.objects.all()
@@ -195,23 +444,54 @@ class PostDetailView(RetrieveUpdateDestroyAPIView):
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        return Post.objects.all()
+        return Post.objects.with_feed_annotations(self.request.user)
+
+    def retrieve(self, request, *args, **kwargs):
+        # Served from the cache; only one request reloads a popular post after it changes
+        post_id = self.kwargs['pk']
+
+        def load():
+            post = Post.objects.with_feed_annotations().filter(id=post_id).first()
+            return serialize_post(request, post) if post is not None else None
+
+        variant = caching.variant_key(request.build_absolute_uri('/'))
+        data = caching.get_or_set('post', caching.object_scope(Post, post_id), load, variant=variant)
+        if data is None:
+            raise Http404
+        return Response(with_viewer_likes(request, [data])[0])
 
     def perform_update(self, serializer):
         # Only allow the author to update their own posts
         if serializer.instance.author != self.request.user:
             raise PermissionDenied("You can only edit your own posts.")
-        serializer.save()
+        previous = serializer.instance.content
+        previous_place = serializer.instance.place_id
+        with transaction.atomic():
+            changes = {}
+            if 'location' in serializer.validated_data or 'latitude' in serializer.validated_data:
+                location = serializer.validated_data.get('location', serializer.instance.location)
+                changes['place'] = resolve_place(location, *coordinates(serializer))
+            post = serializer.save(**changes)
+            if post.place_id != previous_place:
+                count_post(previous_place, -1)
+                count_post(post.place_id, 1)
+            # Only the tags and mentions that were added or removed are written
+            if post.content != previous:
+                index_post(post)
 
     def perform_destroy(self, instance):
         # Only allow the author to delete their own posts
         if instance.author != self.request.user:
             raise PermissionDenied("You can only delete your own posts.")
-        instance.delete()
+        with transaction.atomic():
+            instance.delete()
+            adjust(User, instance.author_id, posts_count=-1)
+            count_post(instance.place_id, -1)
 
 class CommentListCreateView(ListCreateAPIView):
     serializer_class = CommentSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = CommentPagination
 
     def get_queryset(self):
         post_id = self.kwargs['post_id']
@@ -220,16 +500,12 @@ class CommentListCreateView(ListCreateAPIView):
     def perform_create(self, serializer):
         post_id = self.kwargs['post_id']
         post = get_object_or_404(Post, id=post_id)
-        comment = serializer.save(author=self.request.user, post=post)
+        with transaction.atomic():
+            comment = serializer.save(author=self.request.user, post=post)
+            adjust(Post, post.id, comments_count=1)
         # Create notification for post author if not commenting on own post
         if post.author != self.request.user:
-            Notification.objects.create(
-                recipient=post.author,
-                actor=self.request.user,
-                notification_type='comment',
-                post=post,
-                comment=comment
-            )
+            notify(post.author, self.request.user, 'comment', post=post, comment=comment)
 
 class CommentDetailView(RetrieveUpdateDestroyAPIView):
     serializer_class = CommentSerializer
@@ -248,26 +524,73 @@ class CommentDetailView(RetrieveUpdateDestroyAPIView):
         # Only allow the author to delete their own comments
         if instance.author != self.request.user:
             raise PermissionDenied("You can only delete your own comments.")
-        instance.delete()
+        with transaction.atomic():
+            instance.delete()
+            adjust(Post, instance.post_id, comments_count=-1)
 
 class UserSearchView(ListAPIView):
+    # Ranked username/email prefix search, suitable for typeahead
     serializer_class = UserListSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = None
+    default_limit = 20
+    max_limit = 50
 
     def get_queryset(self):
         query = self.request.query_params.get('q', '')
         if query:
-            return User.objects.filter(
-                Q(username__icontains=query) | Q(email__icontains=query)
-            ).exclude(id=self.request.user.id)
+            limit = query_limit(self.request, self.default_limit, self.max_limit)
+            ids = get_backend().rank_users(query, limit + 1)
+            ids = [user_id for user_id in ids if user_id != self.request.user.id][:limit]
+            return ranked(User.objects.all(), ids)
         return User.objects.none()
 
+class PostSearchView(ListAPIView):
+    # Posts ranked by relevance across content, author and location
+    serializer_class = PostSerializer
+    permission_classes = [IsAuthenticatedOrReadOnly]
+    pagination_class = None
+    default_limit = 20
+    max_limit = 50
+
+    def get_queryset(self):
+        query = self.request.query_params.get('q', '')
+        if query:
+            limit = query_limit(self.request, self.default_limit, self.max_limit)
+            ids = get_backend().rank_posts(query, limit)
+            return ranked(Post.objects.with_feed_annotations(self.request.user), ids)
+        return Post.objects.none()
+
+def query_limit(request, default, maximum):
+    try:
+        limit = int(request.query_params.get('limit', default))
+    except ValueError:
+        return default
+    return max(1, min(limit, maximum))
+
+class CacheStatsView(APIView):
+    # Hit/miss counts of the response cache in this process
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(caching.stats.snapshot())
+
+class MetricsView(APIView):
+    # Per-view request metrics in Prometheus text format; ?format=json adds the
+    # recent N+1 reports with their stacks and any sampled profiles
+    permission_classes = [IsAdminUser]
+    renderer_classes = [instrumentation.PrometheusRenderer, JSONRenderer]
+
+    def get(self, request):
+        return Response({'metrics': instrumentation.registry.snapshot(), 'cache': caching.stats.snapshot()})
+
 class NotificationListView(ListAPIView):
     serializer_class = NotificationSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = NotificationPagination
 
     def get_queryset(self):
-        return Notification.objects.filter(recipient=self.request.user)
+        return Notification.objects.filter(recipient=self.request.user).select_related('actor')
 
 class NotificationMarkReadView(APIView):
     permission_classes = [IsAuthenticated]
@@ -281,6 +604,22 @@ class NotificationMarkReadView(APIView):
         except Notification.DoesNotExist:
             return Response({"error": "Notification not found."}, status=status.HTTP_404_NOT_FOUND)
 
+class NotificationBatchReadView(APIView):
+    # Marks the notifications in "ids", or all of them with {"all": true}, read
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        if request.data.get('all') is True:
+            updated, _ = mark_notifications_read(request.user)
+            return Response({"updated": updated})
+        ids = request.data.get('ids')
+        if not isinstance(ids, list) or not ids or not all(isinstance(i, int) and not isinstance(i, bool) for i in ids):
+            return Response({"error": "Send a non-empty list of notification ids, or all: true."}, status=status.HTTP_400_BAD_REQUEST)
+        if len(ids) > BATCH_MAX_OPERATIONS:
+            return Response({"error": f"At most {BATCH_MAX_OPERATIONS} ids per request."}, status=status.HTTP_400_BAD_REQUEST)
+        updated, results = mark_notifications_read(request.user, ids)
+        return Response({"updated": updated, "results": results})
+
 class NotificationUnreadCountView(APIView):
     permission_classes = [IsAuthenticated]
 
@@ -291,18 +630,61 @@ class NotificationUnreadCountView(APIView):
 class ConversationListView(ListAPIView):
     serializer_class = ConversationSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = ConversationPagination
 
     def get_queryset(self):
-        return Conversation.objects.filter(participants=self.request.user)
+        # the inbox renders in a constant number of queries
+        return (
+            Conversation.objects.filter(memberships__user=self.request.user)
+            .annotate(unread_count=F('memberships__unread_count'))
+            .select_related('last_message__sender')
+            .prefetch_related('participants')
+        )
 
 class ConversationDetailView(APIView):
+    # Message history in pages of `limit`, oldest first within a page:
+    #   no cursor       -> the newest messages
+    #   ?before_id=<id> -> older messages, for scrolling back
+    #   ?after_id=<id>  -> newer messages, for syncing the deltas since the last visit
     permission_classes = [IsAuthenticated]
+    default_limit = 50
+    max_limit = 200
 
     def get(self, request, conversation_id):
         conversation = get_object_or_404(Conversation, id=conversation_id, participants=request.user)
-        messages = conversation.messages.all()
-        serializer = MessageSerializer(messages, many=True)
-        return Response(serializer.data)
+        limit = query_limit(request, self.default_limit, self.max_limit)
+        messages = conversation.messages.select_related('sender')
+
+        before_id = request.query_params.get('before_id')
+        after_id = request.query_params.get('after_id')
+        if before_id and after_id:
+            return Response({"error": "Use either before_id or after_id, not both."}, status=status.HTTP_400_BAD_REQUEST)
+
+        anchor_id = after_id or before_id
+        if anchor_id:
+            if not anchor_id.isdigit():
+                return Response({"error": "before_id and after_id must be message ids."}, status=status.HTTP_400_BAD_REQUEST)
+            anchor = conversation.messages.filter(id=anchor_id).values_list('created_at', 'id').first()
+            if anchor is None:
+                return Response({"error": "Message not found."}, status=status.HTTP_404_NOT_FOUND)
+            created_at, message_id = anchor
+            if after_id:
+                messages = messages.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=message_id))
+            else:
+                messages = messages.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=message_id))
+
+        # Walk the (conversation, created_at, id) index from the anchor and fetch one extra row to detect more
+        if after_id:
+            page = list(messages.order_by('created_at', 'id')[:limit + 1])
+            has_more = len(page) > limit
+            page = page[:limit]
+        else:
+            page = list(messages.order_by('-created_at', '-id')[:limit + 1])
+            has_more = len(page) > limit
+            page = page[:limit][::-1]
+
+        serializer = MessageSerializer(page, many=True)
+        return Response({'results': serializer.data, 'has_more': has_more})
 
 class ConversationCreateView(APIView):
     permission_classes = [IsAuthenticated]
@@ -342,12 +724,8 @@ class MessageCreateView(APIView):
         if not content:
             return Response({"error": "content is required"}, status=status.HTTP_400_BAD_REQUEST)
 
-        message = Message.objects.create(
-            conversation=conversation,
-            sender=request.user,
-            content=content
-        )
-        
+        message = send_message(conversation, request.user, content)
+
         serializer = MessageSerializer(message)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
@@ -357,5 +735,155 @@ class MessageMarkReadView(APIView):
     def post(self, request, conversation_id):
         conversation = get_object_or_404(Conversation, id=conversation_id, participants=request.user)
         # Mark all unread messages in this conversation as read (except own messages)
-        conversation.messages.filter(is_read=False).exclude(sender=request.user).update(is_read=True)
-        return Response({"message": "Messages marked as read"})
\ No newline at end of file
+        mark_read(conversation, request.user)
+        return Response({"message": "Messages marked as read"})
+
+class UploadCreateView(APIView):
+    # Starts a resumable upload for a post video
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        serializer = UploadSessionSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        if serializer.validated_data['total_size'] > uploads.MAX_UPLOAD_SIZE:
+            return Response({"error": "File is too large."}, status=status.HTTP_400_BAD_REQUEST)
+
+        session = serializer.save(user=request.user)
+        uploads.start(session)
+        return Response(dict(serializer.data, max_chunk_size=uploads.MAX_CHUNK_SIZE), status=status.HTTP_201_CREATED)
+
+class UploadDetailView(APIView):
+    # GET reports the offset to resume from; PUT appends the chunk in the
+    # raw request body at ?offset= (or the Upload-Offset header)
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, upload_id):
+        session = get_object_or_404(UploadSession, id=upload_id, user=request.user)
+        return Response(UploadSessionSerializer(session).data)
+
+    def put(self, request, upload_id):
+        session = get_object_or_404(UploadSession, id=upload_id, user=request.user, status='active')
+        try:
+            offset = int(request.query_params.get('offset', request.headers.get('Upload-Offset', '')))
+            length = int(request.headers.get('Content-Length', ''))
+        except ValueError:
+            return Response({"error": "offset and Content-Length are required."}, status=status.HTTP_400_BAD_REQUEST)
+
+        if offset != session.received:
+            return Response({"error": "Offset does not match the uploaded size.", "offset": session.received}, status=status.HTTP_409_CONFLICT)
+        if length <= 0 or length > uploads.MAX_CHUNK_SIZE:
+            return Response({"error": f"Chunks must be between 1 and {uploads.MAX_CHUNK_SIZE} bytes."}, status=status.HTTP_400_BAD_REQUEST)
+        if offset + length > session.total_size:
+            return Response({"error": "Chunk runs past the declared file size."}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            received = uploads.write_chunk(session, request.stream, length, request.headers.get('X-Chunk-SHA256'))
+        except uploads.ChunkError as error:
+            return Response({"error": str(error), "offset": session.received}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Only advance from the offset this chunk was written at
+        if not UploadSession.objects.filter(id=session.id, received=offset).update(received=received, updated_at=timezone.now()):
+            session.refresh_from_db()
+            return Response({"error": "Concurrent upload to the same session.", "offset": session.received}, status=status.HTTP_409_CONFLICT)
+        session.received = received
+        return Response(UploadSessionSerializer(session).data)
+
+    def delete(self, request, upload_id):
+        session = get_object_or_404(UploadSession, id=upload_id, user=request.user, status='active')
+        uploads.discard(session)
+        session.delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+class UploadFinalizeView(APIView):
+    # Verifies the assembled file and publishes it as the video of a new post
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, upload_id):
+        # The session row is locked, so of two concurrent finalize calls the
+        # second only sees the session once it is complete and gets a 404
+        with transaction.atomic():
+            session = get_object_or_404(UploadSession.objects.select_for_update(), id=upload_id, user=request.user, status='active')
+            if session.received != session.total_size:
+                return Response({"error": "Upload is incomplete.", "offset": session.received}, status=status.HTTP_400_BAD_REQUEST)
+            if session.sha256 and uploads.file_sha256(uploads.part_path(session)) != session.sha256.lower():
+                return Response({"error": "File checksum mismatch."}, status=status.HTTP_400_BAD_REQUEST)
+
+            serializer = PostSerializer(data=request.data, context={'request': request})
+            if not serializer.is_valid():
+                return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+            video = uploads.assemble(session, Post._meta.get_field('video').upload_to)
+            post = create_post(serializer, request.user, video=video)
+            session.status = 'complete'
+            session.save(update_fields=['status', 'updated_at'])
+        return Response(PostSerializer(post, context={'request': request}).data, status=status.HTTP_201_CREATED)
+
+
+# Originals without a version parameter may still be replaced under the same name
+MEDIA_MAX_AGE = 3600
+MEDIA_IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+
+def serve_media(request, path):
+    # Media files with validators and byte ranges, so video seeking and repeat
+    # views do not download whole files again. FileResponse hands the open file
+    # to the server, which can use sendfile (wsgi.file_wrapper) for full responses.
+    path = path.lstrip('/')
+    if '\x00' in path or not path.startswith(media.SERVED_DIRS) or '..' in path.split('/'):
+        raise Http404
+    try:
+        full_path = default_storage.path(path)
+        stat = os.stat(full_path)
+    except (OSError, ValueError):
+        raise Http404
+    if not os.path.isfile(full_path):
+        raise Http404
+
+    etag = media.content_etag(path)
+    if etag is None and path.startswith(media.IMAGE_DIRS):
+        raise Http404
+    if etag is None:
+        etag = f'W/"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+    last_modified = http_date(stat.st_mtime)
+    immutable = media.RENDITION_PATH_RE.match(path) is not None or media.is_current_version(etag, request.GET.get(media.VERSION_PARAM))
+    if immutable:
+        cache_control = f'public, max-age={MEDIA_IMMUTABLE_MAX_AGE}, immutable'
+    else:
+        cache_control = f'public, max-age={MEDIA_MAX_AGE}'
+
+    def with_headers(response):
+        response['ETag'] = etag
+        response['Last-Modified'] = last_modified
+        response['Cache-Control'] = cache_control
+        response['Accept-Ranges'] = 'bytes'
+        return response
+
+    not_modified = get_conditional_response(request, etag=etag, last_modified=stat.st_mtime)
+    if not_modified is not None:
+        return with_headers(not_modified)
+
+    size = stat.st_size
+    byte_range = None
+    if request.method == 'GET' and 'HTTP_RANGE' in request.META:
+        # A stale If-Range means the client's partial copy is outdated: send everything
+        if_range = request.META.get('HTTP_IF_RANGE')
+        if if_range is None or if_range in (etag, last_modified) and not etag.startswith('W/'):
+            byte_range = media.parse_range(request.META['HTTP_RANGE'], size)
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return with_headers(response)
+
+    content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    file = open(full_path, 'rb')
+    if byte_range is None:
+        response = FileResponse(file, content_type=content_type)
+        response['Content-Length'] = size
+        return with_headers(response)
+
+    start, end = byte_range
+    response = FileResponse(media.RangeFile(file, start, end - start + 1), status=206, content_type=content_type)
+    response['Content-Length'] = end - start + 1
+    response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    return with_headers(response)